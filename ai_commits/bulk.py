@@ -0,0 +1,421 @@
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter, connect
+from common.diff_index import diff_sizes
+from common.diff_store import diff_sql
+from common.instrumentation import add_arguments, count, instrumented_from_args, timer
+from generate import (DEFAULT_EXECUTABLE, RateLimiter, create_ai_commits_table, generate_message, generator_config,
+                      insert_ai_commit, prepare_diff)
+from message_cache import DEFAULT_CACHE_PATH, MessageCache, cache_key
+from trim import DEFAULT_TOKEN_BUDGET, create_token_stats_table
+
+# Generation without the interactive loop, for batch backends or another machine:
+#   export  writes one job per commit without an AI message to size-bounded JSONL shards:
+#           {"hash": ..., "key": ..., "diff": <trimmed diff>, "config": {...}}
+#   run     is a local backend: it feeds job shards to adapted_turbocommit (or the stub) and
+#           records in results.json which job shard, by digest, each result shard answers
+#   ingest  loads result shards, {"hash": ..., "content": ...} or {"hash": ..., "error": ...},
+#           into ai_commits_one_shot in a single transaction. "key" is optional and, when
+#           echoed back, fills the message cache.
+
+DEFAULT_SHARD_BYTES = 50 * 2**20
+
+class ShardWriter:
+    # Rolls over to a new shard before a line would push it past max_bytes. Shards are written
+    # under a temporary name and renamed when complete, so a reader never sees half a shard.
+    def __init__(self, output_dir: str, prefix: str, max_bytes: int):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.shards: List[Dict] = []
+        self._file = None
+        self._digest = None
+        self._bytes = 0
+        self._lines = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _path(self, index: int) -> str:
+        return os.path.join(self.output_dir, f"{self.prefix}-{index:05d}.jsonl")
+
+    def _close_shard(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        path = self._path(len(self.shards))
+        os.replace(path + ".tmp", path)
+        self.shards.append({"file": os.path.basename(path), "lines": self._lines, "bytes": self._bytes,
+                            "sha256": self._digest.hexdigest()})
+        self._file = None
+
+    def write(self, record: Dict) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        # A single line larger than the bound still gets a shard of its own
+        if self._file is not None and self._bytes + len(line) > self.max_bytes:
+            self._close_shard()
+        if self._file is None:
+            self._file = open(self._path(len(self.shards)) + ".tmp", "wb")
+            self._digest = hashlib.sha256()
+            self._bytes = self._lines = 0
+        self._file.write(line)
+        self._digest.update(line)
+        self._bytes += len(line)
+        self._lines += 1
+
+    def close(self) -> None:
+        self._close_shard()
+
+def shard_paths(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl"))) if os.path.isdir(path) else [path])
+    return files
+
+def shard_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def require_executable(executable_path: str) -> None:
+    # The config digest and every job need the generator, so fail before doing any work
+    if not os.path.isfile(executable_path):
+        print(f"Generator not found: {executable_path}; build adapted_turbocommit or pass --executable", file=sys.stderr)
+        sys.exit(1)
+
+def job_problem(job: Dict) -> Optional[str]:
+    if not isinstance(job.get("hash"), str) or not job["hash"]:
+        return "missing hash"
+    if not isinstance(job.get("diff"), str):
+        return "missing diff"
+    if "key" in job and not isinstance(job["key"], str):
+        return "key is not a string"
+    return None
+
+def read_shard(path: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    # Yields (line number, record, problem); a line that is not a JSON object is a problem
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                yield line_number, None, f"invalid JSON ({error})"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "not a JSON object"
+                continue
+            yield line_number, record, None
+
+def export(database_path: str, output_dir: str, limit: Optional[int], shard_bytes: int, executable_path: str,
+           token_budget: int, cache: Optional[MessageCache], chunk_size: int = 500, report: Optional[Dict] = None) -> None:
+    require_executable(executable_path)
+    create_ai_commits_table(database_path)
+    config = generator_config(executable_path, token_budget)
+    connection = connect(database_path)
+    create_token_stats_table(connection)
+
+    # A separate read connection streams the commits while the writer stores the trim statistics
+    read_connection = sqlite3.connect(database_path)
+    diff, join = diff_sql(read_connection, "commits")
+    pending = "NOT EXISTS (SELECT 1 FROM ai_commits_one_shot WHERE ai_commits_one_shot.hash = commits.hash)"
+    total = read_connection.execute(f"SELECT COUNT(*) FROM commits WHERE {pending}").fetchone()[0]
+    total = min(total, limit) if limit is not None else total
+    cursor = read_connection.execute(f"""
+        SELECT commits.hash, {diff} FROM commits {join} WHERE {pending}
+        ORDER BY commits.rowid {'LIMIT ?' if limit is not None else ''}
+    """, (limit,) if limit is not None else ())
+
+    shards = ShardWriter(output_dir, "jobs", shard_bytes)
+    jobs = cached = skipped = 0
+    with BatchWriter(connection, batch_size=chunk_size) as writer, tqdm(total=total, desc="Exporting jobs", unit="commit") as progress_bar:
+        while True:
+            with timer("sqlite.fetch_chunk"):
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            sizes = diff_sizes(connection, [hash for hash, _ in rows]) if token_budget else {}
+            for hash, diff in rows:
+                diff = diff or ""
+                key = cache_key(diff, config)
+                content = cache.get(key) if cache is not None else None
+                if content is not None:
+                    # Already generated elsewhere; no need to send it out again
+                    count("message_cache.hits")
+                    insert_ai_commit(writer, hash, content)
+                    cached += 1
+                    continue
+                diff, skip_reason = prepare_diff(writer, hash, diff, sizes, token_budget)
+                if skip_reason is not None:
+                    skipped += 1
+                    continue
+                shards.write({"hash": hash, "key": key, "diff": diff, "config": config})
+                jobs += 1
+            progress_bar.update(len(rows))
+    shards.close()
+    read_connection.close()
+    connection.close()
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as file:
+        json.dump({"database": os.path.abspath(database_path), "created": time.time(), "config": config,
+                   "jobs": jobs, "shards": shards.shards}, file, indent=2)
+    print(f"Exported {jobs} jobs to {len(shards.shards)} shards in {output_dir}, {cached} commits filled from the message cache, "
+          f"{skipped} skipped (see diff_tokens.skipped)")
+    if report is not None:
+        report.update({"jobs": jobs, "shards": len(shards.shards), "cached": cached, "skipped": skipped})
+
+def load_job_shards(jobs_dir: str) -> Tuple[Optional[str], List[Tuple[str, Optional[str]]]]:
+    # The shards of the export in jobs_dir with their recorded digests, and the export's own
+    # digest; shards left over from an earlier, larger export are not listed in its manifest
+    manifest_path = os.path.join(jobs_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None, [(path, None) for path in shard_paths([jobs_dir]) if os.path.basename(path).startswith("jobs-")]
+    with open(manifest_path, "rb") as file:
+        data = file.read()
+    manifest = json.loads(data)
+    return hashlib.sha256(data).hexdigest(), [(os.path.join(jobs_dir, shard["file"]), shard.get("sha256")) for shard in manifest["shards"]]
+
+def write_json(path: str, value: Dict) -> None:
+    with open(path + ".tmp", "w") as file:
+        json.dump(value, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+def run(jobs_dir: str, results_dir: str, executable_path: str, concurrency: int, rate_limit: float, retries: int,
+        backoff: float, timeout: Optional[float], report: Optional[Dict] = None) -> None:
+    require_executable(executable_path)
+    os.makedirs(results_dir, exist_ok=True)
+    export_digest, job_shards = load_job_shards(jobs_dir)
+
+    # Shards whose results match their digest are skipped, so an interrupted run picks up where it
+    # stopped; results of any other export must not be mixed in and ingested for these jobs
+    state_path = os.path.join(results_dir, "results.json")
+    if os.path.exists(state_path):
+        with open(state_path, "r") as file:
+            state = json.load(file)
+        if state.get("export") != export_digest:
+            print(f"{results_dir} holds results of a different export; ingest them and use an empty directory", file=sys.stderr)
+            sys.exit(1)
+    elif glob.glob(os.path.join(results_dir, "results-*.jsonl")):
+        print(f"{results_dir} holds results of an unknown export; use an empty directory", file=sys.stderr)
+        sys.exit(1)
+    else:
+        state = {"export": export_digest, "shards": {}}
+
+    rate_limiter = RateLimiter(rate_limit)
+    generated = failed = calls = 0
+    for path, expected_digest in job_shards:
+        name = os.path.basename(path)
+        digest = shard_digest(path)
+        if expected_digest is not None and digest != expected_digest:
+            print(f"{name} does not match manifest.json; it changed or was not copied completely", file=sys.stderr)
+            sys.exit(1)
+        result_name = "results-" + name[len("jobs-"):]
+        result_path = os.path.join(results_dir, result_name)
+        done = state["shards"].get(name)
+        if done is not None and done["sha256"] == digest and os.path.exists(result_path):
+            continue
+
+        # Identical diffs within a shard are generated once; invalid jobs fail without a call
+        pending: Dict[str, Tuple[str, List[str]]] = {}
+        results = []
+        for line_number, job, problem in read_shard(path):
+            if problem is None:
+                problem = job_problem(job)
+            if problem is not None:
+                print(f"{name}:{line_number}: {problem}, failed", file=sys.stderr)
+                failed += 1
+                if job is not None and isinstance(job.get("hash"), str) and job["hash"]:
+                    results.append({"hash": job["hash"], "error": f"invalid job: {problem}"})
+                continue
+            key = job.get("key") or job["hash"]
+            if key in pending:
+                pending[key][1].append(job["hash"])
+            else:
+                pending[key] = (job["diff"], [job["hash"]])
+
+        with open(result_path + ".tmp", "w", encoding="utf-8") as file, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for result in results:
+                file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            futures = {pool.submit(generate_message, hashes[0], diff, executable_path, rate_limiter, retries, backoff, timeout): key
+                       for key, (diff, hashes) in pending.items()}
+            try:
+                for future in tqdm(as_completed(futures), total=len(futures), desc=name, unit="job"):
+                    key = futures[future]
+                    _, content, error = future.result()
+                    for hash in pending[key][1]:
+                        result = {"hash": hash, "key": key, "content": content} if content is not None else {"hash": hash, "key": key, "error": error}
+                        file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        if content is not None:
+                            generated += 1
+                        else:
+                            failed += 1
+            except KeyboardInterrupt:
+                # The unfinished shard stays a .tmp file and is generated again on the next run
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+        os.replace(result_path + ".tmp", result_path)
+        state["shards"][name] = {"sha256": digest, "results": result_name}
+        write_json(state_path, state)
+        calls += len(pending)
+    print(f"Generated {generated} messages, {failed} failed, with {calls} generator calls")
+    if report is not None:
+        report.update({"generated": generated, "failed": failed, "generator_calls": calls})
+
+MAX_PROBLEMS_SHOWN = 20
+
+def ingest(database_path: str, paths: List[str], replace: bool, skip_invalid: bool, cache: Optional[MessageCache],
+           chunk_size: int = 5000, report: Optional[Dict] = None) -> None:
+    create_ai_commits_table(database_path)
+    files = shard_paths(paths)
+    if not files:
+        print("No result shards found")
+        sys.exit(1)
+
+    connection = connect(database_path)
+    # Results are staged in a temporary table and checked with set operations, then applied in
+    # one transaction: either every valid result lands or, on a failed check, none does
+    connection.execute("CREATE TEMP TABLE bulk_results (hash TEXT, key TEXT, content TEXT, error TEXT, source TEXT)")
+    problems: List[str] = []
+    staged = 0
+    for path in files:
+        rows = []
+        for line_number, record, problem in read_shard(path):
+            source = f"{os.path.basename(path)}:{line_number}"
+            if problem is None:
+                hash, content, error = record.get("hash"), record.get("content"), record.get("error")
+                if not isinstance(hash, str) or not hash:
+                    problem = "missing hash"
+                elif content is None and error is None:
+                    problem = "neither content nor error"
+                elif content is not None and (not isinstance(content, str) or not content.strip()):
+                    problem = "empty content"
+            if problem is not None:
+                problems.append(f"{source}: {problem}")
+                continue
+            key = record.get("key") if isinstance(record.get("key"), str) else None
+            rows.append((hash, key, content, None if content is not None else str(error), source))
+            if len(rows) >= chunk_size:
+                connection.executemany("INSERT INTO bulk_results VALUES (?, ?, ?, ?, ?)", rows)
+                staged += len(rows)
+                rows = []
+        connection.executemany("INSERT INTO bulk_results VALUES (?, ?, ?, ?, ?)", rows)
+        staged += len(rows)
+
+    with timer("sqlite.validate_results"):
+        unknown = connection.execute("""
+            SELECT hash, source FROM bulk_results WHERE NOT EXISTS (SELECT 1 FROM commits WHERE commits.hash = bulk_results.hash)
+        """).fetchall()
+        conflicting = connection.execute("""
+            SELECT hash, GROUP_CONCAT(source, ', ') FROM bulk_results WHERE content IS NOT NULL
+            GROUP BY hash HAVING COUNT(DISTINCT content) > 1
+        """).fetchall()
+    problems += [f"{source}: unknown commit {hash}" for hash, source in unknown]
+    problems += [f"{sources}: different messages for {hash}" for hash, sources in conflicting]
+
+    if problems:
+        for problem in problems[:MAX_PROBLEMS_SHOWN]:
+            print(problem)
+        if len(problems) > MAX_PROBLEMS_SHOWN:
+            print(f"... and {len(problems) - MAX_PROBLEMS_SHOWN} more")
+        if not skip_invalid:
+            print(f"{len(problems)} invalid results; nothing was ingested (use --skip-invalid to load the rest)")
+            connection.close()
+            sys.exit(1)
+        connection.executemany("DELETE FROM bulk_results WHERE hash = ?", [(hash,) for hash, _ in unknown + conflicting])
+        staged = connection.execute("SELECT COUNT(*) FROM bulk_results").fetchone()[0]
+
+    with timer("sqlite.ingest_results"), connection:
+        new, unchanged, different = connection.execute("""
+            SELECT
+                SUM(ai_commits_one_shot.hash IS NULL),
+                SUM(ai_commits_one_shot.content = results.content),
+                SUM(ai_commits_one_shot.content IS NOT results.content AND ai_commits_one_shot.hash IS NOT NULL)
+            FROM (SELECT hash, MIN(content) AS content FROM bulk_results WHERE content IS NOT NULL GROUP BY hash) AS results
+            LEFT JOIN ai_commits_one_shot ON ai_commits_one_shot.hash = results.hash
+        """).fetchone()
+        # Loading the same shards twice changes nothing; messages generated earlier are only
+        # overwritten with --replace
+        connection.execute(f"""
+            INSERT INTO ai_commits_one_shot (hash, content)
+            SELECT hash, MIN(content) FROM bulk_results WHERE content IS NOT NULL GROUP BY hash
+            ON CONFLICT (hash) DO {'UPDATE SET content = excluded.content WHERE ai_commits_one_shot.content IS NOT excluded.content' if replace else 'NOTHING'}
+        """)
+    failures = connection.execute("""
+        SELECT hash, MIN(error) FROM bulk_results
+        WHERE error IS NOT NULL AND hash NOT IN (SELECT hash FROM bulk_results WHERE content IS NOT NULL)
+        AND hash NOT IN (SELECT hash FROM ai_commits_one_shot)
+        GROUP BY hash
+    """).fetchall()
+
+    if cache is not None:
+        cache.put_many(connection.execute("SELECT DISTINCT key, content FROM bulk_results WHERE key IS NOT NULL AND content IS NOT NULL"))
+    connection.close()
+
+    new, unchanged, different = new or 0, unchanged or 0, different or 0
+    print(f"Ingested {staged} results from {len(files)} shards: {new} new, {unchanged} unchanged, "
+          f"{different} {'replaced' if replace else 'kept (differing, use --replace)'}, {len(failures)} failed")
+    for hash, error in failures[:MAX_PROBLEMS_SHOWN]:
+        print(f"{hash}: {error}")
+    if report is not None:
+        report.update({"results": staged, "new": new, "unchanged": unchanged, "different": different,
+                       "failed": len(failures), "invalid": len(problems)})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate AI commit messages in bulk: export jobs, run them, ingest the results.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write commits without an AI message to JSONL job shards.')
+    export_parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    export_parser.add_argument('output_dir', type=str, help='Directory receiving the job shards and manifest.json.')
+    export_parser.add_argument('-n', '--limit', type=int, default=None, help='Export at most this many commits.')
+    export_parser.add_argument('--shard-bytes', type=int, default=DEFAULT_SHARD_BYTES, help='Maximum size of a shard in bytes.')
+    export_parser.add_argument('-b', '--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET, help='Trim diffs to this many tokens, 0 to disable.')
+    export_parser.add_argument('--executable', type=str, default=DEFAULT_EXECUTABLE, help='Generator whose digest goes into the job config.')
+
+    run_parser = subparsers.add_parser('run', help='Generate the messages of job shards locally.')
+    run_parser.add_argument('jobs_dir', type=str, help='Directory holding the job shards.')
+    run_parser.add_argument('results_dir', type=str, help='Directory receiving one result shard per job shard.')
+    run_parser.add_argument('--executable', type=str, default=DEFAULT_EXECUTABLE, help='Path to adapted_turbocommit or a compatible generator.')
+    run_parser.add_argument('-j', '--concurrency', type=int, default=4, help='Number of generator processes running at once.')
+    run_parser.add_argument('--rate-limit', type=float, default=0, help='Maximum generator calls per minute, 0 for no limit.')
+    run_parser.add_argument('--retries', type=int, default=3, help='Retries per job after a failed generator call.')
+    run_parser.add_argument('--backoff', type=float, default=2.0, help='Initial retry delay in seconds, doubled on each retry.')
+    run_parser.add_argument('--timeout', type=float, default=None, help='Seconds before a generator call is aborted.')
+
+    ingest_parser = subparsers.add_parser('ingest', help='Load result shards into ai_commits_one_shot.')
+    ingest_parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    ingest_parser.add_argument('results', type=str, nargs='+', help='Result shards, or directories of *.jsonl shards.')
+    ingest_parser.add_argument('--replace', action='store_true', help='Overwrite existing AI messages that differ.')
+    ingest_parser.add_argument('--skip-invalid', action='store_true', help='Load the valid results even if some are invalid.')
+
+    for subparser in (export_parser, ingest_parser):
+        subparser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH, help='Path to the generated message cache.')
+        subparser.add_argument('--cache-size', type=int, default=100000, help='Maximum number of cached messages.')
+        subparser.add_argument('--no-cache', action='store_true', help='Neither read nor fill the message cache.')
+    for subparser in (export_parser, run_parser, ingest_parser):
+        add_arguments(subparser)
+    args = parser.parse_args()
+
+    cache = None if args.command == 'run' or args.no_cache else MessageCache(args.cache, args.cache_size)
+    with instrumented_from_args(args) as report:
+        if args.command == 'export':
+            export(args.database, args.output_dir, args.limit, args.shard_bytes, args.executable, args.token_budget, cache, report=report)
+        elif args.command == 'run':
+            run(args.jobs_dir, args.results_dir, args.executable, args.concurrency, args.rate_limit, args.retries,
+                args.backoff, args.timeout, report)
+        else:
+            ingest(args.database, args.results, args.replace, args.skip_invalid, cache, report=report)
+    if cache is not None:
+        cache.close()
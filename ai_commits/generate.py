@@ -1,13 +1,30 @@
 import os
 import os.path
 import sys
+import time
+import random
 import sqlite3
-from typing import List, Tuple
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 import subprocess
 from pygments import highlight
 from pygments.lexers import DiffLexer
 from pygments.formatters import TerminalFormatter
-import click
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter, connect
+from common.diff_index import diff_sizes, hunk_tokens
+from common.diff_store import diff_sql
+from common.instrumentation import add_arguments, count, instrumented_from_args, timer
+from common.sampling import fetch_rows, sample_rowids
+from message_cache import DEFAULT_CACHE_PATH, MessageCache, cache_key, file_digest
+from trim import DEFAULT_TOKEN_BUDGET, TrimStats, create_token_stats_table, insert_token_stats, trim_diff
+
+DEFAULT_EXECUTABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "adapted_turbocommit")
 
 def create_ai_commits_table(database_path: str) -> None:
     connection = sqlite3.connect(database_path)
@@ -27,28 +44,18 @@ def display_diff(diff: str) -> None:
     pager.communicate(highlighted_diff)
     pager.wait()
 
-def get_commits(database_path: str, n: int) -> List[Tuple[str, str, str]]:
+def get_commits(database_path: str, n: int, seed: Optional[int] = None) -> List[Tuple[str, str, str]]:
     connection = sqlite3.connect(database_path)
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT hash, message, diff
+    rowids = sample_rowids(connection, """
+        SELECT rowid
         FROM commits
         WHERE hash NOT IN (SELECT hash FROM ai_commits_one_shot)
-        ORDER BY RANDOM()
-        LIMIT ?
-    """, (n,))
-    commits = cursor.fetchall()
+    """, n, seed)
+    diff, join = diff_sql(connection, "commits")
+    commits = fetch_rows(connection, f"SELECT commits.hash, commits.message, {diff} FROM commits {join} WHERE commits.rowid IN (SELECT id FROM sampled_rowids)", rowids)
     connection.close()
     return commits
 
-def ai_commit_exists(database_path: str, hash: str) -> bool:
-    connection = sqlite3.connect(database_path)
-    cursor = connection.cursor()
-    cursor.execute("SELECT COUNT(*) FROM ai_commits_one_shot WHERE hash = ?", (hash,))
-    count = cursor.fetchone()[0]
-    connection.close()
-    return count > 0
-
 def save_to_file(filename: str, content: str) -> None:
     with open(filename, "w") as file:
         file.write(content)
@@ -58,84 +65,191 @@ def read_file(filename: str) -> str:
         content = file.read()
     return content
 
-def delete_files(filepaths: List[str]) -> None:
-    for filepath in filepaths:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        else:
-            print(f"File '{filepath}' not found. Skipping deletion.")
-
-def call_turbocommit(extra_arg: str) -> int:
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    executable_path = os.path.join(script_dir, "adapted_turbocommit")
-    return os.system(f"{executable_path} -o {extra_arg}")
-
-def insert_ai_commit(database_path: str, hash: str, content: str) -> None:
-    connection = sqlite3.connect(database_path)
-    cursor = connection.cursor()
-    cursor.execute("INSERT INTO ai_commits_one_shot (hash, content) VALUES (?, ?)", (hash, content))
-    connection.commit()
-    connection.close()
-
-def delete_commit(database_path: str, hash: str) -> None:
-    connection = sqlite3.connect(database_path)
-    cursor = connection.cursor()
-    cursor.execute("DELETE FROM commits WHERE hash = ?", (hash,))
-    connection.commit()
-    connection.close()
-    print(f"Commit with hash {hash} deleted from the commits table")
-
-def main(database_path: str, n: int) -> None:
+# Spaces out the start of requests so at most `per_minute` are issued per minute
+# across all workers. A value of 0 disables the limit.
+class RateLimiter:
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+GENERATOR_ARGS = ["-o"]
+
+def generator_config(executable_path: str, token_budget: int) -> Dict:
+    # Prompt and model are compiled into the binary, so its digest stands in for them
+    return {"executable": file_digest(executable_path), "args": GENERATOR_ARGS, "token_budget": token_budget}
+
+def call_turbocommit(executable_path: str, work_dir: str, timeout: Optional[float]) -> Tuple[int, str]:
+    # adapted_turbocommit reads diff.txt and writes output.txt in its working directory
+    try:
+        with timer("turbocommit.subprocess"):
+            result = subprocess.run([executable_path] + GENERATOR_ARGS, cwd=work_dir, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        count("turbocommit.timeouts")
+        return -1, f"timed out after {timeout}s"
+    if result.returncode != 0:
+        count("turbocommit.failures")
+    return result.returncode, result.stdout.decode("utf-8", "replace").strip()
+
+def generate_message(hash: str, diff: str, executable_path: str, rate_limiter: RateLimiter,
+                     retries: int, backoff: float, timeout: Optional[float]) -> Tuple[str, Optional[str], Optional[str]]:
+    error = None
+    with tempfile.TemporaryDirectory(prefix="turbocommit_") as work_dir:
+        save_to_file(os.path.join(work_dir, "diff.txt"), diff)
+        count("turbocommit.diff_bytes", len(diff.encode("utf-8")))
+
+        for attempt in range(retries + 1):
+            if attempt:
+                # Exponential backoff with jitter so failing workers do not retry in lockstep
+                time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            with timer("turbocommit.rate_limit_wait"):
+                rate_limiter.wait()
+
+            exit_code, log = call_turbocommit(executable_path, work_dir, timeout)
+            output_path = os.path.join(work_dir, "output.txt")
+            if exit_code == 0 and os.path.exists(output_path):
+                return hash, read_file(output_path), None
+
+            last_line = log.splitlines()[-1] if log else ""
+            error = f"exit code {exit_code}: {last_line}"
+
+    return hash, None, error
+
+def prepare_diff(writer: BatchWriter, hash: str, diff: str, sizes: Dict[str, Tuple[int, int, int]],
+                 token_budget: int) -> Tuple[str, Optional[str]]:
+    # Returns the diff to send and, when there is nothing worth sending, why the commit is skipped
+    stats = None
+    # Oversized diffs would make adapted_turbocommit ask which files to keep
+    if token_budget and hash in sizes and sizes[hash][0] <= token_budget:
+        tokens, files, hunks = sizes[hash]
+        stats = TrimStats(tokens, tokens, files, files, hunks, hunks)
+    elif token_budget:
+        # Indexed diffs are trimmed with the stored hunk token counts instead of re-tokenizing
+        tokens = hunk_tokens(writer.conn, hash) if hash in sizes else None
+        with timer("trim_diff"):
+            diff, stats = trim_diff(diff, token_budget, tokens)
+    # An empty diff would only get a made-up message, which would then be cached
+    skipped = None
+    if not diff.strip():
+        skipped = "nothing fits the token budget" if stats is not None and stats.original_tokens else "empty diff"
+    if stats is not None:
+        insert_token_stats(writer, hash, token_budget, stats, skipped)
+    return diff, skipped
+
+def insert_ai_commit(writer: BatchWriter, hash: str, content: str) -> None:
+    writer.add("INSERT OR IGNORE INTO ai_commits_one_shot (hash, content) VALUES (?, ?)", (hash, content))
+
+def delete_commit(writer: BatchWriter, hash: str) -> None:
+    writer.add("DELETE FROM commits WHERE hash = ?", (hash,))
+
+def main(database_path: str, n: int, executable_path: str, concurrency: int, rate_limit: float,
+         retries: int, backoff: float, timeout: Optional[float], delete_failed: bool,
+         cache: Optional[MessageCache], seed: Optional[int], token_budget: int, report: Optional[Dict] = None) -> None:
     create_ai_commits_table(database_path)
-    commits = get_commits(database_path, n)
-
-    for hash, message, diff in commits:
-        if ai_commit_exists(database_path, hash):
-            print(f"AI commit already exists for hash {hash}")
-            continue
-
-        separator_line = "-" * 80
-        print(separator_line)
-        print(message)
-        print(separator_line)
-
-        # input("Press Enter to view the diff...")
-        # display_diff(diff)
-
-        while True:
-            # extra_arg = input("Enter an extra string for adapted_turbocommit: ")
-
-            print("Running adapted_turbocommit...")
-            save_to_file("diff.txt", diff)
-            # exit_code = call_turbocommit(extra_arg)
-            exit_code = call_turbocommit("")
-
-            if exit_code != 0:
-                print(f"adapted_turbocommit exited with non-zero code: {exit_code}")
-                retry = click.prompt("Do you want to retry, delete the commit, or skip? [R/d/s]", type=click.Choice(['r', 'd', 's'], case_sensitive=False), default='r', show_default=True)
-
-                if retry == 'r':
-                    continue
-                elif retry == 'd':
-                    delete_commit(database_path, hash)
-                    break
-                else:
-                    break
+    with timer("sqlite.sample_commits"):
+        commits = get_commits(database_path, n, seed)
+    rate_limiter = RateLimiter(rate_limit)
+    config = generator_config(executable_path, token_budget)
+    failed = skipped = 0
+
+    connection = connect(database_path)
+    create_token_stats_table(connection)
+    # Diffs the index already knows to fit the budget are not tokenized again
+    sizes = diff_sizes(connection, [hash for hash, _, _ in commits]) if token_budget else {}
+    with BatchWriter(connection, batch_size=50) as writer:
+        # Identical diffs are generated once and the message is shared by all their hashes
+        pending: Dict[str, Tuple[str, List[str]]] = {}
+        for hash, _, diff in commits:
+            key = cache_key(diff, config)
+            diff, skip_reason = prepare_diff(writer, hash, diff, sizes, token_budget)
+            if skip_reason is not None:
+                skipped += 1
+                tqdm.write(f"{hash}: {skip_reason}, skipped")
+                continue
+            if key in pending:
+                pending[key][1].append(hash)
+                continue
+            content = cache.get(key) if cache is not None else None
+            if content is not None:
+                count("message_cache.hits")
+                insert_ai_commit(writer, hash, content)
             else:
-                print("adapted_turbocommit finished. Saving AI commit...")
-                output = read_file("output.txt")
-                insert_ai_commit(database_path, hash, output)
-                print(f"AI commit saved for hash {hash}\n")
-                break
+                pending[key] = (diff, [hash])
+
+        # Workers only run the generator; this thread is the single writer draining their results
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(generate_message, hashes[0], diff, executable_path, rate_limiter, retries, backoff, timeout): key
+                       for key, (diff, hashes) in pending.items()}
+
+            try:
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Generating AI commits", unit="commit"):
+                    key = futures[future]
+                    hashes = pending[key][1]
+                    _, content, error = future.result()
+                    if content is not None:
+                        if cache is not None:
+                            cache.put(key, content)
+                        for hash in hashes:
+                            insert_ai_commit(writer, hash, content)
+                        continue
+
+                    failed += len(hashes)
+                    for hash in hashes:
+                        if delete_failed:
+                            delete_commit(writer, hash)
+                            tqdm.write(f"{hash}: {error}, deleted from the commits table")
+                        else:
+                            tqdm.write(f"{hash}: {error}, skipped")
+            except KeyboardInterrupt:
+                # Only the calls already running are waited for; the writer still flushes what finished
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
 
-        delete_files(["diff.txt", "output.txt"])
+    connection.close()
+    generated = len(commits) - failed - skipped
+    print(f"Generated {generated} AI commits, {failed} failed, {skipped} skipped")
+    if report is not None:
+        report.update({"commits": len(commits), "generated": generated, "failed": failed, "skipped": skipped,
+                       "generator_calls": len(pending)})
+    if cache is not None:
+        stats = cache.stats()
+        if report is not None:
+            report["message_cache"] = stats
+        print(f"Message cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+              f"{stats['evictions']} evictions, {stats['entries']} entries")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <database_path> <number_of_rows>")
-        sys.exit(1)
-
-    database_path = sys.argv[1]
-    n = int(sys.argv[2])
-
-    main(database_path, n)
+    parser = argparse.ArgumentParser(description='Generate AI commit messages for random commits in an SQLite database.')
+    parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    parser.add_argument('number_of_rows', type=int, help='Number of commits to generate messages for.')
+    parser.add_argument('-j', '--concurrency', type=int, default=4, help='Number of generator processes running at once.')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Maximum generator calls per minute, 0 for no limit.')
+    parser.add_argument('--retries', type=int, default=3, help='Retries per commit after a failed generator call.')
+    parser.add_argument('--backoff', type=float, default=2.0, help='Initial retry delay in seconds, doubled on each retry.')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before a generator call is aborted.')
+    parser.add_argument('--executable', type=str, default=DEFAULT_EXECUTABLE, help='Path to adapted_turbocommit or a compatible generator.')
+    parser.add_argument('--delete-failed', action='store_true', help='Delete commits from the commits table once all retries failed.')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH, help='Path to the generated message cache.')
+    parser.add_argument('--cache-size', type=int, default=100000, help='Maximum number of cached messages.')
+    parser.add_argument('-b', '--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET, help='Trim diffs to this many tokens before generating, 0 to disable.')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='Random seed for a reproducible selection of commits.')
+    parser.add_argument('--no-cache', action='store_true', help='Always run the generator, neither reading nor filling the cache.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else MessageCache(args.cache, args.cache_size)
+    with instrumented_from_args(args) as report:
+        main(args.database, args.number_of_rows, args.executable, args.concurrency, args.rate_limit,
+             args.retries, args.backoff, args.timeout, args.delete_failed, cache, args.seed, args.token_budget, report)
+    if cache is not None:
+        cache.close()
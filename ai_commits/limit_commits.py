@@ -1,13 +1,19 @@
+import os
 import sqlite3
-import random
 import sys
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.diff_store import has_column
+from common.sampling import STRATA, copy_rows, sample_table, stratified_sample
+
 # Parse the command line arguments
 parser = argparse.ArgumentParser(description='Select a random subset of commits from a SQLite database table.')
 parser.add_argument('database', help='the name of the SQLite database file')
 parser.add_argument('num_commits', type=int, help='the number of random commits to select')
 parser.add_argument('-r', '--reverse', action='store_true', help='reverse the changes made by this script')
+parser.add_argument('-s', '--seed', type=int, default=None, help='random seed for a reproducible selection')
+parser.add_argument('--stratify', type=str, default=None, help=f"sample proportionally per stratum: {', '.join(STRATA)} or an SQL expression over the commits")
 args = parser.parse_args()
 
 # Connect to the database
@@ -40,18 +46,25 @@ else:
     print("Renaming the 'commits' table to 'all_commits'...")
     c.execute("ALTER TABLE commits RENAME TO all_commits")
 
-    # Create a new 'commits' table
+    # Create a new 'commits' table, keeping the reference to compressed diffs if there is one
     print("Creating a new 'commits' table...")
-    c.execute("CREATE TABLE commits(hash TEXT PRIMARY KEY, message TEXT, diff TEXT)")
+    columns = ["hash", "message", "diff"]
+    if has_column(conn, "all_commits", "diff_hash"):
+        columns.append("diff_hash")
+        c.execute("CREATE TABLE commits(hash TEXT PRIMARY KEY, message TEXT, diff TEXT, diff_hash TEXT)")
+    else:
+        c.execute("CREATE TABLE commits(hash TEXT PRIMARY KEY, message TEXT, diff TEXT)")
 
-    # Get random rows from 'all_commits' table
+    # Pick random rowids from the 'all_commits' table without sorting or loading the rows
     print(f"Selecting {args.num_commits} random commits from the 'all_commits' table...")
-    c.execute(f"SELECT * FROM all_commits ORDER BY RANDOM() LIMIT {args.num_commits}")
-    rows = c.fetchall()
+    if args.stratify:
+        rowids = stratified_sample(conn, "all_commits", args.stratify, args.num_commits, args.seed)
+    else:
+        rowids = sample_table(conn, "all_commits", args.num_commits, args.seed)
 
-    # Insert the selected rows into the new 'commits' table
+    # Copy the selected rows into the new 'commits' table inside the database
     print("Inserting the selected rows into the new 'commits' table...")
-    c.executemany("INSERT INTO commits(hash, message, diff) VALUES (?, ?, ?)", rows)
+    copy_rows(conn, "all_commits", "commits", columns, rowids)
 
 # Commit the changes and close the connection
 print("Committing the changes and closing the connection...")
@@ -0,0 +1,160 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "turbocommit", "messages.db")
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+def normalize_diff(diff: str) -> str:
+    # A cherry-pick repeats a change with other blob ids and line offsets, so both are dropped
+    # before hashing. Paths and +/- lines are kept: a vendored copy touches other files and a
+    # revert is the opposite change, and neither should reuse the original message.
+    lines = []
+    for line in diff.replace("\r\n", "\n").split("\n"):
+        if line.startswith("index "):
+            continue
+        lines.append(HUNK_HEADER.sub("@@", line).rstrip())
+    return "\n".join(lines).strip("\n")
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(diff: str, config: Dict) -> str:
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_diff(diff).encode("utf-8", "replace"))
+    return digest.hexdigest()
+
+# Persistent, size-bounded LRU cache of generated messages keyed by cache_key()
+class MessageCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 100000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                key TEXT PRIMARY KEY,
+                content TEXT,
+                created REAL,
+                last_used REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_last_used ON messages (last_used)")
+        self.conn.commit()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT content FROM messages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.conn:
+            self.conn.execute("UPDATE messages SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, content: str) -> None:
+        now = time.time()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO messages (key, content, created, last_used) VALUES (?, ?, ?, ?)",
+                              (key, content, now, now))
+            self._evict()
+
+    def put_many(self, entries: Iterable[Tuple[str, str]]) -> int:
+        # One transaction and one eviction pass, for bulk loads
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.executemany("INSERT OR REPLACE INTO messages (key, content, created, last_used) VALUES (?, ?, ?, ?)",
+                                           ((key, content, now, now) for key, content in entries))
+            self._evict()
+        return cursor.rowcount
+
+    def _evict(self) -> None:
+        count = self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute("DELETE FROM messages WHERE key IN (SELECT key FROM messages ORDER BY last_used LIMIT ?)", (excess,))
+            self.evictions += excess
+
+    def stats(self) -> Dict:
+        entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "content_bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def export_jsonl(self, path: str) -> int:
+        count = 0
+        with open(path, "w") as file:
+            for key, content, created, last_used in self.conn.execute("SELECT key, content, created, last_used FROM messages ORDER BY last_used"):
+                file.write(json.dumps({"key": key, "content": content, "created": created, "last_used": last_used}) + "\n")
+                count += 1
+        return count
+
+    def import_jsonl(self, path: str) -> int:
+        count = 0
+        with open(path, "r") as file, self.conn:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                # Keep whichever side used the entry most recently
+                self.conn.execute("""
+                    INSERT INTO messages (key, content, created, last_used) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET last_used = MAX(last_used, excluded.last_used)
+                """, (entry["key"], entry["content"], entry.get("created", time.time()), entry.get("last_used", time.time())))
+                count += 1
+            self._evict()
+        return count
+
+    def clear(self) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM messages")
+
+    def close(self) -> None:
+        self.conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect, share and clear the generated commit message cache.')
+    parser.add_argument('command', choices=['stats', 'export', 'import', 'clear'], help='Action to perform.')
+    parser.add_argument('file', nargs='?', help='JSONL file to export to or import from.')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH, help='Path to the cache database.')
+    parser.add_argument('--cache-size', type=int, default=100000, help='Maximum number of cached messages.')
+    args = parser.parse_intermixed_args()
+
+    if args.command in ('export', 'import') and not args.file:
+        print(f"Usage: python message_cache.py {args.command} <file.jsonl>")
+        sys.exit(1)
+
+    cache = MessageCache(args.cache, args.cache_size)
+    if args.command == 'stats':
+        stats = cache.stats()
+        print(f"{stats['entries']} messages, {stats['content_bytes']} bytes")
+    elif args.command == 'export':
+        print(f"Exported {cache.export_jsonl(args.file)} messages to {args.file}")
+    elif args.command == 'import':
+        print(f"Imported {cache.import_jsonl(args.file)} messages from {args.file}")
+    else:
+        cache.clear()
+        print("Cleared the message cache.")
+    cache.close()
@@ -0,0 +1,180 @@
+import os
+import re
+import sys
+import sqlite3
+import argparse
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.diff_index import HUNK_HEADER, split_diff
+from common.diff_store import has_column
+from common.tokens import count_tokens, get_encoding
+
+DEFAULT_TOKEN_BUDGET = 3000
+
+TrimStats = namedtuple("TrimStats", ["original_tokens", "trimmed_tokens", "files_total", "files_kept", "hunks_total", "hunks_kept"])
+
+class Hunk:
+    def __init__(self, lines: List[str], tokens: Optional[int] = None):
+        self.lines = lines
+        self.text = "".join(lines)
+        self.tokens = count_tokens(self.text) if tokens is None else tokens
+        self.changes = sum(1 for line in lines[1:] if line[:1] in ("+", "-"))
+
+class FileDiff:
+    def __init__(self, header: List[str], hunks: List[Hunk], tokens: Optional[int] = None):
+        self.header = "".join(header)
+        self.hunks = hunks
+        self.tokens = count_tokens(self.header) if tokens is None else tokens
+        self.path = self._path(header)
+
+    @staticmethod
+    def _path(header: List[str]) -> str:
+        match = re.match(r"diff --git a/(.*) b/(.*)", header[0].rstrip("\n")) if header else None
+        return match.group(2) if match else ""
+
+def file_diffs(diff: str, tokens: Optional[List[Tuple[int, List[int]]]] = None) -> List[FileDiff]:
+    # `tokens` are the indexed counts from diff_index.hunk_tokens; they are only used
+    # while they describe the same files and hunks, otherwise everything is counted here
+    split = list(split_diff(diff))
+    if tokens is not None and [len(hunks) for _, hunks in split] != [len(counts) for _, counts in tokens]:
+        tokens = None
+    if tokens is None:
+        return [FileDiff(header, [Hunk(lines) for lines in hunks]) for header, hunks in split]
+    return [FileDiff(header, [Hunk(lines, count) for lines, count in zip(hunks, counts)], header_tokens)
+            for (header, hunks), (header_tokens, counts) in zip(split, tokens)]
+
+LOW_PRIORITY_NAMES = re.compile(r"(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|Cargo\.lock|poetry\.lock|Gemfile\.lock|go\.sum|composer\.lock)$")
+LOW_PRIORITY_PATHS = re.compile(r"(^|/)(vendor|node_modules|dist|build|third_party)/|\.min\.(js|css)$|\.(svg|map|snap)$")
+DOC_PATHS = re.compile(r"\.(md|rst|txt)$|(^|/)docs?/", re.IGNORECASE)
+TEST_PATHS = re.compile(r"(^|/)(tests?|__tests__|spec)/|(_test|\.test|\.spec|_spec)\.\w+$|(^|/)test_[^/]+$")
+
+def file_priority(path: str) -> int:
+    # Lower is more important: source, tests, docs, then lockfiles and generated files
+    if LOW_PRIORITY_NAMES.search(path) or LOW_PRIORITY_PATHS.search(path):
+        return 3
+    if DOC_PATHS.search(path):
+        return 2
+    if TEST_PATHS.search(path):
+        return 1
+    return 0
+
+def truncate_hunk(hunk: Hunk, budget: int) -> Optional[Hunk]:
+    # Keeps the lines that fit and rewrites the header so the hunk stays well-formed. The first
+    # change is always kept, even over the budget, so the result never shows context only: its
+    # first line and, for a replacement, the removed lines up to the first added one.
+    match = HUNK_HEADER.match(hunk.lines[0])
+    section = hunk.lines[0][match.end():].rstrip("\n")
+    lines = hunk.lines[1:]
+    first_change = next((index for index, line in enumerate(lines) if line[:1] in ("+", "-")), None)
+    if first_change is None:
+        return None
+    last_required = first_change
+    for index in range(first_change, len(lines)):
+        if lines[index][:1] not in ("+", "-", "\\"):
+            break
+        if lines[index][:1] == "+":
+            last_required = index
+            break
+    used = count_tokens(hunk.lines[0])
+    # Leading context that would crowd out the first change is dropped
+    skip = first_change if used + sum(count_tokens(line) for line in lines[:last_required + 1]) > budget else 0
+    kept = []
+    for line in lines[skip:]:
+        tokens = count_tokens(line)
+        if used + tokens > budget and len(kept) > last_required - skip:
+            break
+        kept.append(line)
+        used += tokens
+    old_count = sum(1 for line in kept if line[:1] in (" ", "-"))
+    new_count = sum(1 for line in kept if line[:1] in (" ", "+"))
+    header = f"@@ -{int(match.group(1)) + skip},{old_count} +{int(match.group(3)) + skip},{new_count} @@{section}\n"
+    return Hunk([header] + kept)
+
+def trim_diff(diff: str, budget: int = DEFAULT_TOKEN_BUDGET, tokens: Optional[List[Tuple[int, List[int]]]] = None):
+    files = file_diffs(diff, tokens)
+    # Counted like diff_stats.tokens, as the sum of the file headers and hunks
+    original_tokens = sum(file.tokens + sum(hunk.tokens for hunk in file.hunks) for file in files)
+    hunks_total = sum(len(file.hunks) for file in files)
+    if original_tokens <= budget:
+        return diff, TrimStats(original_tokens, original_tokens, len(files), len(files), hunks_total, hunks_total)
+
+    # Rank hunks by file priority, then by how much they change per token; ties keep diff order
+    candidates = []
+    for file_index, file in enumerate(files):
+        for hunk_index, hunk in enumerate(file.hunks):
+            density = hunk.changes / max(hunk.tokens, 1)
+            candidates.append((file_priority(file.path), -density, file_index, hunk_index))
+        if not file.hunks:
+            # Renames, mode changes and binary files only have a header
+            candidates.append((file_priority(file.path), 0.0, file_index, -1))
+    candidates.sort()
+
+    used = 0
+    selected = {}
+    for _, _, file_index, hunk_index in candidates:
+        file = files[file_index]
+        header_cost = 0 if file_index in selected else file.tokens
+        if hunk_index < 0:
+            if used + header_cost <= budget:
+                selected.setdefault(file_index, {})
+                used += header_cost
+            continue
+        hunk = file.hunks[hunk_index]
+        if used + header_cost + hunk.tokens <= budget:
+            selected.setdefault(file_index, {})[hunk_index] = hunk
+            used += header_cost + hunk.tokens
+        elif not any(selected.values()):
+            # Not even the most important hunk fits, so keep as much of it as possible, and at
+            # least its first change: a diff without changes would leave nothing to describe
+            truncated = truncate_hunk(hunk, budget - used - header_cost)
+            if truncated is not None:
+                selected.setdefault(file_index, {})[hunk_index] = truncated
+                used += header_cost + truncated.tokens
+
+    # Reassemble in the original order so the result is still a valid diff
+    parts = []
+    for file_index in sorted(selected):
+        parts.append(files[file_index].header)
+        for hunk_index in sorted(selected[file_index]):
+            parts.append(selected[file_index][hunk_index].text)
+    trimmed = "".join(parts)
+
+    hunks_kept = sum(len(hunks) for hunks in selected.values())
+    return trimmed, TrimStats(original_tokens, count_tokens(trimmed), len(files), len(selected), hunks_total, hunks_kept)
+
+def create_token_stats_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS diff_tokens (
+            hash TEXT PRIMARY KEY,
+            budget INTEGER,
+            original_tokens INTEGER,
+            trimmed_tokens INTEGER,
+            files_total INTEGER,
+            files_kept INTEGER,
+            hunks_total INTEGER,
+            hunks_kept INTEGER,
+            skipped TEXT
+        )
+    """)
+    # Why a commit was not sent to the generator, NULL when it was
+    if not has_column(conn, "diff_tokens", "skipped"):
+        conn.execute("ALTER TABLE diff_tokens ADD COLUMN skipped TEXT")
+    conn.commit()
+
+def insert_token_stats(writer, hash: str, budget: int, stats: TrimStats, skipped: Optional[str] = None) -> None:
+    writer.add("INSERT OR REPLACE INTO diff_tokens (hash, budget, original_tokens, trimmed_tokens, files_total, files_kept, hunks_total, hunks_kept, skipped) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+               (hash, budget) + tuple(stats) + (skipped,))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Trim a diff to a token budget, keeping the most important files and hunks.')
+    parser.add_argument('diff', type=str, help='Path to the diff file, or - for stdin.')
+    parser.add_argument('-b', '--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET, help='Maximum number of diff tokens.')
+    args = parser.parse_args()
+
+    diff = sys.stdin.read() if args.diff == '-' else open(args.diff, "r").read()
+    trimmed, stats = trim_diff(diff, args.token_budget)
+    sys.stdout.write(trimmed)
+    print(f"{stats.original_tokens} -> {stats.trimmed_tokens} tokens, {stats.files_kept}/{stats.files_total} files, "
+          f"{stats.hunks_kept}/{stats.hunks_total} hunks" + ("" if get_encoding() else " (approximate token counts)"), file=sys.stderr)
@@ -0,0 +1,60 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluator"))
+
+import spacy
+from scorers import ScoringEngine, evaluate_flesch, parse_commit_message, score_pos
+from synthetic import random_message
+
+def combine_scores(message, parsed, pos_score):
+    # The readability formula of the per-message evaluator, kept here as the baseline
+    if parsed:
+        flesch_score = evaluate_flesch(parsed['body'] or parsed['message'])
+        return {'adherence': 1.0, 'readability': (pos_score + flesch_score) / 2}
+    return {'adherence': 0.0, 'readability': evaluate_flesch(message)}
+
+def per_message(messages):
+    # The previous path: one nlp() call per message with the full pipeline, NER included
+    full_nlp = spacy.load('en_core_web_sm')
+    results = []
+    for message in messages:
+        parsed = parse_commit_message(message)
+        pos_score = score_pos(full_nlp(parsed['message'])) if parsed else None
+        results.append(combine_scores(message, parsed, pos_score))
+    return results
+
+def batched(messages, batch_size, n_process):
+    with ScoringEngine(['adherence', 'readability'], batch_size, n_process) as engine:
+        frame = engine.score(messages)
+    return frame[['adherence', 'readability']].to_dict('records')
+
+def measure(label, func, *args):
+    start = time.perf_counter()
+    results = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {len(results):>7} messages in {elapsed:8.2f}s  {len(results) / elapsed:10.1f} messages/s")
+    return results, elapsed
+
+def main(count, batch_size, n_process, seed):
+    rng = random.Random(seed)
+    messages = [random_message(rng) for _ in range(count)]
+
+    before, before_time = measure("per-message", per_message, messages)
+    after, after_time = measure("batched", batched, messages, batch_size, n_process)
+
+    mismatches = sum(1 for a, b in zip(before, after) if (a['adherence'], a['readability']) != (b['adherence'], b['readability']))
+    print(f"speedup      {before_time / after_time:.1f}x, {mismatches} differing scores")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare per-message and batched commit message evaluation.')
+    parser.add_argument('-n', '--messages', type=int, default=5000, help='Number of synthetic messages.')
+    parser.add_argument('--batch-size', type=int, default=256, help='Messages per spaCy batch.')
+    parser.add_argument('--n-process', type=int, default=1, help='Number of spaCy worker processes.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic messages.')
+    args = parser.parse_args()
+
+    main(args.messages, args.batch_size, args.n_process, args.seed)
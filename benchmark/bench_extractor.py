@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+
+from git import Git, Repo
+from history import iter_history
+from synthetic import create_synthetic_repo
+
+def legacy_history(repo_path):
+    # The per-commit path extractor.py used before: one `git diff` process per commit
+    repo = Repo(repo_path)
+    git = Git(repo_path)
+    for commit in repo.iter_commits():
+        diff = git.diff(commit.parents[0].hexsha, commit.hexsha) if commit.parents else git.diff(commit.hexsha)
+        yield commit.hexsha, commit.message.strip(), diff.encode('utf-8', 'replace').decode('utf-8')
+
+def streaming_history(repo_path):
+    for commit in iter_history(repo_path):
+        yield commit.hash, commit.message.strip(), commit.diff
+
+def measure(label, history, repo_path):
+    start = time.perf_counter()
+    results = {commit_hash: (message, diff) for commit_hash, message, diff in history(repo_path)}
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {len(results):>7} commits in {elapsed:8.2f}s  {len(results) / elapsed:10.1f} commits/s")
+    return results, elapsed
+
+def main(num_commits, repo_path):
+    with tempfile.TemporaryDirectory() as tmp:
+        if repo_path is None:
+            repo_path = create_synthetic_repo(os.path.join(tmp, "repo"), num_commits)
+
+        legacy, legacy_time = measure("legacy", legacy_history, repo_path)
+        streaming, streaming_time = measure("streaming", streaming_history, repo_path)
+
+        # Root commits were diffed against the working tree before, so they are not compared
+        roots = set(Git(repo_path).rev_list("--max-parents=0", "HEAD").split())
+        mismatches = [h for h, row in legacy.items() if h not in roots and streaming.get(h) != row]
+        print(f"speedup    {legacy_time / streaming_time:.1f}x, {len(mismatches)} mismatching commits")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare per-commit and streaming history extraction.')
+    parser.add_argument('-n', '--commits', type=int, default=2000, help='Number of synthetic commits to generate.')
+    parser.add_argument('--repo', type=str, default=None, help='Benchmark an existing local repository instead.')
+    args = parser.parse_args()
+
+    main(args.commits, args.repo)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import DISTRIBUTIONS, create_synthetic_corpus, create_synthetic_repo
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_turbocommit.py")
+
+def script(*parts):
+    return os.path.join(ROOT, *parts)
+
+def database_size(database_path):
+    return sum(os.path.getsize(path) for path in (database_path, database_path + "-wal") if os.path.exists(path))
+
+def count_rows(database_path, table):
+    conn = sqlite3.connect(database_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+def run_stage(name, command, cwd, report_path=None):
+    # Each stage is a separate process, so wait4 gives its own peak RSS
+    if report_path:
+        command = command + ["--report", report_path]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        sys.stderr.write(output.decode("utf-8", "replace"))
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    result = {"stage": name, "seconds": elapsed, "peak_rss_bytes": peak_rss}
+    if report_path and os.path.exists(report_path):
+        with open(report_path) as file:
+            result["timers"] = json.load(file)["timers"]
+    return result
+
+def measure_stages(options, work_dir):
+    database = os.path.join(work_dir, "synthetic.db")
+    reports = os.path.join(work_dir, "reports")
+    os.makedirs(reports, exist_ok=True)
+    shape = (options.commits, options.files, options.mean_diff_lines, options.bot_ratio, options.seed, options.distribution)
+    results = []
+
+    start = time.perf_counter()
+    if options.corpus:
+        create_synthetic_corpus(database, *shape)
+    else:
+        create_synthetic_repo(os.path.join(work_dir, "synthetic"), *shape)
+    results.append({"stage": "synthesize", "seconds": time.perf_counter() - start, "items": options.commits})
+
+    if not options.corpus:
+        # extractor.py clones next to the database it writes, named after the repository
+        result = run_stage("extract", [sys.executable, script("extractor", "extractor.py"), os.path.join(work_dir, "synthetic")],
+                           os.path.join(work_dir, "run"), os.path.join(reports, "extract.json"))
+        os.replace(os.path.join(work_dir, "run", "synthetic.db"), database)
+        result["items"] = count_rows(database, "commits") + count_rows(database, "bot_commits")
+        results.append(result)
+
+    stages = [
+        ("sample", [sys.executable, script("ai_commits", "limit_commits.py"), database, str(options.sample), "-s", str(options.seed)],
+         None, "commits"),
+        ("generate", [sys.executable, script("ai_commits", "generate.py"), database, str(options.sample), "--executable", STUB,
+                      "--no-cache", "-j", str(options.concurrency), "-s", str(options.seed)],
+         "generate.json", "ai_commits_one_shot"),
+        ("evaluate", [sys.executable, script("evaluator", "evaluator.py"), database], "evaluate.json", "evaluated"),
+        ("overall", [sys.executable, script("evaluator", "overall.py"), database], None, "evaluated"),
+    ]
+    for name, command, report, table in stages:
+        result = run_stage(name, command, work_dir, os.path.join(reports, report) if report else None)
+        result["items"] = count_rows(database, table)
+        results.append(result)
+
+    for result in results:
+        result["items_per_second"] = result["items"] / result["seconds"] if result["seconds"] else 0.0
+        if result["stage"] != "synthesize":
+            result["database_bytes"] = database_size(database)
+    return results
+
+def compare(results, baseline_path, tolerance):
+    # Flags stages whose throughput dropped, or whose peak RSS grew, by more than `tolerance`
+    with open(baseline_path) as file:
+        baseline = {result["stage"]: result for result in json.load(file)["stages"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["stage"])
+        if previous is None:
+            continue
+        if result["items_per_second"] < previous["items_per_second"] * (1 - tolerance):
+            regressions.append(f"{result['stage']}: {previous['items_per_second']:.1f} -> {result['items_per_second']:.1f} items/s")
+        if result.get("peak_rss_bytes") and previous.get("peak_rss_bytes") \
+                and result["peak_rss_bytes"] > previous["peak_rss_bytes"] * (1 + tolerance):
+            regressions.append(f"{result['stage']}: peak RSS {previous['peak_rss_bytes'] / 2**20:.1f} -> "
+                               f"{result['peak_rss_bytes'] / 2**20:.1f} MiB")
+    return regressions
+
+def main(options):
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_", dir=options.work_dir) as work_dir:
+        os.makedirs(os.path.join(work_dir, "run"))
+        results = measure_stages(options, work_dir)
+
+    print(f"{'stage':<11} {'items':>8} {'seconds':>9} {'items/s':>10} {'peak RSS':>10} {'db size':>10}")
+    for result in results:
+        rss = f"{result['peak_rss_bytes'] / 2**20:.1f} MiB" if result.get("peak_rss_bytes") else "-"
+        size = f"{result['database_bytes'] / 2**20:.1f} MiB" if "database_bytes" in result else "-"
+        print(f"{result['stage']:<11} {result['items']:>8} {result['seconds']:>9.2f} {result['items_per_second']:>10.1f} {rss:>10} {size:>10}")
+
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump({"options": vars(options), "stages": results}, file, indent=2)
+
+    if options.baseline:
+        regressions = compare(results, options.baseline, options.tolerance)
+        for regression in regressions:
+            print(f"regression  {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the whole pipeline on synthetic data and record per-stage throughput, peak RSS and database size.')
+    parser.add_argument('-n', '--commits', type=int, default=2000, help='Number of synthetic commits.')
+    parser.add_argument('--files', type=int, default=50, help='Number of files in the synthetic repository.')
+    parser.add_argument('--mean-diff-lines', type=int, default=40, help='Mean number of changed lines per commit.')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='exponential', help='Distribution of the diff sizes.')
+    parser.add_argument('--bot-ratio', type=float, default=0.1, help='Fraction of commits made by bots.')
+    parser.add_argument('--sample', type=int, default=500, help='Commits kept by limit_commits.py and sent to the generator.')
+    parser.add_argument('-j', '--concurrency', type=int, default=4, help='Generator processes running at once.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the data and the sampling.')
+    parser.add_argument('--corpus', action='store_true', help='Write the commit database directly and skip git and extraction.')
+    parser.add_argument('--work-dir', type=str, default=None, help='Directory for the temporary files.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', type=str, default=None, help='Results of an earlier run; exit non-zero on regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown or RSS growth against the baseline.')
+    args = parser.parse_args()
+
+    main(args)
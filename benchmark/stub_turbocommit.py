@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# Offline stand-in for adapted_turbocommit: reads diff.txt and writes output.txt in the
+# working directory. STUB_DELAY adds latency in seconds, STUB_FAILURE_RATE makes that
+# fraction of calls exit non-zero.
+import os
+import re
+import random
+import sys
+import time
+
+def summarize(diff):
+    files = re.findall(r"^\+\+\+ b/(.+)$", diff, re.MULTILINE)
+    added = len(re.findall(r"^\+(?!\+\+)", diff, re.MULTILINE))
+    removed = len(re.findall(r"^-(?!--)", diff, re.MULTILINE))
+    if not files:
+        return "chore: update files"
+    scope = os.path.splitext(os.path.basename(files[0]))[0]
+    subject = f"feat({scope}): update {len(files)} file{'s' if len(files) != 1 else ''}"
+    return f"{subject}\n\nAdds {added} and removes {removed} lines in {', '.join(files[:3])}."
+
+def main():
+    time.sleep(float(os.environ.get("STUB_DELAY", "0")))
+    if random.random() < float(os.environ.get("STUB_FAILURE_RATE", "0")):
+        print("stub failure")
+        sys.exit(1)
+
+    with open("diff.txt", "r") as file:
+        diff = file.read()
+    with open("output.txt", "w") as file:
+        file.write(summarize(diff))
+    print("Message written to output.txt")
+
+if __name__ == "__main__":
+    main()
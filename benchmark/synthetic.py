@@ -0,0 +1,157 @@
+import argparse
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import time
+
+TYPES = ["feat", "fix", "refactor", "docs", "test", "chore", "perf", "style"]
+SCOPES = ["api", "cli", "parser", "db", "ui", "auth", None]
+VERBS = ["add", "fix", "remove", "update", "rename", "handle", "support", "simplify"]
+NOUNS = ["cache", "config loader", "retry logic", "user model", "error message", "query builder", "login form", "docs"]
+HUMANS = ["Alice Example", "Bob Example", "Carol Example", "Dan Example"]
+BOTS = ["dependabot[bot]", "renovate-bot", "snyk-bot"]
+EXTENSIONS = [".py", ".rs", ".ts", ".md", ".go"]
+DISTRIBUTIONS = ["exponential", "lognormal", "uniform"]
+
+def random_message(rng: random.Random) -> str:
+    subject = f"{rng.choice(VERBS)} {rng.choice(NOUNS)}"
+    if rng.random() < 0.6:
+        scope = rng.choice(SCOPES)
+        prefix = rng.choice(TYPES) + (f"({scope})" if scope else "")
+        subject = f"{prefix}: {subject}"
+    else:
+        subject = subject.capitalize()
+    if rng.random() < 0.3:
+        subject += f"\n\nThe {rng.choice(NOUNS)} needed to {rng.choice(VERBS)} the {rng.choice(NOUNS)} before release."
+    return subject
+
+def random_lines(rng: random.Random, count: int) -> list:
+    return [f"{rng.choice(VERBS)}_{rng.choice(NOUNS).replace(' ', '_')} = {rng.randint(0, 10**6)}" for _ in range(count)]
+
+def diff_size(rng: random.Random, mean: float, distribution: str = "exponential") -> int:
+    # Number of changed lines of one commit; all distributions have the given mean
+    if distribution == "exponential":
+        value = rng.expovariate(1 / mean)
+    elif distribution == "lognormal":
+        # Heavy tail: a few huge commits, like vendored code or lockfile updates
+        sigma = 1.5
+        value = rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    elif distribution == "uniform":
+        value = rng.uniform(1, 2 * mean - 1)
+    else:
+        raise ValueError(f"Unknown diff size distribution {distribution!r}")
+    return max(1, int(value))
+
+def _data(text: str) -> bytes:
+    payload = text.encode("utf-8")
+    return b"data %d\n" % len(payload) + payload + b"\n"
+
+def fast_import_stream(num_commits: int, num_files: int = 50, mean_diff_lines: int = 40,
+                       bot_ratio: float = 0.1, seed: int = 0, distribution: str = "exponential"):
+    rng = random.Random(seed)
+    files = {f"src/module_{i}{rng.choice(EXTENSIONS)}": random_lines(rng, 20) for i in range(num_files)}
+    timestamp = 1_600_000_000
+
+    for index in range(num_commits):
+        touched = rng.sample(sorted(files), k=min(len(files), 1 + int(rng.expovariate(1 / 2))))
+        changed_lines = diff_size(rng, mean_diff_lines, distribution)
+        for path in touched:
+            lines = files[path]
+            for _ in range(max(1, changed_lines // len(touched))):
+                position = rng.randint(0, len(lines))
+                if lines and rng.random() < 0.3:
+                    del lines[min(position, len(lines) - 1)]
+                else:
+                    lines.insert(position, random_lines(rng, 1)[0])
+
+        if rng.random() < bot_ratio:
+            author = rng.choice(BOTS)
+            message = f"Bump dependency from 1.{index}.0 to 1.{index + 1}.0"
+        else:
+            author = rng.choice(HUMANS)
+            message = random_message(rng)
+
+        email = author.split(" ")[0].lower() + "@example.com"
+        timestamp += rng.randint(60, 86400)
+        chunk = [b"commit refs/heads/main\n", f"mark :{index + 1}\n".encode(),
+                 f"author {author} <{email}> {timestamp} +0000\n".encode(),
+                 f"committer {author} <{email}> {timestamp} +0000\n".encode(), _data(message)]
+        if index:
+            chunk.append(f"from :{index}\n".encode())
+        for path in touched:
+            chunk.append(f"M 100644 inline {path}\n".encode())
+            chunk.append(_data("\n".join(files[path]) + "\n"))
+        chunk.append(b"\n")
+        yield b"".join(chunk)
+
+def create_synthetic_repo(path: str, num_commits: int, num_files: int = 50, mean_diff_lines: int = 40,
+                          bot_ratio: float = 0.1, seed: int = 0, distribution: str = "exponential") -> str:
+    os.makedirs(path, exist_ok=True)
+    subprocess.run(["git", "init", "-q", "-b", "main", path], check=True)
+    process = subprocess.Popen(["git", "-C", path, "fast-import", "--quiet"], stdin=subprocess.PIPE)
+    for chunk in fast_import_stream(num_commits, num_files, mean_diff_lines, bot_ratio, seed, distribution):
+        process.stdin.write(chunk)
+    process.stdin.close()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, "git fast-import")
+    subprocess.run(["git", "-C", path, "checkout", "-q", "main"], check=True)
+    return path
+
+def random_diff(rng: random.Random, num_files: int, changed_lines: int) -> str:
+    touched = sorted(rng.sample(range(num_files), k=min(num_files, 1 + int(rng.expovariate(1 / 2)))))
+    parts = []
+    for index in touched:
+        path = f"src/module_{index}{EXTENSIONS[index % len(EXTENSIONS)]}"
+        lines = max(1, changed_lines // len(touched))
+        removed = random_lines(rng, lines // 3)
+        added = random_lines(rng, lines - len(removed))
+        context = random_lines(rng, 3)
+        start = rng.randint(1, 500)
+        parts.append(f"diff --git a/{path} b/{path}\nindex {rng.getrandbits(28):07x}..{rng.getrandbits(28):07x} 100644\n"
+                     f"--- a/{path}\n+++ b/{path}\n"
+                     f"@@ -{start},{len(context) + len(removed)} +{start},{len(context) + len(added)} @@\n"
+                     + "".join(f" {line}\n" for line in context)
+                     + "".join(f"-{line}\n" for line in removed)
+                     + "".join(f"+{line}\n" for line in added))
+    return "".join(parts)
+
+def create_synthetic_corpus(database_path: str, num_commits: int, num_files: int = 50, mean_diff_lines: int = 40,
+                            bot_ratio: float = 0.1, seed: int = 0, distribution: str = "exponential") -> str:
+    # Writes an extractor-shaped database directly, for corpus sizes where building a git repo is too slow
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS commits (hash TEXT, message TEXT, diff TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS bot_commits (hash TEXT, message TEXT)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_commits_hash ON commits (hash)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bot_commits_hash ON bot_commits (hash)")
+    with conn:
+        for index in range(num_commits):
+            commit_hash = f"{rng.getrandbits(160):040x}"
+            diff = random_diff(rng, num_files, diff_size(rng, mean_diff_lines, distribution))
+            if rng.random() < bot_ratio:
+                conn.execute("INSERT OR IGNORE INTO bot_commits (hash, message) VALUES (?, ?)",
+                             (commit_hash, f"Bump dependency from 1.{index}.0 to 1.{index + 1}.0"))
+            else:
+                conn.execute("INSERT OR IGNORE INTO commits (hash, message, diff) VALUES (?, ?, ?)",
+                             (commit_hash, random_message(rng), diff))
+    conn.close()
+    return database_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create a synthetic git repository, or an extracted commit database with --corpus.')
+    parser.add_argument('target', type=str, help='Path of the repository, or of the database with --corpus.')
+    parser.add_argument('commits', type=int, help='Number of commits.')
+    parser.add_argument('bot_ratio', type=float, nargs='?', default=0.1, help='Fraction of commits made by bots.')
+    parser.add_argument('--files', type=int, default=50, help='Number of files in the repository.')
+    parser.add_argument('--mean-diff-lines', type=int, default=40, help='Mean number of changed lines per commit.')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='exponential', help='Distribution of the diff sizes.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--corpus', action='store_true', help='Write the commits table directly instead of a git repository.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    create = create_synthetic_corpus if args.corpus else create_synthetic_repo
+    create(args.target, args.commits, args.files, args.mean_diff_lines, args.bot_ratio, args.seed, args.distribution)
+    print(f"Created {args.commits} commits in {time.perf_counter() - start:.2f}s")
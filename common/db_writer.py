@@ -0,0 +1,76 @@
+import sqlite3
+import time
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from common.instrumentation import count, timer
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+def connect(database_path: str, wal: bool = True, synchronous: str = "NORMAL",
+            cache_size_kib: int = 65536, timeout: float = 30.0) -> sqlite3.Connection:
+    if synchronous.upper() not in SYNCHRONOUS_MODES:
+        raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+
+    conn = sqlite3.connect(database_path, timeout=timeout)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous.upper()}")
+    # Negative cache_size is interpreted by SQLite as KiB instead of pages
+    conn.execute(f"PRAGMA cache_size=-{int(cache_size_kib)}")
+    return conn
+
+# Buffers write statements and flushes them with executemany in one transaction every
+# `batch_size` rows or `flush_interval_ms` milliseconds. Statement order is preserved, and
+# using it as a context manager flushes the buffer on normal exit and on Ctrl-C alike.
+# `on_flush` runs inside each flush transaction, e.g. to record progress atomically.
+class BatchWriter:
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = 1000, flush_interval_ms: Optional[float] = 1000,
+                 on_flush: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.on_flush = on_flush
+        self.rows_written = 0
+        self._pending: List[Tuple[str, Sequence[Any]]] = []
+        self._last_flush = time.monotonic()
+
+    def add(self, sql: str, params: Sequence[Any]) -> None:
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.batch_size or self._interval_elapsed():
+            self.flush()
+
+    def _interval_elapsed(self) -> bool:
+        if self.flush_interval_ms is None:
+            return False
+        return (time.monotonic() - self._last_flush) * 1000 >= self.flush_interval_ms
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+
+        # `with conn` commits on success and rolls back on error, in which case
+        # the rows stay buffered for the next attempt.
+        with timer("sqlite.flush"), self.conn:
+            start = 0
+            while start < len(self._pending):
+                sql = self._pending[start][0]
+                end = start
+                while end < len(self._pending) and self._pending[end][0] == sql:
+                    end += 1
+                self.conn.executemany(sql, [params for _, params in self._pending[start:end]])
+                start = end
+            if self.on_flush is not None:
+                self.on_flush(self.conn)
+
+        self.rows_written += len(self._pending)
+        count("sqlite.rows_written", len(self._pending))
+        self._pending = []
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.diff_store import DIFF_TABLES, diff_sql, table_exists
+from common.tokens import count_tokens
+
+# Each stored diff is parsed once into per-commit, per-file and per-hunk rows, so questions
+# like "large diffs", "Rust files" or "commits over the token budget" are indexed queries.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS diff_stats (
+        hash TEXT PRIMARY KEY,
+        files INTEGER,
+        hunks INTEGER,
+        added INTEGER,
+        removed INTEGER,
+        bytes INTEGER,
+        tokens INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS diff_files (
+        hash TEXT,
+        file_index INTEGER,
+        path TEXT,
+        old_path TEXT,
+        change_type TEXT,
+        language TEXT,
+        is_binary INTEGER,
+        hunks INTEGER,
+        added INTEGER,
+        removed INTEGER,
+        bytes INTEGER,
+        tokens INTEGER,
+        PRIMARY KEY (hash, file_index)
+    )""",
+    """CREATE TABLE IF NOT EXISTS diff_hunks (
+        hash TEXT,
+        file_index INTEGER,
+        hunk_index INTEGER,
+        old_start INTEGER,
+        old_lines INTEGER,
+        new_start INTEGER,
+        new_lines INTEGER,
+        added INTEGER,
+        removed INTEGER,
+        bytes INTEGER,
+        tokens INTEGER,
+        PRIMARY KEY (hash, file_index, hunk_index)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_diff_stats_tokens ON diff_stats (tokens)",
+    "CREATE INDEX IF NOT EXISTS idx_diff_stats_bytes ON diff_stats (bytes)",
+    "CREATE INDEX IF NOT EXISTS idx_diff_files_language ON diff_files (language)",
+    "CREATE INDEX IF NOT EXISTS idx_diff_files_change_type ON diff_files (change_type)",
+    "CREATE INDEX IF NOT EXISTS idx_diff_files_path ON diff_files (path)",
+]
+
+LANGUAGES = {
+    ".py": "Python", ".pyi": "Python", ".rs": "Rust", ".go": "Go", ".js": "JavaScript", ".mjs": "JavaScript",
+    ".cjs": "JavaScript", ".jsx": "JavaScript", ".ts": "TypeScript", ".tsx": "TypeScript", ".java": "Java",
+    ".kt": "Kotlin", ".kts": "Kotlin", ".scala": "Scala", ".c": "C", ".h": "C", ".cc": "C++", ".cpp": "C++",
+    ".cxx": "C++", ".hpp": "C++", ".hh": "C++", ".cs": "C#", ".swift": "Swift", ".m": "Objective-C",
+    ".rb": "Ruby", ".php": "PHP", ".sh": "Shell", ".bash": "Shell", ".zsh": "Shell", ".ps1": "PowerShell",
+    ".sql": "SQL", ".html": "HTML", ".htm": "HTML", ".css": "CSS", ".scss": "CSS", ".sass": "CSS",
+    ".vue": "Vue", ".svelte": "Svelte", ".dart": "Dart", ".lua": "Lua", ".r": "R", ".jl": "Julia",
+    ".hs": "Haskell", ".ex": "Elixir", ".exs": "Elixir", ".erl": "Erlang", ".clj": "Clojure", ".ml": "OCaml",
+    ".md": "Markdown", ".rst": "reStructuredText", ".txt": "Text", ".json": "JSON", ".yaml": "YAML",
+    ".yml": "YAML", ".toml": "TOML", ".xml": "XML", ".ini": "INI", ".cfg": "INI", ".lock": "Lockfile",
+    ".typ": "Typst", ".tex": "TeX", ".ipynb": "Jupyter",
+}
+FILENAMES = {"Dockerfile": "Dockerfile", "Makefile": "Makefile", "CMakeLists.txt": "CMake", "go.sum": "Lockfile",
+             "package-lock.json": "Lockfile", "yarn.lock": "Lockfile", "pnpm-lock.yaml": "Lockfile"}
+
+def language(path: str) -> Optional[str]:
+    name = os.path.basename(path)
+    if name in FILENAMES:
+        return FILENAMES[name]
+    return LANGUAGES.get(os.path.splitext(name)[1].lower())
+
+HunkStats = namedtuple("HunkStats", ["old_start", "old_lines", "new_start", "new_lines", "added", "removed", "bytes", "tokens"])
+FileStats = namedtuple("FileStats", ["path", "old_path", "change_type", "language", "is_binary", "added", "removed", "bytes", "tokens", "hunks"])
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+def _unquote(path: str) -> str:
+    # git quotes paths with unusual characters
+    return path[1:-1] if len(path) > 1 and path.startswith('"') and path.endswith('"') else path
+
+def _strip_prefix(path: str) -> Optional[str]:
+    path = _unquote(path.strip())
+    if path == "/dev/null":
+        return None
+    return path[2:] if path[:2] in ("a/", "b/") else path
+
+def _hunk_stats(lines: List[str]) -> HunkStats:
+    match = HUNK_HEADER.match(lines[0])
+    old_start, old_lines, new_start, new_lines = (int(value) if value is not None else 1 for value in match.groups())
+    text = "".join(lines)
+    added = sum(1 for line in lines[1:] if line.startswith("+"))
+    removed = sum(1 for line in lines[1:] if line.startswith("-"))
+    return HunkStats(old_start, old_lines, new_start, new_lines, added, removed, len(text.encode("utf-8")), count_tokens(text))
+
+def _file_stats(header: List[str], hunks: List[List[str]]) -> FileStats:
+    old_path = new_path = None
+    change_type = "modified"
+    is_binary = False
+    match = re.match(r"diff --git (\"?a/.*?\"?) (\"?b/.*\"?)$", header[0].rstrip("\n"))
+    if match:
+        old_path, new_path = _strip_prefix(match.group(1)), _strip_prefix(match.group(2))
+    for line in header[1:]:
+        if line.startswith("new file mode"):
+            change_type = "added"
+        elif line.startswith("deleted file mode"):
+            change_type = "deleted"
+        elif line.startswith("rename from ") or line.startswith("copy from "):
+            change_type = "renamed" if line.startswith("rename") else "copied"
+            old_path = _unquote(line.split(" ", 2)[2].rstrip("\n"))
+        elif line.startswith("rename to ") or line.startswith("copy to "):
+            new_path = _unquote(line.split(" ", 2)[2].rstrip("\n"))
+        elif line.startswith("--- "):
+            old_path = _strip_prefix(line[4:].rstrip("\n"))
+        elif line.startswith("+++ "):
+            new_path = _strip_prefix(line[4:].rstrip("\n"))
+        elif line.startswith("Binary files") or line.startswith("GIT binary patch"):
+            is_binary = True
+
+    path = new_path if new_path is not None else old_path
+    hunk_stats = [_hunk_stats(lines) for lines in hunks]
+    header_text = "".join(header)
+    return FileStats(
+        path or "", old_path if old_path != path else None, change_type, language(path or ""), int(is_binary),
+        sum(hunk.added for hunk in hunk_stats), sum(hunk.removed for hunk in hunk_stats),
+        len(header_text.encode("utf-8")) + sum(hunk.bytes for hunk in hunk_stats),
+        count_tokens(header_text) + sum(hunk.tokens for hunk in hunk_stats),
+        hunk_stats,
+    )
+
+def split_diff(diff: str) -> Iterator[Tuple[List[str], List[List[str]]]]:
+    # The header lines and hunks (header line first) of each file; the trimmer in
+    # ai_commits/trim.py splits with this too, so its hunks are the indexed ones
+    header: List[str] = []
+    hunks: List[List[str]] = []
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("diff --git "):
+            if header:
+                yield header, hunks
+            header, hunks = [line], []
+        elif line.startswith("@@") and header and HUNK_HEADER.match(line):
+            hunks.append([line])
+        elif hunks:
+            hunks[-1].append(line)
+        elif header:
+            header.append(line)
+    if header:
+        yield header, hunks
+
+def parse_diff(diff: str) -> Iterator[FileStats]:
+    for header, hunks in split_diff(diff):
+        yield _file_stats(header, hunks)
+
+def create_index_tables(conn: sqlite3.Connection) -> None:
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+
+def index_rows(commit_hash: str, diff: str) -> Tuple[tuple, List[tuple], List[tuple]]:
+    files = list(parse_diff(diff or ""))
+    file_rows = []
+    hunk_rows = []
+    for file_index, file in enumerate(files):
+        file_rows.append((commit_hash, file_index, file.path, file.old_path, file.change_type, file.language, file.is_binary,
+                          len(file.hunks), file.added, file.removed, file.bytes, file.tokens))
+        hunk_rows.extend((commit_hash, file_index, hunk_index) + tuple(hunk) for hunk_index, hunk in enumerate(file.hunks))
+    stats = (commit_hash, len(files), len(hunk_rows), sum(file.added for file in files), sum(file.removed for file in files),
+             len((diff or "").encode("utf-8")), sum(file.tokens for file in files))
+    return stats, file_rows, hunk_rows
+
+def index_table(conn: sqlite3.Connection, table: str, chunk_size: int = 500) -> int:
+    # Only commits without a diff_stats row are parsed, so running this after every
+    # extraction keeps the index current. Each chunk is committed on its own.
+    expression, join = diff_sql(conn, table)
+    indexed = 0
+    last_rowid = -1
+    while True:
+        rows = conn.execute(f"""
+            SELECT {table}.rowid, {table}.hash, {expression} FROM {table} {join}
+            WHERE {table}.rowid > ? AND NOT EXISTS (SELECT 1 FROM diff_stats WHERE diff_stats.hash = {table}.hash)
+            ORDER BY {table}.rowid LIMIT ?
+        """, (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        stats_rows, file_rows, hunk_rows = [], [], []
+        for _, commit_hash, diff in rows:
+            stats, files, hunks = index_rows(commit_hash, diff)
+            stats_rows.append(stats)
+            file_rows.extend(files)
+            hunk_rows.extend(hunks)
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO diff_stats VALUES (?, ?, ?, ?, ?, ?, ?)", stats_rows)
+            conn.executemany("INSERT OR REPLACE INTO diff_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", file_rows)
+            conn.executemany("INSERT OR REPLACE INTO diff_hunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", hunk_rows)
+        indexed += len(rows)
+        last_rowid = rows[-1][0]
+    return indexed
+
+def index_diffs(conn: sqlite3.Connection) -> int:
+    create_index_tables(conn)
+    return sum(index_table(conn, table) for table in DIFF_TABLES if table_exists(conn, table))
+
+def drop_index(conn: sqlite3.Connection) -> None:
+    with conn:
+        for table in ("diff_stats", "diff_files", "diff_hunks"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+def is_indexed(conn: sqlite3.Connection) -> bool:
+    return table_exists(conn, "diff_stats")
+
+def diff_sizes(conn: sqlite3.Connection, hashes: List[str], chunk_size: int = 500) -> Dict[str, Tuple[int, int, int]]:
+    # tokens, files and hunks of the indexed commits among `hashes`
+    if not is_indexed(conn):
+        return {}
+    sizes = {}
+    for start in range(0, len(hashes), chunk_size):
+        chunk = hashes[start:start + chunk_size]
+        placeholders = ", ".join("?" * len(chunk))
+        for commit_hash, tokens, files, hunks in conn.execute(
+                f"SELECT hash, tokens, files, hunks FROM diff_stats WHERE hash IN ({placeholders})", chunk):
+            sizes[commit_hash] = (tokens, files, hunks)
+    return sizes
+
+def hunk_tokens(conn: sqlite3.Connection, commit_hash: str) -> Optional[List[Tuple[int, List[int]]]]:
+    # Header tokens and per-hunk tokens of each file of an indexed commit, in diff order
+    if not is_indexed(conn):
+        return None
+    files = conn.execute("SELECT file_index, tokens FROM diff_files WHERE hash = ? ORDER BY file_index", (commit_hash,)).fetchall()
+    if not files:
+        return None
+    hunks: Dict[int, List[int]] = {}
+    for file_index, tokens in conn.execute("SELECT file_index, tokens FROM diff_hunks WHERE hash = ? ORDER BY file_index, hunk_index", (commit_hash,)):
+        hunks.setdefault(file_index, []).append(tokens)
+    return [(tokens - sum(hunks.get(file_index, [])), hunks.get(file_index, [])) for file_index, tokens in files]
+
+def print_language_stats(conn: sqlite3.Connection, limit: int) -> None:
+    rows = conn.execute("""
+        SELECT COALESCE(language, '(unknown)'), COUNT(*), COUNT(DISTINCT hash), SUM(added), SUM(removed), SUM(tokens)
+        FROM diff_files GROUP BY 1 ORDER BY 2 DESC LIMIT ?
+    """, (limit,)).fetchall()
+    print(f"{'language':<20} {'files':>9} {'commits':>9} {'added':>10} {'removed':>10} {'tokens':>12}")
+    for name, files, commits, added, removed, tokens in rows:
+        print(f"{name:<20} {files:>9} {commits:>9} {added or 0:>10} {removed or 0:>10} {tokens or 0:>12}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parse the stored diffs into indexed file and hunk tables.')
+    parser.add_argument('command', choices=['update', 'rebuild', 'drop', 'languages'], help='Index new commits, re-index everything, remove the index or show per-language totals.')
+    parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    parser.add_argument('--limit', type=int, default=30, help='Number of languages shown.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    if args.command in ('drop', 'rebuild'):
+        drop_index(conn)
+    if args.command in ('update', 'rebuild'):
+        start = time.perf_counter()
+        indexed = index_diffs(conn)
+        print(f"Indexed {indexed} diffs in {time.perf_counter() - start:.2f}s")
+    if args.command == 'languages':
+        if not is_indexed(conn):
+            print("No diff index yet; run the update command first")
+            sys.exit(1)
+        print_language_stats(conn, args.limit)
+    conn.close()
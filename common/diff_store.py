@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+from typing import Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Optional storage layout: diffs live compressed in `diff_blobs`, keyed by the SHA-256 of
+# their text, and `<table>.diff_hash` points there. Migrated rows have `diff` set to NULL;
+# rows added later keep their raw diff until the next migration, so readers use
+# diff_sql(), which handles both.
+DIFF_TABLES = ("commits", "all_commits")
+
+def create_blob_tables(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS diff_blobs (
+            digest TEXT PRIMARY KEY,
+            codec TEXT,
+            dict_id INTEGER,
+            raw_size INTEGER,
+            data BLOB
+        )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS diff_dicts (id INTEGER PRIMARY KEY, codec TEXT, data BLOB)")
+
+def has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+def is_compressed(conn: sqlite3.Connection, table: str = "commits") -> bool:
+    return table_exists(conn, "diff_blobs") and has_column(conn, table, "diff_hash")
+
+def load_dictionaries(conn: sqlite3.Connection) -> Dict[int, bytes]:
+    if not table_exists(conn, "diff_dicts"):
+        return {}
+    return {dict_id: data for dict_id, data in conn.execute("SELECT id, data FROM diff_dicts")}
+
+def decompressor(dictionaries: Dict[int, bytes]):
+    zstd_contexts = {}
+
+    def decompress(codec: Optional[str], dict_id: Optional[int], data: Optional[bytes]) -> Optional[str]:
+        if data is None:
+            return None
+        if codec == "zlib":
+            return zlib.decompress(data).decode("utf-8")
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("This database stores zstd-compressed diffs; install the zstandard package")
+            if dict_id not in zstd_contexts:
+                dictionary = zstandard.ZstdCompressionDict(dictionaries[dict_id]) if dict_id is not None else None
+                zstd_contexts[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+            return zstd_contexts[dict_id].decompress(data).decode("utf-8")
+        raise ValueError(f"Unknown diff codec {codec!r}")
+
+    return decompress
+
+def register(conn: sqlite3.Connection) -> None:
+    conn.create_function("decompress_diff", 3, decompressor(load_dictionaries(conn)), deterministic=True)
+
+def diff_sql(conn: sqlite3.Connection, table: str = "commits") -> Tuple[str, str]:
+    # Returns the column expression and JOIN clause that yield the diff text of `table` rows;
+    # only rows actually selected are decompressed.
+    if not is_compressed(conn, table):
+        return f"{table}.diff", ""
+    register(conn)
+    return (f"COALESCE({table}.diff, decompress_diff(diff_blobs.codec, diff_blobs.dict_id, diff_blobs.data))",
+            f"LEFT JOIN diff_blobs ON diff_blobs.digest = {table}.diff_hash")
+
+def diff_size_sql(conn: sqlite3.Connection, table: str = "commits") -> str:
+    # Byte length of the diff of `table` rows; migrated rows read it from diff_blobs without decompressing
+    if not is_compressed(conn, table):
+        return f"length(CAST({table}.diff AS BLOB))"
+    return (f"COALESCE(length(CAST({table}.diff AS BLOB)), "
+            f"(SELECT raw_size FROM diff_blobs WHERE diff_blobs.digest = {table}.diff_hash))")
+
+def compressor(codec: str, level: int, dictionary: Optional[bytes]):
+    if codec == "zlib":
+        return lambda data: zlib.compress(data, level)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The zstd codec needs the zstandard package")
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compress
+    raise ValueError(f"Unknown diff codec {codec!r}")
+
+def train_dictionary(conn: sqlite3.Connection, table: str, dict_size: int, samples: int = 5000) -> Optional[bytes]:
+    rows = conn.execute(f"SELECT diff FROM {table} WHERE diff IS NOT NULL ORDER BY rowid LIMIT ?", (samples,)).fetchall()
+    # zstd needs a reasonable number of samples to train on
+    if len(rows) < 100:
+        return None
+    return zstandard.train_dictionary(dict_size, [row[0].encode("utf-8") for row in rows]).as_bytes()
+
+def database_size(conn: sqlite3.Connection, database_path: str) -> int:
+    # Fold a WAL back into the main file first so both measurements are comparable
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sum(os.path.getsize(path) for path in (database_path, database_path + "-wal") if os.path.exists(path))
+
+def read_throughput(conn: sqlite3.Connection, table: str = "commits") -> Tuple[int, float]:
+    expression, join = diff_sql(conn, table)
+    start = time.perf_counter()
+    total = 0
+    for (diff,) in conn.execute(f"SELECT {expression} FROM {table} {join}"):
+        total += len(diff or "")
+    return total, time.perf_counter() - start
+
+def migrate_table(conn: sqlite3.Connection, table: str, compress, codec: str, dict_id: Optional[int], chunk_size: int = 500) -> int:
+    if not has_column(conn, table, "diff_hash"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN diff_hash TEXT")
+
+    migrated = 0
+    last_rowid = -1
+    # Walks the table in rowid chunks and commits per chunk, so an interrupted migration resumes
+    while True:
+        rows = conn.execute(f"SELECT rowid, diff FROM {table} WHERE diff IS NOT NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                            (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        blobs = []
+        updates = []
+        for rowid, diff in rows:
+            raw = diff.encode("utf-8")
+            digest = hashlib.sha256(raw).hexdigest()
+            blobs.append((digest, codec, dict_id, len(raw), compress(raw)))
+            updates.append((digest, rowid))
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO diff_blobs (digest, codec, dict_id, raw_size, data) VALUES (?, ?, ?, ?, ?)", blobs)
+            conn.executemany(f"UPDATE {table} SET diff_hash = ?, diff = NULL WHERE rowid = ?", updates)
+        migrated += len(rows)
+        last_rowid = rows[-1][0]
+    return migrated
+
+def migrate(database_path: str, codec: str, level: int, dict_size: int, vacuum: bool) -> None:
+    conn = sqlite3.connect(database_path)
+    tables = [table for table in DIFF_TABLES if table_exists(conn, table)]
+    if not tables:
+        print(f"No table with diffs found in {database_path}")
+        conn.close()
+        return
+
+    size_before = database_size(conn, database_path)
+    raw_bytes, raw_seconds = read_throughput(conn, tables[0])
+
+    create_blob_tables(conn)
+    dict_id = None
+    dictionary = train_dictionary(conn, tables[0], dict_size) if codec == "zstd" and dict_size else None
+    if dictionary is not None:
+        with conn:
+            dict_id = conn.execute("INSERT INTO diff_dicts (codec, data) VALUES (?, ?)", (codec, dictionary)).lastrowid
+    compress = compressor(codec, level, dictionary)
+
+    for table in tables:
+        print(f"Compressed {migrate_table(conn, table, compress, codec, dict_id)} diffs in '{table}'")
+
+    if vacuum:
+        conn.execute("VACUUM")
+    size_after = database_size(conn, database_path)
+    compressed_bytes, compressed_seconds = read_throughput(conn, tables[0])
+    blobs, raw_size, stored_size = conn.execute("SELECT COUNT(*), SUM(raw_size), SUM(LENGTH(data)) FROM diff_blobs").fetchone()
+    conn.close()
+
+    print(f"Unique diffs: {blobs}, {raw_size or 0} bytes raw, {stored_size or 0} bytes stored ({(stored_size or 0) / max(raw_size or 0, 1):.1%})")
+    print(f"Database size: {size_before} -> {size_after} bytes ({size_after / max(size_before, 1):.1%})")
+    print(f"Read throughput of '{tables[0]}': {raw_bytes / max(raw_seconds, 1e-9) / 1e6:.1f} MB/s raw, "
+          f"{compressed_bytes / max(compressed_seconds, 1e-9) / 1e6:.1f} MB/s compressed")
+
+def restore(database_path: str) -> None:
+    conn = sqlite3.connect(database_path)
+    register(conn)
+    for table in DIFF_TABLES:
+        if not is_compressed(conn, table):
+            continue
+        with conn:
+            conn.execute(f"""
+                UPDATE {table} SET diff = (
+                    SELECT decompress_diff(codec, dict_id, data) FROM diff_blobs WHERE digest = {table}.diff_hash
+                ), diff_hash = NULL
+                WHERE diff IS NULL AND diff_hash IS NOT NULL
+            """)
+        print(f"Restored raw diffs in '{table}'")
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS diff_blobs")
+        conn.execute("DROP TABLE IF EXISTS diff_dicts")
+    conn.execute("VACUUM")
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Move commit diffs into compressed, deduplicated storage or back.')
+    parser.add_argument('command', choices=['migrate', 'restore'], help='Compress diffs or restore them as raw text.')
+    parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    parser.add_argument('--codec', choices=['zstd', 'zlib'], default='zstd' if zstandard else 'zlib', help='Compression codec.')
+    parser.add_argument('--level', type=int, default=None, help='Compression level (default: 19 for zstd, 9 for zlib).')
+    parser.add_argument('--dict-size', type=int, default=0, help='Train a zstd dictionary of this many bytes on the diffs.')
+    parser.add_argument('--no-vacuum', action='store_true', help='Skip VACUUM, leaving freed pages in the file.')
+    args = parser.parse_args()
+
+    if args.command == 'restore':
+        restore(args.database)
+        sys.exit(0)
+
+    level = args.level if args.level is not None else (19 if args.codec == 'zstd' else 9)
+    migrate(args.database, args.codec, level, args.dict_size, not args.no_vacuum)
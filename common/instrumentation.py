@@ -0,0 +1,191 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Latency histograms use power-of-two buckets from 1 µs up to ~2000 s
+BUCKETS = 32
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        micros = seconds * 1e6
+        self.buckets[min(BUCKETS - 1, max(0, math.ceil(math.log2(micros)) if micros > 1 else 0))] += 1
+
+    def percentile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation, capped by the exact maximum
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** index / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "min_s": self.min if self.count else 0.0,
+            "p50_s": self.percentile(0.5),
+            "p90_s": self.percentile(0.9),
+            "p99_s": self.percentile(0.99),
+            "max_s": self.max,
+        }
+
+# Process-wide timers and counters. Recording is cheap enough to stay on all the time;
+# only the report, cProfile and tracemalloc are opt-in.
+class Metrics:
+    def __init__(self):
+        self.timers: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+METRICS = Metrics()
+
+def count(name: str, value: float = 1) -> None:
+    METRICS.count(name, value)
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe(name, time.perf_counter() - start)
+
+def timed_iter(iterable: Iterable[Any], name: str) -> Iterator[Any]:
+    # Times how long each item takes to produce, e.g. waiting on a subprocess pipe
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        METRICS.observe(name, time.perf_counter() - start)
+        yield item
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def build_report(started: float, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    with METRICS._lock:
+        timers = {name: histogram.summary() for name, histogram in sorted(METRICS.timers.items())}
+        counters = dict(sorted(METRICS.counters.items()))
+    report = {
+        "script": os.path.basename(sys.argv[0]),
+        "argv": sys.argv[1:],
+        "started": started,
+        "wall_s": time.time() - started,
+        "cpu_s": time.process_time(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "timers": timers,
+        "counters": counters,
+    }
+    if extra:
+        report.update(extra)
+    return report
+
+def write_report(report: Dict[str, Any], path: str) -> None:
+    if path.endswith(".csv"):
+        # One row per timer or counter, so reports of several runs can be concatenated
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            fields = ["count", "total_s", "mean_s", "min_s", "p50_s", "p90_s", "p99_s", "max_s"]
+            writer.writerow(["script", "kind", "name", "value"] + fields)
+            for name, value in report.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    writer.writerow([report["script"], "run", name, value] + [""] * len(fields))
+            for name, summary in report["timers"].items():
+                writer.writerow([report["script"], "timer", name, ""] + [summary[field] for field in fields])
+            for name, value in report["counters"].items():
+                writer.writerow([report["script"], "counter", name, value] + [""] * len(fields))
+    else:
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2, default=str)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument('--report', type=str, default=None, help='Write timers and counters of the run to this .json or .csv file.')
+    group.add_argument('--profile', type=str, default=None, help='Run under cProfile and write the stats to this file (main thread only).')
+    group.add_argument('--tracemalloc', action='store_true', help='Trace allocations and add the top allocation sites to the report.')
+
+@contextmanager
+def instrumented_run(report_path: Optional[str] = None, profile_path: Optional[str] = None,
+                     trace_memory: bool = False, extra: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    # Yields a dict the caller can fill with run-specific results for the report
+    extra = {} if extra is None else extra
+    started = time.time()
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield extra
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            extra["tracemalloc"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top": [{"site": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                        for stat in snapshot.statistics("lineno")[:20]],
+            }
+        if report_path:
+            write_report(build_report(started, extra), report_path)
+
+def instrumented_from_args(args: argparse.Namespace, extra: Optional[Dict[str, Any]] = None):
+    return instrumented_run(args.report, args.profile, args.tracemalloc, extra)
@@ -0,0 +1,102 @@
+import math
+import random
+import sqlite3
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from common.diff_store import diff_size_sql
+
+# Named stratification expressions over the commits table, with {table} standing for its
+# name and {diff_size} for the diff's byte length (also after `diff_store migrate`); anything
+# else passed as a stratum is used as a raw SQL expression. The diff_tokens strata read the
+# diff index (common/diff_index.py) instead of the diff text.
+STRATA = {
+    "diff_size": "CASE WHEN {diff_size} < 1000 THEN 'small' WHEN {diff_size} < 10000 THEN 'medium' ELSE 'large' END",
+    "diff_tokens": "(SELECT CASE WHEN tokens < 300 THEN 'small' WHEN tokens < 3000 THEN 'medium' ELSE 'large' END "
+                   "FROM diff_stats WHERE diff_stats.hash = {table}.hash)",
+}
+
+def reservoir_sample(items: Iterable[Any], k: int, rng: random.Random) -> List[Any]:
+    # Algorithm L: draws O(k log(n/k)) random numbers and skips over the rest in C
+    iterator = iter(items)
+    reservoir = list(islice(iterator, k))
+    if len(reservoir) < k or k <= 0:
+        return reservoir
+
+    weight = math.exp(math.log(1.0 - rng.random()) / k)
+    while True:
+        skip = int(math.log(1.0 - rng.random()) / math.log(1.0 - weight)) if weight < 1.0 else 0
+        item = next(islice(iterator, skip, skip + 1), None)
+        if item is None:
+            return reservoir
+        reservoir[rng.randrange(k)] = item
+        weight *= math.exp(math.log(1.0 - rng.random()) / k)
+
+def sample_rowids(conn: sqlite3.Connection, query: str, n: int, seed: Optional[int] = None,
+                  params: Sequence[Any] = (), rng: Optional[random.Random] = None) -> List[int]:
+    # `query` must select rowids as its first column; only those are read, never the rows.
+    # Callers that keep drawing after the sample pass their own `rng` instead of a seed.
+    rng = rng or random.Random(seed)
+    cursor = conn.execute(query, params)
+    return reservoir_sample((row[0] for row in cursor), n, rng)
+
+def sample_table(conn: sqlite3.Connection, table: str, n: int, seed: Optional[int] = None) -> List[int]:
+    rng = random.Random(seed)
+    low, high, count = conn.execute(f"SELECT MIN(rowid), MAX(rowid), COUNT(*) FROM {table}").fetchone()
+    if count == 0:
+        return []
+    # Without gaps in the rowids the sample can be drawn from the range without reading the table
+    if high - low + 1 == count:
+        return rng.sample(range(low, high + 1), min(n, count))
+    return reservoir_sample((row[0] for row in conn.execute(f"SELECT rowid FROM {table}")), n, rng)
+
+def allocate(counts: Dict[Any, int], n: int) -> Dict[Any, int]:
+    # Proportional allocation with largest remainders, so the quotas add up to n
+    total = sum(counts.values())
+    if total <= n:
+        return dict(counts)
+    shares = {stratum: count * n / total for stratum, count in counts.items()}
+    quotas = {stratum: int(share) for stratum, share in shares.items()}
+    remaining = n - sum(quotas.values())
+    for stratum in sorted(shares, key=lambda s: shares[s] - quotas[s], reverse=True)[:remaining]:
+        quotas[stratum] += 1
+    return quotas
+
+def stratified_sample(conn: sqlite3.Connection, table: str, stratum: str, n: int, seed: Optional[int] = None) -> List[int]:
+    expression = STRATA[stratum].format(table=table, diff_size=diff_size_sql(conn, table)) if stratum in STRATA else stratum
+    rng = random.Random(seed)
+    counts = dict(conn.execute(f"SELECT {expression}, COUNT(*) FROM {table} GROUP BY 1").fetchall())
+    quotas = allocate(counts, n)
+
+    # One pass with a reservoir (Algorithm R) per stratum
+    reservoirs: Dict[Any, List[int]] = {key: [] for key in quotas}
+    seen: Dict[Any, int] = {key: 0 for key in quotas}
+    for rowid, key in conn.execute(f"SELECT rowid, {expression} FROM {table}"):
+        quota = quotas[key]
+        seen[key] += 1
+        if len(reservoirs[key]) < quota:
+            reservoirs[key].append(rowid)
+        else:
+            slot = rng.randrange(seen[key])
+            if slot < quota:
+                reservoirs[key][slot] = rowid
+
+    return [rowid for reservoir in reservoirs.values() for rowid in reservoir]
+
+def load_rowids(conn: sqlite3.Connection, rowids: Iterable[int], name: str = "sampled_rowids") -> str:
+    conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    conn.execute(f"CREATE TEMP TABLE {name} (id INTEGER PRIMARY KEY)")
+    conn.executemany(f"INSERT OR IGNORE INTO temp.{name} (id) VALUES (?)", ((rowid,) for rowid in rowids))
+    return f"temp.{name}"
+
+def copy_rows(conn: sqlite3.Connection, source: str, target: str, columns: Sequence[str], rowids: Iterable[int]) -> int:
+    # The selected rows never leave SQLite
+    sampled = load_rowids(conn, rowids)
+    column_list = ", ".join(columns)
+    cursor = conn.execute(f"INSERT OR IGNORE INTO {target} ({column_list}) SELECT {column_list} FROM {source} WHERE rowid IN (SELECT id FROM {sampled})")
+    return cursor.rowcount
+
+def fetch_rows(conn: sqlite3.Connection, query: str, rowids: Iterable[int], params: Sequence[Any] = ()) -> List[tuple]:
+    # `query` refers to the sampled ids as `sampled_rowids`, e.g. "... WHERE rowid IN (SELECT id FROM sampled_rowids)"
+    load_rowids(conn, rowids)
+    return conn.execute(query, params).fetchall()
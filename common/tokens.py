@@ -0,0 +1,29 @@
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# gpt-3.5-turbo, which adapted_turbocommit uses, tokenizes with cl100k_base
+ENCODING_NAME = "cl100k_base"
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = ENCODING_NAME):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # The encoding file is downloaded on first use, which fails offline
+        return None
+
+# Rough stand-in for BPE when tiktoken is unavailable: words, numbers and single symbols
+APPROXIMATE_TOKEN = re.compile(r"[A-Za-z]{1,4}|\d{1,3}|\S")
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(APPROXIMATE_TOKEN.findall(text))
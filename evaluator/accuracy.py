@@ -3,47 +3,46 @@ import os
 import random
 import subprocess
 import sys
-import psutil
-import random
+import time
+import argparse
 import click
 
-def get_commits(db_path, num_commits):
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        cur.execute("""
-        SELECT commits.hash, commits.message, ai_commits_one_shot.content, commits.diff
-        FROM commits
-        JOIN ai_commits_one_shot ON commits.hash = ai_commits_one_shot.hash
-        LEFT JOIN evaluated ON commits.hash = evaluated.hash
-        WHERE evaluated.hash IS NULL OR evaluated.human_accuracy IS NULL OR evaluated.ai_accuracy IS NULL
-        ORDER BY RANDOM()
-        LIMIT ?
-        """, (num_commits,))
-
-        results = cur.fetchall()
-
-    return results
-
-def get_ai_commit(db_path, commit_hash):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT content FROM ai_commits_one_shot WHERE hash=?", (commit_hash,))
-        return cursor.fetchone()[0]
-
-def update_evaluated(db_path, commit_hash, human_accuracy, ai_accuracy):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE evaluated
-            SET human_accuracy = ?, ai_accuracy = ?
-            WHERE hash = ?
-        """, (human_accuracy, ai_accuracy, commit_hash))
-        conn.commit()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter, connect
+from common.instrumentation import add_arguments, instrumented_from_args
+from common.sampling import fetch_rows, sample_rowids
+from rating_session import Prefetcher, RatingSession, create_session_tables, finish_session, latest_session, pending_hashes, start_session
+
+def get_commits(conn, num_commits, seed=None):
+    rng = random.Random(seed)
+    rowids = sample_rowids(conn, """
+    SELECT commits.rowid
+    FROM commits
+    JOIN ai_commits_one_shot ON commits.hash = ai_commits_one_shot.hash
+    LEFT JOIN evaluated ON commits.hash = evaluated.hash
+    WHERE evaluated.hash IS NULL OR evaluated.human_accuracy IS NULL OR evaluated.ai_accuracy IS NULL
+    """, num_commits, rng=rng)
+
+    # Only the hashes; messages and diffs are loaded by the prefetcher shortly before they are shown
+    results = fetch_rows(conn, """
+    SELECT commits.hash
+    FROM commits
+    WHERE commits.rowid IN (SELECT id FROM sampled_rowids)
+    """, rowids)
+
+    # The rows come back in rowid order, which would show older commits first
+    hashes = [row[0] for row in results]
+    rng.shuffle(hashes)
+    return hashes
 
 def open_diff_in_editor(diff):
     with open("temp_diff.diff", "w") as f:
         f.write(diff)
 
+def show_in_pager(text):
+    pager = subprocess.Popen(["less", "-R"], stdin=subprocess.PIPE, universal_newlines=True)
+    pager.communicate(input=text)
+
 RUBRIC = """1 = 1.0: The commit message accurately and completely describes the changes made in the code.
 2 = 0.8: The commit message accurately describes most of the changes, but misses some minor details.
 3 = 0.6: The commit message describes some of the changes accurately, but significant portions are missing or unclear.
@@ -57,47 +56,93 @@ def evaluate_messages(human_message, ai_message):
     messages = [("Human", human_message), ("AI", ai_message)]
     random.shuffle(messages)
     evaluations = {}
+    latencies = {}
     score_options = [1.0, 0.8, 0.6, 0.4, 0.2, 0.0]
 
     for label, message in messages:
         print("=" * 40 + "\n" + message + "\n" + "=" * 40 + "\n")
         
-        print("Select the score by entering the index (1-6):")
+        print("Select the score by entering the index (1-6), 0 to skip, u to undo the previous commit or q to quit:")
         # for idx, option in enumerate(score_options, start=1):
         #     print(f"{idx}. {option}")
         print(RUBRIC)
 
-        selected_index = click.prompt("Enter the index of the score", type=click.IntRange(0, 6)) - 1
+        start = time.perf_counter()
+        choice = click.prompt("Enter the index of the score", type=click.Choice(["0", "1", "2", "3", "4", "5", "6", "u", "q"]), show_choices=False)
+        if choice in ("u", "q"):
+            return choice, None, None
+        selected_index = int(choice) - 1
         if selected_index == -1:
             print("Skipping...")
-            return None
+            return "skip", None, None
         score = score_options[selected_index]
         evaluations[label.lower()] = score
-
-    return evaluations
-
-def main(db_path, num_commits):
-    commits = get_commits(db_path, num_commits)
-
-    for commit in commits:
-        commit_hash, human_message, ai_message, diff = commit
-
-        open_diff_in_editor(diff)
-
-        scores = evaluate_messages(human_message, ai_message)
-        if scores is None:
-            continue
-        update_evaluated(db_path, commit_hash, scores["human"], scores["ai"])
-
+        latencies[label.lower()] = time.perf_counter() - start
+
+    return "rated", evaluations, latencies
+
+def main(db_path, num_commits, prefetch, seed, resume, pager):
+    conn = connect(db_path)
+    create_session_tables(conn)
+
+    session_id = latest_session(conn) if resume else None
+    if session_id is None:
+        session_id = start_session(conn, get_commits(conn, num_commits, seed), seed)
+    hashes = pending_hashes(conn, session_id)
+    print(f"Rating session {session_id}: {len(hashes)} commits to rate")
+
+    prefetcher = Prefetcher(db_path, hashes, prefetch, highlighted=pager)
+    items = iter(prefetcher)
+    redo = []
+    stopped = False
+    # One connection for the whole session; ratings are written in batches
+    with BatchWriter(conn, batch_size=10, flush_interval_ms=5000) as writer:
+        session = RatingSession(conn, session_id, writer)
+        while True:
+            item = redo.pop() if redo else next(items, None)
+            if item is None:
+                break
+
+            open_diff_in_editor(item.diff)
+            if pager:
+                show_in_pager(item.highlighted)
+
+            action, scores, latencies = evaluate_messages(item.human_message, item.ai_message)
+            if action == "q":
+                stopped = True
+                break
+            if action == "u":
+                previous = session.undo()
+                # The current commit comes back after the undone one
+                redo.append(item)
+                if previous is not None:
+                    redo.append(previous)
+                    print(f"Undid the rating of {previous.hash}")
+                continue
+            if action == "rated":
+                session.record(item, scores["human"], scores["ai"], latencies["human"], latencies["ai"])
+
+    prefetcher.stop()
+    if os.path.exists("temp_diff.diff"):
         os.remove("temp_diff.diff")
+    if not stopped and not pending_hashes(conn, session_id):
+        finish_session(conn, session_id)
+    elif stopped:
+        print("Stopped; continue this session with --resume")
+    print(session.summary())
+    conn.close()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <path_to_database> <number_of_commits>")
-        sys.exit(1)
-
-    db_path = sys.argv[1]
-    num_commits = int(sys.argv[2])
-
-    main(db_path, num_commits)
+    parser = argparse.ArgumentParser(description='Rate the accuracy of human and AI commit messages against their diffs.')
+    parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    parser.add_argument('number_of_commits', type=int, help='Number of commits to rate in a new session.')
+    parser.add_argument('-k', '--prefetch', type=int, default=5, help='Number of upcoming commits loaded and highlighted in the background.')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='Random seed for a reproducible selection of commits.')
+    parser.add_argument('-r', '--resume', action='store_true', help='Continue the last unfinished session instead of starting a new one.')
+    parser.add_argument('-p', '--pager', action='store_true', help='Show the highlighted diff in less before rating.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_from_args(args):
+        main(args.database, args.number_of_commits, args.prefetch, args.seed, args.resume, args.pager)
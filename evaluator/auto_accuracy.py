@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import csv
+import time
+import sqlite3
+import argparse
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy import stats
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter, connect
+from common.diff_store import diff_sql
+from common.instrumentation import add_arguments, count, instrumented_from_args, timer
+from evaluator import create_evaluated_table
+
+# Estimates accuracy without a human: a message that names the files, identifiers and
+# changed code of its diff is more likely to describe it. Diffs and messages become sparse
+# term-count rows, weighted with TF-IDF over all diffs, and each message is compared with its
+# own diff only (a row-wise product, never a full similarity matrix).
+
+IDENTIFIER = re.compile(r"[A-Za-z][A-Za-z0-9]*(?:_+[A-Za-z0-9]+)*")
+SUBWORD = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+# Changed lines and the function context git puts after hunk headers; context lines are skipped
+CHANGED = re.compile(r"^(?:[+-](?!\+\+ |-- )|@@[^@]*@@)(.*)$", re.MULTILINE)
+PATHS = re.compile(r"^diff --git \"?a/(.*?)\"? \"?b/(.*?)\"?$", re.MULTILINE)
+
+# Function words, and the verbs and types every message uses whatever the diff contains
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "its", "of", "on",
+    "or", "so", "that", "the", "this", "to", "was", "when", "which", "with", "now", "not", "no", "all", "some",
+    "add", "added", "adds", "fix", "fixed", "fixes", "update", "updated", "updates", "remove", "removed", "change",
+    "changed", "changes", "use", "make", "improve", "implement", "support", "bump", "refactor", "clean", "cleanup",
+    "feat", "chore", "docs", "style", "perf", "test", "build", "ci", "revert", "wip", "minor", "new", "initial",
+}
+# A file name in the message is strong evidence, so path terms count more than code terms
+PATH_WEIGHT = 3
+MIN_TERM_LENGTH = 2
+
+@lru_cache(maxsize=200000)
+def split_identifier(identifier: str) -> Tuple[str, ...]:
+    # parseDiffFile and parse_diff_file both give parse, diff, file and the whole identifier
+    parts = [part.lower() for part in SUBWORD.findall(identifier)]
+    terms = parts if len(parts) > 1 else []
+    terms.append(identifier.lower())
+    return tuple(term for term in terms if len(term) >= MIN_TERM_LENGTH and term not in STOPWORDS)
+
+def text_terms(text: str, weight: int = 1, counts: Optional[Counter] = None) -> Counter:
+    counts = Counter() if counts is None else counts
+    for identifier, occurrences in Counter(IDENTIFIER.findall(text)).items():
+        for term in split_identifier(identifier):
+            counts[term] += occurrences * weight
+    return counts
+
+def diff_terms(diff: str, max_bytes: int) -> Counter:
+    if len(diff) > max_bytes:
+        diff = diff[:max_bytes]
+    counts = text_terms("\n".join(CHANGED.findall(diff)))
+    paths = {path for pair in PATHS.findall(diff) for path in pair}
+    return text_terms(" ".join(path.replace(".", " ") for path in paths), PATH_WEIGHT, counts)
+
+class TermRows:
+    # Accumulates term counts as CSR arrays; term ids come from a vocabulary shared by all rows
+    def __init__(self, vocabulary: Dict[str, int]):
+        self.vocabulary = vocabulary
+        # Typed arrays rather than lists keep 100k diffs' worth of entries compact
+        self.indptr = array("q", [0])
+        self.indices = array("i")
+        self.data = array("d")
+
+    def add(self, counts: Optional[Counter]) -> None:
+        for term, value in (counts or {}).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = self.vocabulary[term] = len(self.vocabulary)
+            self.indices.append(term_id)
+            self.data.append(value)
+        self.indptr.append(len(self.indices))
+
+    def matrix(self) -> sp.csr_matrix:
+        return sp.csr_matrix((np.frombuffer(self.data, dtype=np.float64), np.frombuffer(self.indices, dtype=np.int32),
+                              np.frombuffer(self.indptr, dtype=np.int64)), shape=(len(self.indptr) - 1, len(self.vocabulary)))
+
+def idf_weights(diffs: sp.csr_matrix) -> np.ndarray:
+    # Smoothed IDF over the diffs; message terms that no diff contains get the maximum weight
+    document_frequency = np.bincount(diffs.indices, minlength=diffs.shape[1])
+    return np.log((1 + diffs.shape[0]) / (1 + document_frequency)) + 1
+
+def tfidf(counts: sp.csr_matrix, idf: np.ndarray) -> sp.csr_matrix:
+    weighted = counts.copy()
+    weighted.data = (1 + np.log(weighted.data)) * idf[weighted.indices]
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    return sp.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)) @ weighted
+
+def row_sums(matrix: sp.spmatrix) -> np.ndarray:
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+def similarity(messages: sp.csr_matrix, diffs: sp.csr_matrix, idf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Cosine of the TF-IDF vectors, and the IDF-weighted share of message terms found in the diff
+    cosine = row_sums(tfidf(messages, idf).multiply(tfidf(diffs, idf)))
+    message_weights = messages.copy()
+    message_weights.data = idf[message_weights.indices]
+    present = diffs.copy()
+    present.data = np.ones_like(present.data)
+    total = row_sums(message_weights)
+    coverage = np.divide(row_sums(message_weights.multiply(present)), total, out=np.zeros_like(total), where=total > 0)
+    return cosine, coverage
+
+def estimate(cosine: np.ndarray, coverage: np.ndarray) -> np.ndarray:
+    return (cosine + coverage) / 2
+
+def load_terms(conn: sqlite3.Connection, chunk_size: int, max_diff_bytes: int):
+    expression, join = diff_sql(conn, "commits")
+    total = conn.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+    cursor = conn.execute(f"""
+        SELECT commits.hash, commits.message, ai_commits_one_shot.content, {expression},
+               evaluated.human_accuracy, evaluated.ai_accuracy
+        FROM commits
+        LEFT JOIN ai_commits_one_shot ON ai_commits_one_shot.hash = commits.hash
+        LEFT JOIN evaluated ON evaluated.hash = commits.hash
+        {join}
+    """)
+    vocabulary: Dict[str, int] = {}
+    diffs, humans, ais = TermRows(vocabulary), TermRows(vocabulary), TermRows(vocabulary)
+    hashes, has_diff, has_ai, manual = [], [], [], []
+    with tqdm(total=total, desc="Extracting terms", unit="commit") as progress_bar:
+        while True:
+            with timer("sqlite.fetch_chunk"):
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            with timer("auto_accuracy.terms"):
+                for commit_hash, message, ai_message, diff, human_accuracy, ai_accuracy in rows:
+                    terms = diff_terms(diff or "", max_diff_bytes)
+                    diffs.add(terms)
+                    humans.add(text_terms(message or ""))
+                    ais.add(text_terms(ai_message) if ai_message is not None else None)
+                    hashes.append(commit_hash)
+                    has_diff.append(bool(terms))
+                    has_ai.append(ai_message is not None)
+                    manual.append((human_accuracy, ai_accuracy))
+            progress_bar.update(len(rows))
+    count("auto_accuracy.commits", len(hashes))
+    count("auto_accuracy.terms", len(vocabulary))
+    manual = np.array(manual, dtype=float).reshape(-1, 2)
+    return hashes, diffs.matrix(), humans.matrix(), ais.matrix(), np.array(has_diff), np.array(has_ai), manual
+
+def add_columns(conn: sqlite3.Connection) -> None:
+    create_evaluated_table(conn)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(evaluated)")}
+    for column in ("human_auto_accuracy", "ai_auto_accuracy"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE evaluated ADD COLUMN {column} REAL")
+    conn.commit()
+
+def write_scores(conn: sqlite3.Connection, hashes: List[str], human: np.ndarray, ai: np.ndarray, chunk_size: int) -> None:
+    # Only the automatic columns are touched; manual ratings and the other scores stay as they are
+    sql = """
+        INSERT INTO evaluated (hash, human_auto_accuracy, ai_auto_accuracy) VALUES (?, ?, ?)
+        ON CONFLICT (hash) DO UPDATE SET human_auto_accuracy = excluded.human_auto_accuracy, ai_auto_accuracy = excluded.ai_auto_accuracy
+    """
+    with BatchWriter(conn, batch_size=chunk_size) as writer:
+        for commit_hash, human_score, ai_score in zip(hashes, human.tolist(), ai.tolist()):
+            writer.add(sql, (commit_hash, None if human_score != human_score else human_score, None if ai_score != ai_score else ai_score))
+
+RATING_STEP = 0.2
+
+def agreement(automatic: np.ndarray, manual: np.ndarray) -> Dict[str, float]:
+    # Manual ratings come in steps of 0.2; the estimate is snapped to the same grid for the bin rates
+    rated = ~np.isnan(automatic) & ~np.isnan(manual)
+    automatic, manual = automatic[rated], manual[rated]
+    result = {"n": int(rated.sum()), "pearson": np.nan, "spearman": np.nan, "mae": np.nan, "same_bin": np.nan, "within_one_bin": np.nan}
+    if result["n"] == 0:
+        return result
+    bins = np.abs(np.round(automatic / RATING_STEP) - np.round(manual / RATING_STEP))
+    result.update({"mae": float(np.abs(automatic - manual).mean()), "same_bin": float((bins == 0).mean()),
+                   "within_one_bin": float((bins <= 1).mean())})
+    if result["n"] >= 3 and automatic.std() > 0 and manual.std() > 0:
+        result["pearson"] = float(stats.pearsonr(automatic, manual)[0])
+        result["spearman"] = float(stats.spearmanr(automatic, manual)[0])
+    return result
+
+def agreement_report(measures: Dict[str, Tuple[np.ndarray, np.ndarray]], manual: np.ndarray) -> List[Dict]:
+    rows = []
+    for name, (human, ai) in measures.items():
+        for source, automatic, rated in (("human", human, manual[:, 0]), ("ai", ai, manual[:, 1]),
+                                         ("both", np.concatenate([human, ai]), np.concatenate([manual[:, 0], manual[:, 1]]))):
+            rows.append({"measure": name, "source": source, **agreement(automatic, rated)})
+    return rows
+
+def write_agreement(rows: List[Dict], path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def print_agreement(rows: List[Dict]) -> None:
+    print(f"{'measure':<10} {'source':<6} {'n':>6} {'pearson':>8} {'spearman':>9} {'mae':>6} {'same bin':>9} {'±1 bin':>7}")
+    for row in rows:
+        print(f"{row['measure']:<10} {row['source']:<6} {row['n']:>6} {row['pearson']:>8.3f} {row['spearman']:>9.3f} "
+              f"{row['mae']:>6.3f} {row['same_bin']:>9.3f} {row['within_one_bin']:>7.3f}")
+
+def main(database_path: str, chunk_size: int, max_diff_bytes: int, agreement_path: Optional[str], report: Optional[Dict] = None):
+    conn = connect(database_path)
+    add_columns(conn)
+
+    start = time.perf_counter()
+    hashes, diffs, humans, ais, has_diff, has_ai, manual = load_terms(conn, chunk_size, max_diff_bytes)
+    # IDF is taken over the whole corpus, so every run rescores every commit
+    with timer("auto_accuracy.similarity"):
+        idf = idf_weights(diffs)
+        human_cosine, human_coverage = similarity(humans, diffs, idf)
+        ai_cosine, ai_coverage = similarity(ais, diffs, idf)
+    # Nothing to compare against without code terms in the diff, or without an AI message
+    missing_human, missing_ai = ~has_diff, ~has_diff | ~has_ai
+    for values, missing in ((human_cosine, missing_human), (human_coverage, missing_human), (ai_cosine, missing_ai), (ai_coverage, missing_ai)):
+        values[missing] = np.nan
+    human_estimate, ai_estimate = estimate(human_cosine, human_coverage), estimate(ai_cosine, ai_coverage)
+
+    with timer("sqlite.write_scores"):
+        write_scores(conn, hashes, human_estimate, ai_estimate, chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {len(hashes)} commits ({diffs.shape[1]} distinct terms) in {elapsed:.2f}s ({len(hashes) / max(elapsed, 1e-9):.0f} commits/s)")
+
+    rows = agreement_report({
+        "estimate": (human_estimate, ai_estimate),
+        "cosine": (human_cosine, ai_cosine),
+        "coverage": (human_coverage, ai_coverage),
+    }, manual)
+    if not any(row["n"] for row in rows):
+        print("No manual accuracy ratings to compare with; rate some commits with accuracy.py")
+    else:
+        print_agreement(rows)
+        if agreement_path:
+            write_agreement(rows, agreement_path)
+            print(f"Wrote the agreement with the manual ratings to {agreement_path}")
+    if report is not None:
+        report.update({"commits": len(hashes), "terms": diffs.shape[1],
+                       "rated": int((~np.isnan(manual)).any(axis=1).sum())})
+    conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate the accuracy of human and AI commit messages from their overlap with the diff.')
+    parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Commits read and written per chunk.')
+    parser.add_argument('--max-diff-bytes', type=int, default=200000, help='Only this many leading characters of larger diffs are read, e.g. for generated files.')
+    parser.add_argument('-a', '--agreement', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'results', 'accuracy_agreement.csv'),
+                        help='CSV receiving the agreement with the manual ratings from accuracy.py.')
+
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_from_args(args) as report:
+        main(args.database, args.chunk_size, args.max_diff_bytes, args.agreement, report)
@@ -1,11 +1,21 @@
 import sqlite3
 import argparse
+import os
 import sys
-import re
-from typing import Optional, Dict
+import hashlib
+import time
+from functools import lru_cache
+from typing import Optional, Dict, List, Sequence
 from tqdm import tqdm
-import textstat
-import spacy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter, connect
+from common.instrumentation import add_arguments, instrumented_from_args, timer
+from overall import print_update, track_changes, update_overall
+from scorers import ScoringEngine, stored_metrics
+
+# Bump whenever a change to the scoring functions should invalidate stored scores
+SCORER_VERSION = 2
 
 def create_evaluated_table(conn: sqlite3.Connection):
     cursor = conn.cursor()
@@ -19,77 +29,53 @@ def create_evaluated_table(conn: sqlite3.Connection):
         ai_adherence REAL,
         ai_readability REAL,
         ai_accuracy REAL,
-        ai_overall REAL
+        ai_overall REAL,
+        fingerprint TEXT,
+        scorer_version INTEGER
     )
     ''')
-    conn.commit()
-
-def insert_evaluated(conn: sqlite3.Connection, hash: str, human_scores: Dict[str, float], ai_scores: Dict[str, float]):
-    cursor = conn.cursor()
-    cursor.execute('''
-    INSERT INTO evaluated (
-        hash, 
-        human_adherence, human_readability, human_accuracy, human_overall,
-        ai_adherence, ai_readability, ai_accuracy, ai_overall
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        hash,
-        human_scores['adherence'], human_scores['readability'], human_scores['accuracy'], human_scores.get('overall'),
-        ai_scores['adherence'], ai_scores['readability'], ai_scores['accuracy'], ai_scores.get('overall')
-    ))
-    conn.commit()
 
-def update_overall_scores(conn: sqlite3.Connection, hash: str, human_overall: Optional[float], ai_overall: Optional[float]):
-    cursor = conn.cursor()
-    cursor.execute('''
-    UPDATE evaluated
-    SET human_overall = ?, ai_overall = ?
-    WHERE hash = ?
-    ''', (human_overall, ai_overall, hash))
+    # Tables created before incremental evaluation lack the bookkeeping columns, and every
+    # stored scorer gets a human and an AI column
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(evaluated)')}
+    if 'fingerprint' not in columns:
+        cursor.execute('ALTER TABLE evaluated ADD COLUMN fingerprint TEXT')
+    if 'scorer_version' not in columns:
+        cursor.execute('ALTER TABLE evaluated ADD COLUMN scorer_version INTEGER')
+    for metric in stored_metrics():
+        for prefix in ('human', 'ai'):
+            if f'{prefix}_{metric}' not in columns:
+                cursor.execute(f'ALTER TABLE evaluated ADD COLUMN {prefix}_{metric} REAL')
     conn.commit()
-
-def parse_commit_message(message: str) -> Optional[Dict[str, str]]:
-    pattern = r'^(?P<type>\w+)(\((?P<scope>.+)\))?:\s(?P<message>[^\r\n]*)(?P<body>(?:\r?\n){2}[\s\S]*)?'
-    match = re.match(pattern, message)
-
-    if match:
-        return match.groupdict()
-    else:
-        return None
-
-nlp = spacy.load('en_core_web_sm')
-
-def evaluate_pos(message: Optional[str]) -> float:
-    if message is None:
-        return 0.0
-
-    doc = nlp(message)
-
-    is_present_tense = False
-    has_subject = False
-    has_verb = False
-    has_object = False
-
-    for token in doc:
-        if token.tag_ in {"VB", "VBP", "VBZ", "VBG"}:
-            is_present_tense = True
-        if token.dep_ == "nsubj":
-            has_subject = True
-        if token.pos_ == "VERB":
-            has_verb = True
-        if token.dep_ in {"dobj", "attr"}:
-            has_object = True
-
-    sentence_structure_score = 1.0 if has_subject and has_verb and has_object else 0.0
-    tense_score = 1.0 if is_present_tense else 0.0
-
-    combined_score = (sentence_structure_score + tense_score) / 2
-    return combined_score
-
-def evaluate_flesch(message: str) -> float:
-    score = textstat.flesch_reading_ease(message)
-    normalized_score = max(0, min(1, (score - 0) / (65 - 0)))
-    return normalized_score
+    track_changes(conn)
+
+def fingerprint(message: str, ai_content: Optional[str]) -> str:
+    digest = hashlib.sha256(message.encode('utf-8', 'replace'))
+    digest.update(b'\0')
+    if ai_content is not None:
+        digest.update(ai_content.encode('utf-8', 'replace'))
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def upsert_sql(metrics: Sequence[str]) -> str:
+    # Only the automatic columns are written; manual accuracy ratings from accuracy.py survive
+    # a re-score, while the overall scores derived from them are cleared until recomputed.
+    columns = [f'{prefix}_{metric}' for prefix in ('human', 'ai') for metric in metrics]
+    return f'''
+    INSERT INTO evaluated (hash, {', '.join(columns)}, fingerprint, scorer_version)
+    VALUES ({', '.join('?' * (len(columns) + 3))})
+    ON CONFLICT (hash) DO UPDATE SET
+        {''.join(f'{column} = excluded.{column}, ' for column in columns)}
+        human_overall = NULL,
+        ai_overall = NULL,
+        overall_stale = 1,
+        fingerprint = excluded.fingerprint,
+        scorer_version = excluded.scorer_version
+    '''
+
+def upsert_evaluated(writer: BatchWriter, hash: str, metrics: Sequence[str], human_scores: Sequence[Optional[float]],
+                     ai_scores: Sequence[Optional[float]], fingerprint: str):
+    writer.add(upsert_sql(tuple(metrics)), (hash, *human_scores, *ai_scores, fingerprint, SCORER_VERSION))
 
 def delete_evaluated_table(conn: sqlite3.Connection):
     cursor = conn.cursor()
@@ -97,34 +83,13 @@ def delete_evaluated_table(conn: sqlite3.Connection):
     conn.commit()
     print('Deleted evaluated table.')
 
-def evaluate_commit(commit) -> Dict[str, Optional[float]]:
-    # hash, message, _ = commit
-    hash = commit[0]
-    message = commit[1]
-    
-    parsed_message = parse_commit_message(message)
-
-    if parsed_message:
-        adherence_score = 1.0
-        pos_score = evaluate_pos(parsed_message['message'])
-        if parsed_message['body']:
-            flesch_score = evaluate_flesch(parsed_message['body'])
-        else:
-            flesch_score = evaluate_flesch(parsed_message['message'])
-        readability_score = (pos_score + flesch_score) / 2
-    else:
-        adherence_score = 0.0
-        readability_score = evaluate_flesch(message)
-
-    return {
-        'adherence': adherence_score,
-        'readability': readability_score,
-        'accuracy': None,
-        'overall': None
-    }
-
-def main(database_path: str, reset: bool, fill_overall: bool):
-    conn = sqlite3.connect(database_path)
+def score_rows(frame, metrics: Sequence[str]) -> List[List[Optional[float]]]:
+    # NaN means "does not apply" and is stored as NULL
+    return [[None if value != value else float(value) for value in row] for row in frame[list(metrics)].to_numpy()]
+
+def main(database_path: str, reset: bool, fill_overall: bool, batch_size: int, n_process: int, chunk_size: int, rescore: bool, weights: List[float],
+         workers: int, score_cache_size: int, report: Optional[Dict] = None):
+    conn = connect(database_path)
 
     if reset:
         delete_evaluated_table(conn)
@@ -133,33 +98,61 @@ def main(database_path: str, reset: bool, fill_overall: bool):
 
     create_evaluated_table(conn)
 
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM commits')
-    human_commits = cursor.fetchall()
-
-    cursor.execute('SELECT * FROM ai_commits_one_shot')
-    ai_commits = cursor.fetchall()
-
-    total_commits = len(human_commits)
-
-    for commit in tqdm(human_commits, total=total_commits, desc="Evaluating human commits", unit="commit"):
-        human_scores = evaluate_commit(commit)
-        ai_commit = [row for row in ai_commits if row[0] == commit[0]]
-        if ai_commit:
-            ai_scores = evaluate_commit(ai_commit[0])
-        else:
-            ai_scores = {'adherence': None, 'readability': None, 'accuracy': None}
+    # A separate read connection streams the join while the writer commits batches (WAL)
+    read_conn = sqlite3.connect(database_path)
+    read_cursor = read_conn.cursor()
+    read_cursor.execute('SELECT COUNT(*) FROM commits')
+    total_commits = read_cursor.fetchone()[0]
+
+    read_cursor.execute('''
+    SELECT commits.hash, commits.message, ai_commits_one_shot.content, evaluated.fingerprint, evaluated.scorer_version
+    FROM commits
+    LEFT JOIN ai_commits_one_shot ON ai_commits_one_shot.hash = commits.hash
+    LEFT JOIN evaluated ON evaluated.hash = commits.hash
+    ''')
 
-        insert_evaluated(conn, commit[0], human_scores, ai_scores)
+    metrics = stored_metrics()
+    missing = [None] * len(metrics)
+    scored = 0
+    engine = ScoringEngine(metrics, batch_size, n_process, workers, score_cache_size)
+    with engine, BatchWriter(conn, batch_size=chunk_size) as writer, tqdm(total=total_commits, desc="Evaluating commits", unit="commit") as progress_bar:
+        while True:
+            with timer("sqlite.fetch_chunk"):
+                chunk = read_cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            progress_bar.update(len(chunk))
+
+            # Skip commits whose messages are unchanged since they were scored by this scorer version
+            rows = []
+            for hash, message, content, stored_fingerprint, stored_version in chunk:
+                current_fingerprint = fingerprint(message, content)
+                if rescore or stored_fingerprint != current_fingerprint or stored_version != SCORER_VERSION:
+                    rows.append((hash, message, content, current_fingerprint))
+            if not rows:
+                continue
+
+            human_scores = score_rows(engine.score([message for _, message, _, _ in rows]), metrics)
+            ai_rows = [(hash, content) for hash, _, content, _ in rows if content is not None]
+            ai_scores = dict(zip(
+                [hash for hash, _ in ai_rows],
+                score_rows(engine.score([content for _, content in ai_rows]), metrics)
+            ))
+
+            for (hash, _, _, current_fingerprint), scores in zip(rows, human_scores):
+                upsert_evaluated(writer, hash, metrics, scores, ai_scores.get(hash, missing), current_fingerprint)
+            scored += len(rows)
+
+    read_conn.close()
+    print(f"Scored {scored} commits, {total_commits - scored} unchanged ({engine.hits} repeated messages reused)")
+    if report is not None:
+        report.update({"commits": total_commits, "scored": scored, "unchanged": total_commits - scored})
 
     if fill_overall:
-        cursor.execute('SELECT * FROM evaluated')
-        evaluated_commits = cursor.fetchall()
-        for commit in tqdm(evaluated_commits, total=len(evaluated_commits), desc="Filling overall scores", unit="commit"):
-            hash, human_adherence, human_readability, human_accuracy, _, ai_adherence, ai_readability, ai_accuracy, _ = commit
-            human_overall = calculate_overall_score(human_adherence, human_readability, human_accuracy)
-            ai_overall = calculate_overall_score(ai_adherence, ai_readability, ai_accuracy)
-            update_overall_scores(conn, hash, human_overall, ai_overall)
+        start = time.perf_counter()
+        with timer("sqlite.update_overall"):
+            num_rows, incomplete = update_overall(conn, weights)
+        print_update(num_rows, incomplete, time.perf_counter() - start)
 
     conn.close()
 
@@ -168,7 +161,18 @@ if __name__ == '__main__':
     parser.add_argument('database', type=str, help='Path to the SQLite database file.')
     parser.add_argument('--reset', action='store_true', help='Delete the evaluated table and exit.')
     parser.add_argument('-o', '--overall', action='store_true', help='Fill in the overall scores for each row.')
-
+    parser.add_argument('-w', '--weights', type=float, nargs=3, default=[1, 1, 1], metavar=('ADHERENCE', 'READABILITY', 'ACCURACY'),
+                        help='Weights of adherence, readability and accuracy in the overall score.')
+    parser.add_argument('--batch-size', type=int, default=256, help='Messages per spaCy batch.')
+    parser.add_argument('--n-process', type=int, default=1, help='Number of spaCy worker processes.')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Commits read, scored and written per chunk.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of scorers run in parallel.')
+    parser.add_argument('--score-cache-size', type=int, default=100000, help='Distinct messages whose scores are kept in memory.')
+    parser.add_argument('--rescore', action='store_true', help='Score every commit again, even if unchanged. Manual accuracy ratings are kept.')
+
+    add_arguments(parser)
     args = parser.parse_args()
-    
-    main(args.database, args.reset, args.overall)
+
+    with instrumented_from_args(args) as report:
+        main(args.database, args.reset, args.overall, args.batch_size, args.n_process, args.chunk_size, args.rescore, args.weights,
+             args.workers, args.score_cache_size, report)
@@ -1,36 +1,77 @@
-import sqlite3
-import sys
-from tqdm import tqdm
-
-def calculate_overall_score(adherence, readability, accuracy):
-    return (adherence + readability + accuracy) / 3
-
-def update_table(database_path):
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT COUNT(*) FROM evaluated")
-    num_rows = cursor.fetchone()[0]
-
-    cursor.execute("SELECT hash, human_adherence, human_readability, human_accuracy, ai_adherence, ai_readability, ai_accuracy FROM evaluated")
-    records = cursor.fetchall()
-
-    with tqdm(total=num_rows, desc="Updating scores", ncols=100) as pbar:
-        for record in records:
-            hash_id, human_adherence, human_readability, human_accuracy, ai_adherence, ai_readability, ai_accuracy = record
-            human_overall = calculate_overall_score(human_adherence, human_readability, human_accuracy)
-            ai_overall = calculate_overall_score(ai_adherence, ai_readability, ai_accuracy)
-
-            cursor.execute("UPDATE evaluated SET human_overall = ?, ai_overall = ? WHERE hash = ?", (human_overall, ai_overall, hash_id))
-            conn.commit()
-            pbar.update(1)
-
-    conn.close()
-
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python update_scores.py <path_to_database>")
-        sys.exit(1)
-
-    database_path = sys.argv[1]
-    update_table(database_path)
+import json
+import sqlite3
+import time
+import argparse
+from typing import Sequence, Tuple
+
+METRICS = ("adherence", "readability", "accuracy")
+INPUT_COLUMNS = [f"{prefix}_{metric}" for prefix in ("human", "ai") for metric in METRICS]
+
+def overall_expression(prefix: str, weights: Sequence[float]) -> str:
+    # Weighted mean of the metrics with a non-zero weight. Any of them being NULL (e.g. no
+    # manual accuracy rating yet) makes the whole expression NULL instead of a partial score,
+    # which would not be comparable; update_overall counts these rows.
+    terms = [(f"{prefix}_{metric}", float(weight)) for metric, weight in zip(METRICS, weights) if weight]
+    if not terms:
+        raise ValueError("At least one weight must be non-zero")
+    total = sum(weight for _, weight in terms)
+    return "(" + " + ".join(f"{weight!r} * {column}" for column, weight in terms) + f") / {total!r}"
+
+def track_changes(conn: sqlite3.Connection) -> None:
+    # Rows whose inputs changed since the last update_overall carry overall_stale = 1: new rows
+    # through the default, changed ones through a trigger, so every writer (the evaluator, rating
+    # sessions, notebooks) is covered and an update only visits those rows through a partial index.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(evaluated)")}
+    if "overall_stale" not in columns:
+        conn.execute("ALTER TABLE evaluated ADD COLUMN overall_stale INTEGER DEFAULT 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_evaluated_overall_stale ON evaluated (overall_stale) WHERE overall_stale = 1")
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in INPUT_COLUMNS)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS evaluated_overall_stale AFTER UPDATE OF {', '.join(INPUT_COLUMNS)} ON evaluated
+        WHEN NEW.overall_stale IS NOT 1 AND ({changed})
+        BEGIN UPDATE evaluated SET overall_stale = 1 WHERE rowid = NEW.rowid; END
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS overall_state (id INTEGER PRIMARY KEY CHECK (id = 0), weights TEXT)")
+    conn.commit()
+
+def update_overall(conn: sqlite3.Connection, weights: Sequence[float] = (1, 1, 1)) -> Tuple[int, int]:
+    # Returns the number of recomputed rows and how many of them lack a weighted component
+    human = overall_expression("human", weights)
+    ai = overall_expression("ai", weights)
+    track_changes(conn)
+    key = json.dumps([float(weight) for weight in weights])
+    stored = conn.execute("SELECT weights FROM overall_state WHERE id = 0").fetchone()
+    # Only rows whose inputs changed, unless the weights did; then every row whose values differ
+    scope = "overall_stale = 1" if stored is not None and stored[0] == key else "1"
+    with conn:
+        incomplete = conn.execute(f"SELECT COUNT(*) FROM evaluated WHERE {scope} AND ({human} IS NULL OR {ai} IS NULL)").fetchone()[0]
+        cursor = conn.execute(f'''
+        UPDATE evaluated SET
+            human_overall = {human},
+            ai_overall = {ai},
+            overall_stale = 0
+        WHERE {scope} AND (overall_stale IS NOT 0 OR human_overall IS NOT {human} OR ai_overall IS NOT {ai})
+        ''')
+        conn.execute("INSERT OR REPLACE INTO overall_state (id, weights) VALUES (0, ?)", (key,))
+    return cursor.rowcount, incomplete
+
+def print_update(num_rows: int, incomplete: int, seconds: float) -> None:
+    print(f"Updated overall scores of {num_rows} rows in {seconds:.3f}s")
+    if incomplete:
+        print(f"{incomplete} of them lack a weighted score (e.g. no accuracy rating yet), so their overall score is NULL")
+
+def update_table(database_path, weights=(1, 1, 1)):
+    conn = sqlite3.connect(database_path)
+    start = time.perf_counter()
+    num_rows, incomplete = update_overall(conn, weights)
+    print_update(num_rows, incomplete, time.perf_counter() - start)
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute the overall scores of all evaluated commits.')
+    parser.add_argument('database', type=str, help='Path to the SQLite database file.')
+    parser.add_argument('-w', '--weights', type=float, nargs=3, default=[1, 1, 1], metavar=('ADHERENCE', 'READABILITY', 'ACCURACY'),
+                        help='Weights of adherence, readability and accuracy in the overall score.')
+    args = parser.parse_args()
+
+    update_table(args.database, args.weights)
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Tuple
+from pygments import highlight
+from pygments.lexers import DiffLexer
+from pygments.formatters import TerminalFormatter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter
+from common.diff_store import diff_sql
+from common.instrumentation import count, timer
+
+RatingItem = namedtuple("RatingItem", ["hash", "human_message", "ai_message", "diff", "highlighted"])
+Rating = namedtuple("Rating", ["item", "sequence", "human_accuracy", "ai_accuracy"])
+
+def create_session_tables(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE TABLE IF NOT EXISTS rating_sessions (id INTEGER PRIMARY KEY, started REAL, finished REAL, seed INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS rating_queue (session_id INTEGER, position INTEGER, hash TEXT, PRIMARY KEY (session_id, position))")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ratings (
+            session_id INTEGER,
+            sequence INTEGER,
+            hash TEXT,
+            human_accuracy REAL,
+            ai_accuracy REAL,
+            human_seconds REAL,
+            ai_seconds REAL,
+            rated_at REAL,
+            undone INTEGER DEFAULT 0,
+            PRIMARY KEY (session_id, sequence)
+        )
+    """)
+    conn.commit()
+
+def start_session(conn: sqlite3.Connection, hashes: List[str], seed: Optional[int]) -> int:
+    # The planned order is stored, so an interrupted session resumes with the same commits
+    with conn:
+        session_id = conn.execute("INSERT INTO rating_sessions (started, seed) VALUES (?, ?)", (time.time(), seed)).lastrowid
+        conn.executemany("INSERT INTO rating_queue (session_id, position, hash) VALUES (?, ?, ?)",
+                         ((session_id, position, commit_hash) for position, commit_hash in enumerate(hashes)))
+    return session_id
+
+def latest_session(conn: sqlite3.Connection) -> Optional[int]:
+    row = conn.execute("SELECT MAX(id) FROM rating_sessions WHERE finished IS NULL").fetchone()
+    return row[0] if row else None
+
+def pending_hashes(conn: sqlite3.Connection, session_id: int) -> List[str]:
+    return [row[0] for row in conn.execute("""
+        SELECT rating_queue.hash FROM rating_queue
+        WHERE rating_queue.session_id = ? AND NOT EXISTS (
+            SELECT 1 FROM ratings WHERE ratings.session_id = rating_queue.session_id
+            AND ratings.hash = rating_queue.hash AND ratings.undone = 0
+        )
+        ORDER BY rating_queue.position
+    """, (session_id,))]
+
+def finish_session(conn: sqlite3.Connection, session_id: int) -> None:
+    with conn:
+        conn.execute("UPDATE rating_sessions SET finished = ? WHERE id = ?", (time.time(), session_id))
+
+# Loads and highlights the next `depth` items on a background thread with its own read
+# connection, so the rater never waits on SQLite, decompression or pygments.
+class Prefetcher:
+    def __init__(self, database_path: str, hashes: List[str], depth: int = 5, highlighted: bool = True):
+        self.database_path = database_path
+        self.hashes = hashes
+        self.highlighted = highlighted
+        self.items: "queue.Queue[Optional[RatingItem]]" = queue.Queue(maxsize=max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rating-prefetch", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Optional[RatingItem]) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        conn = sqlite3.connect(self.database_path)
+        expression, join = diff_sql(conn, "commits")
+        query = f"""
+            SELECT commits.message, ai_commits_one_shot.content, {expression}
+            FROM commits
+            JOIN ai_commits_one_shot ON commits.hash = ai_commits_one_shot.hash
+            {join}
+            WHERE commits.hash = ?
+        """
+        try:
+            for commit_hash in self.hashes:
+                row = conn.execute(query, (commit_hash,)).fetchone()
+                if row is None:
+                    continue
+                human_message, ai_message, diff = row
+                diff = diff or ""
+                with timer("rating.highlight"):
+                    highlighted = highlight(diff, DiffLexer(), TerminalFormatter()) if self.highlighted else diff
+                if not self._put(RatingItem(commit_hash, human_message, ai_message, diff, highlighted)):
+                    return
+        finally:
+            conn.close()
+            self._put(None)
+
+    def __iter__(self) -> Iterator[RatingItem]:
+        while True:
+            with timer("rating.prefetch_wait"):
+                item = self.items.get()
+            if item is None:
+                return
+            yield item
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+class RatingSession:
+    def __init__(self, conn: sqlite3.Connection, session_id: int, writer: BatchWriter):
+        self.conn = conn
+        self.session_id = session_id
+        self.writer = writer
+        self.history: List[Rating] = []
+        self.latencies: List[float] = []
+        # Accuracy values from before this session, for undo; read once per hash because
+        # later values may still sit in the writer's buffer
+        self._original: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        row = conn.execute("SELECT MAX(sequence) FROM ratings WHERE session_id = ?", (session_id,)).fetchone()
+        self._sequence = (row[0] + 1) if row and row[0] is not None else 0
+
+    def record(self, item: RatingItem, human_accuracy: float, ai_accuracy: float, human_seconds: float, ai_seconds: float) -> None:
+        if item.hash not in self._original:
+            row = self.conn.execute("SELECT human_accuracy, ai_accuracy FROM evaluated WHERE hash = ?", (item.hash,)).fetchone()
+            self._original[item.hash] = row if row else (None, None)
+
+        # Commits that were never scored get an evaluated row holding only the ratings
+        self.writer.add("""
+            INSERT INTO evaluated (hash, human_accuracy, ai_accuracy) VALUES (?, ?, ?)
+            ON CONFLICT (hash) DO UPDATE SET human_accuracy = excluded.human_accuracy, ai_accuracy = excluded.ai_accuracy
+        """, (item.hash, human_accuracy, ai_accuracy))
+        self.writer.add("""
+            INSERT INTO ratings (session_id, sequence, hash, human_accuracy, ai_accuracy, human_seconds, ai_seconds, rated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (self.session_id, self._sequence, item.hash, human_accuracy, ai_accuracy, human_seconds, ai_seconds, time.time()))
+        self.history.append(Rating(item, self._sequence, human_accuracy, ai_accuracy))
+        self.latencies.append(human_seconds + ai_seconds)
+        self._sequence += 1
+        count("rating.items")
+
+    def undo(self) -> Optional[RatingItem]:
+        # Restores the previous accuracy values and hands the item back to be rated again
+        if not self.history:
+            return None
+        rating = self.history.pop()
+        self.latencies.pop()
+        human_accuracy, ai_accuracy = self._original[rating.item.hash]
+        self.writer.add("UPDATE evaluated SET human_accuracy = ?, ai_accuracy = ? WHERE hash = ?",
+                        (human_accuracy, ai_accuracy, rating.item.hash))
+        self.writer.add("UPDATE ratings SET undone = 1 WHERE session_id = ? AND sequence = ?", (self.session_id, rating.sequence))
+        count("rating.undos")
+        return rating.item
+
+    def summary(self) -> str:
+        if not self.latencies:
+            return "No commits rated"
+        latencies = sorted(self.latencies)
+        median = latencies[len(latencies) // 2]
+        total = sum(latencies)
+        return (f"Rated {len(latencies)} commits, median {median:.1f}s per commit, "
+                f"{len(latencies) / max(total, 1e-9) * 3600:.0f} commits/hour while rating")
@@ -0,0 +1,55 @@
+import sys
+import json
+import socket
+import argparse
+from typing import Dict, List, Optional, Sequence
+
+# Talks to score_server.py --socket. Only the standard library is imported here, so a hook
+# that scores one message does not pay for numpy, pandas or spaCy.
+
+def request(socket_path: str, payload: Dict, timeout: float = 30.0) -> Dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(payload).encode('utf-8') + b"\n")
+        with connection.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError(f"Scoring server at {socket_path} closed the connection")
+    response = json.loads(line)
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response
+
+def score_messages(socket_path: str, messages: Sequence[str], scorers: Optional[Sequence[str]] = None,
+                   timeout: float = 30.0) -> List[Dict[str, Optional[float]]]:
+    payload = {"messages": list(messages)}
+    if scorers:
+        payload["scorers"] = list(scorers)
+    return request(socket_path, payload, timeout)["scores"]
+
+def format_scores(scores: Dict[str, Optional[float]]) -> str:
+    return " ".join(f"{name}={'-' if value is None else f'{value:.3f}'}" for name, value in scores.items())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score commit messages with a running score_server.py.')
+    parser.add_argument('socket', type=str, help='Unix socket the server listens on.')
+    parser.add_argument('messages', type=str, nargs='*', help='Messages to score. Without any, all of stdin is scored as one message.')
+    parser.add_argument('-s', '--scorers', type=str, nargs='+', default=None, help='Scorers to run (default: the stored ones).')
+    parser.add_argument('--json', action='store_true', help='Print one JSON object per message.')
+    parser.add_argument('--ping', action='store_true', help='Only check that the server is up.')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for the server.')
+    args = parser.parse_args()
+
+    try:
+        if args.ping:
+            print(json.dumps(request(args.socket, {"op": "stats"}, args.timeout)))
+            sys.exit(0)
+        messages = args.messages or [sys.stdin.read()]
+        results = score_messages(args.socket, messages, args.scorers, args.timeout)
+    except (OSError, ValueError) as error:
+        print(f"Scoring failed: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    for scores in results:
+        print(json.dumps(scores) if args.json else format_scores(scores))
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, TextIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import add_arguments, count, instrumented_from_args, timer
+from scorers import SCORERS, ScoringEngine, stored_metrics
+
+# A long-lived scorer that keeps spaCy loaded. It speaks JSON lines, either on stdin/stdout
+# (for a parent process that owns it) or on a Unix socket (for hooks; see score_client.py):
+#   {"messages": ["fix: ..."], "scorers": ["adherence"], "id": 1}
+#     -> {"scores": [{"adherence": 1.0}], "ms": 0.4, "id": 1}
+#   {"op": "stats"} -> {"requests": ..., "messages": ..., "cache_hits": ..., "uptime_s": ...}
+# Scores that do not apply are null; errors come back as {"error": "..."}.
+
+class ScoreService:
+    def __init__(self, batch_size: int = 256, workers: int = 4, cache_size: int = 100000, max_engines: int = 8):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.cache_size = cache_size
+        self.max_engines = max(max_engines, 1)
+        self.default_scorers = tuple(stored_metrics())
+        # One engine per scorer combination, least recently used first; each has its own pool and cache
+        self.engines: "OrderedDict[tuple, ScoringEngine]" = OrderedDict()
+        self.evicted_hits = 0
+        self.evicted_misses = 0
+        # ScoringEngine and its cache are not thread safe; batches are small, so one at a time is fine
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.messages = 0
+
+    def engine(self, names: Sequence[str]) -> ScoringEngine:
+        # Called with the lock held
+        key = tuple(names)
+        if key in self.engines:
+            self.engines.move_to_end(key)
+            return self.engines[key]
+        while len(self.engines) >= self.max_engines:
+            _, evicted = self.engines.popitem(last=False)
+            self.evicted_hits += evicted.hits
+            self.evicted_misses += evicted.misses
+            evicted.close()
+            count("score_server.engine_evictions")
+        self.engines[key] = ScoringEngine(key, self.batch_size, 1, self.workers, self.cache_size)
+        return self.engines[key]
+
+    def warm_up(self) -> None:
+        with self.lock, timer("score_server.warm_up"):
+            self.engine(self.default_scorers).warm_up()
+
+    def score(self, messages: List[str], names: Sequence[str]) -> List[Dict[str, Optional[float]]]:
+        with self.lock:
+            frame = self.engine(names).score(messages)
+        rows = frame[list(names)].to_numpy()
+        return [{name: None if value != value else float(value) for name, value in zip(names, row)} for row in rows]
+
+    def handle(self, request: Dict) -> Dict:
+        if request.get("op") == "stats":
+            with self.lock:
+                return {
+                    "requests": self.requests,
+                    "messages": self.messages,
+                    "cache_hits": self.evicted_hits + sum(engine.hits for engine in self.engines.values()),
+                    "cache_misses": self.evicted_misses + sum(engine.misses for engine in self.engines.values()),
+                    "engines": len(self.engines),
+                    "uptime_s": time.time() - self.started,
+                }
+        if "op" in request:
+            raise ValueError(f"Unknown op {request['op']!r}")
+
+        messages = request.get("messages")
+        if not isinstance(messages, list) or not all(isinstance(message, str) for message in messages):
+            raise ValueError("'messages' must be a list of strings")
+        names = request.get("scorers") or self.default_scorers
+        if not isinstance(names, (list, tuple)) or not all(isinstance(name, str) for name in names):
+            raise ValueError("'scorers' must be a list of scorer names")
+        names = tuple(names)
+        unknown = [name for name in names if name not in SCORERS]
+        if unknown:
+            raise ValueError(f"Unknown scorers: {', '.join(unknown)}")
+
+        start = time.perf_counter()
+        with timer("score_server.request"):
+            scores = self.score(messages, names) if messages else []
+        # Socket connections are handled on their own threads
+        with self.lock:
+            self.requests += 1
+            self.messages += len(messages)
+        count("score_server.messages", len(messages))
+        return {"scores": scores, "ms": (time.perf_counter() - start) * 1000}
+
+    def handle_line(self, line: str) -> str:
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Requests must be JSON objects")
+            request_id = request.get("id")
+            response = self.handle(request)
+        except ValueError as error:
+            count("score_server.errors")
+            response = {"error": str(error)}
+        except Exception as error:
+            # A failing scorer or a missing spaCy model must not take the server down
+            count("score_server.errors")
+            response = {"error": f"{type(error).__name__}: {error}"}
+        if request_id is not None:
+            response["id"] = request_id
+        return json.dumps(response)
+
+    def close(self) -> None:
+        for engine in self.engines.values():
+            engine.close()
+
+def serve_stdio(service: ScoreService, reader: TextIO, writer: TextIO) -> None:
+    # Runs until the parent closes stdin
+    for line in reader:
+        if line.strip():
+            writer.write(service.handle_line(line) + "\n")
+            writer.flush()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        # A connection may send any number of requests, one per line
+        for line in self.rfile:
+            if line.strip():
+                self.wfile.write(self.server.service.handle_line(line.decode('utf-8', 'replace')).encode('utf-8') + b"\n")
+                self.wfile.flush()
+
+class SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def remove_stale_socket(socket_path: str) -> None:
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        # Nobody listens, so it is left over from a server that did not shut down cleanly
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    print(f"Another scoring server is already listening on {socket_path}", file=sys.stderr)
+    sys.exit(1)
+
+def interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+def serve_socket(service: ScoreService, socket_path: str) -> None:
+    remove_stale_socket(socket_path)
+    server = SocketServer(socket_path, RequestHandler)
+    server.service = service
+    # SIGTERM shuts down as cleanly as Ctrl-C, so the socket file is removed
+    signal.signal(signal.SIGTERM, interrupt)
+    print(f"Scoring server listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the scorers loaded and score commit messages on request (JSON lines).')
+    parser.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket instead of serving stdin/stdout.')
+    parser.add_argument('--batch-size', type=int, default=256, help='Messages per spaCy batch.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of scorers run in parallel.')
+    parser.add_argument('--score-cache-size', type=int, default=100000, help='Distinct messages whose scores are kept in memory.')
+    parser.add_argument('--max-engines', type=int, default=8, help='Scorer combinations kept loaded at once; the least recently used is closed.')
+    parser.add_argument('--no-warm-up', action='store_true', help='Load spaCy on the first request instead of at startup.')
+
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.socket and not hasattr(socket, "AF_UNIX"):
+        parser.error("Unix sockets are not available on this platform; use stdin/stdout")
+
+    service = ScoreService(args.batch_size, args.workers, args.score_cache_size, args.max_engines)
+    with instrumented_from_args(args) as report:
+        if not args.no_warm_up:
+            service.warm_up()
+        try:
+            if args.socket:
+                serve_socket(service, args.socket)
+            else:
+                serve_stdio(service, sys.stdin, sys.stdout)
+        finally:
+            service.close()
+            report.update({"requests": service.requests, "messages": service.messages})
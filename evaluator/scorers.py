@@ -0,0 +1,248 @@
+import os
+import re
+import sys
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import count, timer
+
+# A scorer maps a MessageBatch, plus the columns of the scorers it depends on, to one float
+# per message (NaN where it does not apply). Stored scorers get human_<name> and ai_<name>
+# columns in the evaluated table; the others are intermediate results.
+Scorer = namedtuple("Scorer", ["name", "func", "depends", "stored"])
+
+SCORERS: Dict[str, Scorer] = {}
+
+def register_scorer(name: str, depends: Sequence[str] = (), stored: bool = False) -> Callable:
+    def decorator(func):
+        SCORERS[name] = Scorer(name, func, tuple(depends), stored)
+        return func
+    return decorator
+
+def stored_metrics() -> List[str]:
+    return [name for name, scorer in SCORERS.items() if scorer.stored]
+
+def parse_commit_message(message: str) -> Optional[Dict[str, str]]:
+    pattern = r'^(?P<type>\w+)(\((?P<scope>.+)\))?:\s(?P<message>[^\r\n]*)(?P<body>(?:\r?\n){2}[\s\S]*)?'
+    match = re.match(pattern, message)
+
+    if match:
+        return match.groupdict()
+    else:
+        return None
+
+# spaCy and its model take seconds to import and load, so they are only loaded once a
+# message is actually scored; --reset and the other cheap paths never pay for them.
+# Only the tagger and parser feed the POS score; NER and lemmatization are never used.
+_nlp = None
+_nlp_lock = threading.Lock()
+
+def get_nlp():
+    global _nlp
+    with _nlp_lock:
+        if _nlp is None:
+            import spacy
+            with timer("spacy.load"):
+                _nlp = spacy.load('en_core_web_sm', disable=['ner', 'lemmatizer'])
+    return _nlp
+
+def score_pos(doc) -> float:
+    is_present_tense = False
+    has_subject = False
+    has_verb = False
+    has_object = False
+
+    for token in doc:
+        if token.tag_ in {"VB", "VBP", "VBZ", "VBG"}:
+            is_present_tense = True
+        if token.dep_ == "nsubj":
+            has_subject = True
+        if token.pos_ == "VERB":
+            has_verb = True
+        if token.dep_ in {"dobj", "attr"}:
+            has_object = True
+
+    sentence_structure_score = 1.0 if has_subject and has_verb and has_object else 0.0
+    tense_score = 1.0 if is_present_tense else 0.0
+
+    combined_score = (sentence_structure_score + tense_score) / 2
+    return combined_score
+
+def evaluate_flesch(message: str) -> float:
+    import textstat
+    score = textstat.flesch_reading_ease(message)
+    normalized_score = max(0, min(1, (score - 0) / (65 - 0)))
+    return normalized_score
+
+class MessageBatch:
+    def __init__(self, messages: Sequence[str], batch_size: int = 256, n_process: int = 1):
+        self.messages = list(messages)
+        self.parsed = [parse_commit_message(message) for message in self.messages]
+        self.is_parsed = np.array([parsed is not None for parsed in self.parsed], dtype=bool)
+        # The description of a conventional commit, or the first line of any other message
+        self.subjects = [parsed['message'] if parsed else message.split('\n', 1)[0].strip()
+                         for message, parsed in zip(self.messages, self.parsed)]
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self._docs = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def subject_docs(self) -> List[Optional[object]]:
+        # Parsed once per batch and shared by every scorer that needs spaCy
+        with self._lock:
+            if self._docs is None:
+                subjects = [subject for subject, parsed in zip(self.subjects, self.is_parsed) if parsed]
+                with timer("spacy.pipe"):
+                    docs = iter(list(get_nlp().pipe(subjects, batch_size=self.batch_size, n_process=self.n_process)))
+                self._docs = [next(docs) if parsed else None for parsed in self.is_parsed]
+                count("spacy.texts", len(subjects))
+        return self._docs
+
+@register_scorer("adherence", stored=True)
+def adherence(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    return batch.is_parsed.astype(float)
+
+@register_scorer("pos")
+def pos(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    return np.array([score_pos(doc) if doc is not None else np.nan for doc in batch.subject_docs()], dtype=float)
+
+@register_scorer("flesch")
+def flesch(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    texts = [(parsed['body'] or parsed['message']) if parsed else message
+             for message, parsed in zip(batch.messages, batch.parsed)]
+    # textstat works on one text at a time, so at least score repeated texts only once
+    unique = {text: evaluate_flesch(text) for text in dict.fromkeys(texts)}
+    return np.array([unique[text] for text in texts], dtype=float)
+
+@register_scorer("readability", depends=("pos", "flesch"), stored=True)
+def readability(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    return np.where(batch.is_parsed, (scores["pos"] + scores["flesch"]) / 2, scores["flesch"])
+
+@register_scorer("subject_length", stored=True)
+def subject_length(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    first_lines = pd.Series(batch.messages, dtype=object).str.split('\n', n=1).str[0].str.rstrip()
+    return first_lines.str.len().to_numpy(dtype=float)
+
+# "Fixed", "Fixing" and "Fixes" are not imperative; "Fix", "Address" and "Focus" are
+NON_IMPERATIVE = r"^(?:\w+(?:ed|ing)|\w*[^su]s)$"
+IMPERATIVE_EXCEPTIONS = {"bring", "embed", "exceed", "feed", "need", "proceed", "seed", "shed", "speed", "string", "succeed", "alias", "bias"}
+
+@register_scorer("imperative", stored=True)
+def imperative(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    first_words = pd.Series(batch.subjects, dtype=object).str.extract(r"^\W*([A-Za-z]+)", expand=False).str.lower()
+    result = (~first_words.str.match(NON_IMPERATIVE, na=True) | first_words.isin(IMPERATIVE_EXCEPTIONS)).astype(float)
+    return np.where(first_words.isna(), np.nan, result)
+
+CONVENTIONAL_TYPES = {"feat", "fix", "docs", "style", "refactor", "perf", "test", "build", "ci", "chore", "revert"}
+SCOPE_PATTERN = re.compile(r"[\w\-./ ]+")
+
+@register_scorer("conventional_type", stored=True)
+def conventional_type(batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+    # Adherence only checks the shape; this also checks the type and scope themselves
+    return np.array([
+        1.0 if parsed and parsed['type'] in CONVENTIONAL_TYPES
+        and (parsed['scope'] is None or SCOPE_PATTERN.fullmatch(parsed['scope'])) else 0.0
+        for parsed in batch.parsed
+    ], dtype=float)
+
+def scorer_levels(names: Sequence[str]) -> List[List[str]]:
+    # Groups the scorers and their dependencies so that each group only depends on earlier ones
+    depth: Dict[str, int] = {}
+
+    def visit(name: str, path: tuple = ()) -> int:
+        if name in path:
+            raise ValueError(f"Circular scorer dependency: {' -> '.join(path + (name,))}")
+        if name not in SCORERS:
+            raise ValueError(f"Unknown scorer {name!r}")
+        if name not in depth:
+            depth[name] = 1 + max((visit(dep, path + (name,)) for dep in SCORERS[name].depends), default=-1)
+        return depth[name]
+
+    for name in names:
+        visit(name)
+    levels: List[List[str]] = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+    for name, level in depth.items():
+        levels[level].append(name)
+    return levels
+
+def message_digest(message: str) -> bytes:
+    return hashlib.sha256(message.encode('utf-8', 'replace')).digest()
+
+class ScoringEngine:
+    def __init__(self, names: Optional[Sequence[str]] = None, batch_size: int = 256, n_process: int = 1,
+                 workers: int = 4, cache_size: int = 100000):
+        self.levels = scorer_levels(list(names) if names is not None else list(SCORERS))
+        self.columns = [name for level in self.levels for name in level]
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _call(name: str, batch: MessageBatch, scores: Dict[str, np.ndarray]) -> np.ndarray:
+        with timer(f"scorer.{name}"):
+            return SCORERS[name].func(batch, scores)
+
+    def _run(self, messages: List[str]) -> np.ndarray:
+        batch = MessageBatch(messages, self.batch_size, self.n_process)
+        scores: Dict[str, np.ndarray] = {}
+        for level in self.levels:
+            futures = {name: self.executor.submit(self._call, name, batch, scores) for name in level}
+            for name, future in futures.items():
+                scores[name] = np.asarray(future.result(), dtype=float)
+        return np.column_stack([scores[name] for name in self.columns])
+
+    def score(self, messages: Sequence[str]) -> pd.DataFrame:
+        digests = [message_digest(message) for message in messages]
+        values = np.empty((len(digests), len(self.columns)), dtype=float)
+
+        # Only messages not seen before are scored, each of them once
+        missing: Dict[bytes, str] = {}
+        for digest, message in zip(digests, messages):
+            if digest not in self.cache and digest not in missing:
+                missing[digest] = message
+        self.misses += len(missing)
+        self.hits += len(digests) - len(missing)
+        count("scorer_cache.misses", len(missing))
+        count("scorer_cache.hits", len(digests) - len(missing))
+        fresh = dict(zip(missing, self._run(list(missing.values())))) if missing else {}
+
+        for i, digest in enumerate(digests):
+            row = fresh.get(digest)
+            if row is None:
+                row = self.cache[digest]
+                self.cache.move_to_end(digest)
+            values[i] = row
+
+        for digest, row in fresh.items():
+            self.cache[digest] = row
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return pd.DataFrame(values, columns=self.columns)
+
+    def warm_up(self) -> None:
+        # Loads spaCy and textstat before the first real message, without touching the cache
+        self._run(["feat(scorers): load the models up front\n\nScoring a sample imports everything the scorers need."])
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
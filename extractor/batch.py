@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import argparse
+from multiprocessing import Pool
+from typing import List, Tuple
+from tqdm import tqdm
+from extractor import extract_repository
+
+def read_manifest(manifest_path: str) -> List[str]:
+    repo_paths = []
+    with open(manifest_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            repo_paths.append(os.path.expanduser(line))
+    return repo_paths
+
+def shard_name(repo_path: str) -> str:
+    name = os.path.basename(os.path.normpath(repo_path))
+    return name[:-len(".git")] if name.endswith(".git") else name
+
+def assign_shards(repo_paths: List[str], output_dir: str) -> List[Tuple[str, str]]:
+    jobs = []
+    used_names = set()
+    for repo_path in repo_paths:
+        name = shard_name(repo_path)
+        candidate, suffix = name, 1
+        while candidate in used_names:
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        used_names.add(candidate)
+        jobs.append((repo_path, os.path.join(output_dir, f"{candidate}.db")))
+    return jobs
+
+def extract_worker(job):
+    repo_path, database_file, options = job
+    start = time.perf_counter()
+    try:
+        commit_count = extract_repository(repo_path, database_file, **options)
+        error = None
+    except Exception as e:
+        commit_count = 0
+        error = str(e)
+    return repo_path, database_file, commit_count, time.perf_counter() - start, error
+
+def main(manifest_path: str, output_dir: str, workers: int, options: dict):
+    repo_paths = read_manifest(manifest_path)
+    missing = [path for path in repo_paths if not os.path.isdir(path)]
+    if missing:
+        print(f"Repositories not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(repo_path, database_file, options) for repo_path, database_file in assign_shards(repo_paths, output_dir)]
+
+    start = time.perf_counter()
+    total_commits = 0
+    failures = []
+    with Pool(processes=workers) as pool:
+        for repo_path, database_file, commit_count, elapsed, error in tqdm(pool.imap_unordered(extract_worker, jobs), total=len(jobs), desc="Extracting repositories", ncols=100):
+            if error:
+                failures.append((repo_path, error))
+                tqdm.write(f"{repo_path}: failed ({error})")
+                continue
+            total_commits += commit_count
+            tqdm.write(f"{repo_path}: {commit_count} new commits in {elapsed:.2f}s -> {database_file}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Extracted {total_commits} new commits from {len(jobs) - len(failures)}/{len(jobs)} repositories in {elapsed:.2f}s ({total_commits / max(elapsed, 1e-9):.1f} commits/s)")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract many local repositories in parallel into per-repository databases.')
+    parser.add_argument('manifest', type=str, help='File listing one local (optionally bare) repository path per line.')
+    parser.add_argument('-o', '--output-dir', type=str, default='.', help='Directory receiving one <repo_name>.db shard per repository.')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+    parser.add_argument('--flush-interval', type=float, default=1000, help='Maximum milliseconds between transactions.')
+    parser.add_argument('--synchronous', type=str, default='NORMAL', help='SQLite synchronous pragma (OFF, NORMAL, FULL, EXTRA).')
+    parser.add_argument('--cache-size', type=int, default=65536, help='SQLite page cache size in KiB.')
+    parser.add_argument('--full', action='store_true', help='Walk the whole history instead of resuming after the last processed commit.')
+    parser.add_argument('--no-index', action='store_true', help='Do not parse the new diffs into the diff index tables.')
+    args = parser.parse_args()
+
+    options = {
+        'batch_size': args.batch_size,
+        'flush_interval': args.flush_interval,
+        'synchronous': args.synchronous,
+        'cache_size': args.cache_size,
+        'full': args.full,
+        'index': not args.no_index,
+    }
+    main(args.manifest, args.output_dir, args.workers, options)
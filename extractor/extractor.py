@@ -1,12 +1,17 @@
-import sqlite3
 import os
 import sys
+import argparse
 from git import Repo
-from git import Git
 from tqdm import tqdm
+from history import count_commits, iter_history, resolve_commit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.db_writer import BatchWriter, connect
+from common.diff_index import index_diffs
+from common.instrumentation import add_arguments, count, instrumented_from_args, timed_iter, timer
 
 def is_bot_commit(commit):
-    author_name = commit.author.name.lower()
+    author_name = commit.author_name.lower()
     message = commit.message.lower()
     return (
         "bot" in author_name
@@ -18,52 +23,116 @@ def clone_repository(repo_url, local_path):
     if not os.path.exists(local_path):
         Repo.clone_from(repo_url, local_path)
     repo = Repo(local_path)
+    if not repo.bare and "origin" in [remote.name for remote in repo.remotes]:
+        repo.remotes.origin.pull()
     return repo
 
-def init_database(database_file):
-    conn = sqlite3.connect(database_file)
+def create_unique_index(cursor, table):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (f"idx_{table}_hash",))
+    if cursor.fetchone() is None:
+        # Databases from earlier runs may contain the same commit several times
+        cursor.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY hash)")
+        cursor.execute(f"CREATE UNIQUE INDEX idx_{table}_hash ON {table} (hash)")
+
+def init_database(database_file, synchronous="NORMAL", cache_size_kib=65536):
+    conn = connect(database_file, synchronous=synchronous, cache_size_kib=cache_size_kib)
     cursor = conn.cursor()
     cursor.execute('''CREATE TABLE IF NOT EXISTS commits (hash TEXT, message TEXT, diff TEXT)''')
     cursor.execute('''CREATE TABLE IF NOT EXISTS bot_commits (hash TEXT, message TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS extraction_state (ref TEXT PRIMARY KEY, last_commit TEXT)''')
+    create_unique_index(cursor, "commits")
+    create_unique_index(cursor, "bot_commits")
     conn.commit()
     return conn
 
-def save_commit_data(conn, commit_hash, message, diff, is_bot=False):
+def get_last_commit(conn, ref="HEAD"):
     cursor = conn.cursor()
+    cursor.execute("SELECT last_commit FROM extraction_state WHERE ref = ?", (ref,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def set_last_commit(conn, commit_hash, ref="HEAD"):
+    conn.execute("INSERT OR REPLACE INTO extraction_state (ref, last_commit) VALUES (?, ?)", (ref, commit_hash))
+
+def save_commit_data(writer, commit_hash, message, diff, is_bot=False):
     if is_bot:
-        cursor.execute("INSERT INTO bot_commits (hash, message) VALUES (?, ?)", (commit_hash, message))
+        writer.add("INSERT OR IGNORE INTO bot_commits (hash, message) VALUES (?, ?)", (commit_hash, message))
     else:
-        cursor.execute("INSERT INTO commits (hash, message, diff) VALUES (?, ?, ?)", (commit_hash, message, diff))
-    conn.commit()
+        writer.add("INSERT OR IGNORE INTO commits (hash, message, diff) VALUES (?, ?, ?)", (commit_hash, message, diff))
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python script.py <repository_url>")
-        sys.exit(1)
+def extract_repository(local_path, database_file, batch_size=1000, flush_interval=1000,
+                       synchronous="NORMAL", cache_size=65536, full=False, show_progress=False, index=True):
+    conn = init_database(database_file, synchronous, cache_size)
 
-    repo_url = sys.argv[1]
-    repo_name = repo_url.split("/")[-1].split(".")[0]
-    local_path = repo_name
-    database_file = f"{repo_name}.db"
+    # Only walk commits that are not reachable from the last processed one. The mark
+    # may be gone after a force push and gc, in which case everything is walked again
+    # and the unique index skips the known commits.
+    last_commit = None if full else get_last_commit(conn)
+    if last_commit is not None and resolve_commit(local_path, last_commit) is None:
+        last_commit = None
+    revision = f"{last_commit}..HEAD" if last_commit else "HEAD"
 
-    repo = clone_repository(repo_url, local_path)
-    conn = init_database(database_file)
-    git = Git(local_path)
+    progress_bar = None
+    if show_progress:
+        progress_bar = tqdm(total=count_commits(local_path, revision), desc="Processing commits", ncols=100)
 
-    commit_count = len(list(repo.iter_commits()))
-    progress_bar = tqdm(total=commit_count, desc="Processing commits", ncols=100)
+    # The walk runs oldest first, so the newest flushed commit is always a safe point
+    # to resume from after an interruption. It is stored in the same transaction.
+    last_processed = None
+    def record_progress(connection):
+        if last_processed is not None:
+            set_last_commit(connection, last_processed)
 
-    for commit in repo.iter_commits():
-        commit_hash = commit.hexsha
-        message = commit.message.strip()
-        is_bot = is_bot_commit(commit)
-        # diff = git.diff(commit.parents[0].hexsha, commit.hexsha) if commit.parents else git.diff(commit.hexsha)
-        diff = (git.diff(commit.parents[0].hexsha, commit.hexsha) if commit.parents else git.diff(commit.hexsha)).encode('utf-8', 'replace').decode('utf-8')
-        save_commit_data(conn, commit_hash, message, diff, is_bot)
-        progress_bar.update(1)
+    commit_count = 0
 
-    progress_bar.close()
+    # One streamed `git log --patch` instead of a `git diff` process per commit
+    with BatchWriter(conn, batch_size, flush_interval, on_flush=record_progress) as writer:
+        for commit in timed_iter(iter_history(local_path, revision, reverse=True), "git.log_patch"):
+            count("git.diff_bytes", len(commit.diff))
+            is_bot = is_bot_commit(commit)
+            count("extractor.bot_commits" if is_bot else "extractor.commits")
+            save_commit_data(writer, commit.hash, commit.message.strip(), commit.diff, is_bot)
+            # Only once the row is queued, so an interrupt cannot mark a commit that was never written
+            last_processed = commit.hash
+            commit_count += 1
+            if progress_bar is not None:
+                progress_bar.update(1)
+
+    if progress_bar is not None:
+        progress_bar.close()
+
+    # Parses the diffs of the commits that are not indexed yet
+    if index:
+        with timer("diff_index"):
+            index_diffs(conn)
     conn.close()
+    return commit_count
+
+def main(repo_url, batch_size, flush_interval, synchronous, cache_size, full, index, report=None):
+    repo_name = repo_url.split("/")[-1].split(".")[0]
+    local_path = repo_name
+    database_file = f"{repo_name}.db"
+
+    with timer("git.clone_or_pull"):
+        clone_repository(repo_url, local_path)
+    commit_count = extract_repository(local_path, database_file, batch_size, flush_interval, synchronous, cache_size,
+                                      full, show_progress=True, index=index)
+    print(f"Processed {commit_count} new commits")
+    if report is not None:
+        report["commits_processed"] = commit_count
+        report["database_bytes"] = os.path.getsize(database_file)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Extract the commit history of a repository into an SQLite database.')
+    parser.add_argument('repository_url', type=str, help='URL or local path of the repository to extract.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+    parser.add_argument('--flush-interval', type=float, default=1000, help='Maximum milliseconds between transactions.')
+    parser.add_argument('--synchronous', type=str, default='NORMAL', help='SQLite synchronous pragma (OFF, NORMAL, FULL, EXTRA).')
+    parser.add_argument('--cache-size', type=int, default=65536, help='SQLite page cache size in KiB.')
+    parser.add_argument('--full', action='store_true', help='Walk the whole history instead of resuming after the last processed commit.')
+    parser.add_argument('--no-index', action='store_true', help='Do not parse the new diffs into the diff index tables.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_from_args(args) as report:
+        main(args.repository_url, args.batch_size, args.flush_interval, args.synchronous, args.cache_size, args.full, not args.no_index, report)
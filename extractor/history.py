@@ -0,0 +1,92 @@
+import subprocess
+from collections import namedtuple
+from typing import Iterator, List, Optional
+
+# Every commit header starts with RS and the raw message is terminated by GS, so the
+# header can be told apart from patch lines (which always carry a diff prefix).
+RECORD_START = b"\x1e"
+FIELD_SEP = b"\x1f"
+MESSAGE_END = b"\x1d"
+LOG_FORMAT = "%x1e%H%x1f%an%x1f%B%x1d"
+
+CommitRecord = namedtuple("CommitRecord", ["hash", "author_name", "message", "diff"])
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", "replace")
+
+def log_command(repo_path: str, revision: str = "HEAD", reverse: bool = False) -> List[str]:
+    command = [
+        "git", "-C", repo_path,
+        "-c", "core.quotepath=off",
+        "log", revision,
+        "--patch", "--root", "--diff-merges=first-parent",
+        "--no-color", "--no-ext-diff", "--no-textconv",
+        f"--format={LOG_FORMAT}",
+    ]
+    if reverse:
+        # Oldest first with every parent before its children, so any processed
+        # commit is a valid resume point
+        command += ["--reverse", "--topo-order"]
+    return command
+
+def count_commits(repo_path: str, revision: str = "HEAD") -> int:
+    output = subprocess.check_output(["git", "-C", repo_path, "rev-list", "--count", revision])
+    return int(output.strip())
+
+def resolve_commit(repo_path: str, revision: str) -> Optional[str]:
+    result = subprocess.run(["git", "-C", repo_path, "rev-parse", "--verify", "--quiet", f"{revision}^{{commit}}"],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode().strip()
+
+def _build_record(header: bytes, patch: List[bytes]) -> CommitRecord:
+    commit_hash, author_name, message = header[len(RECORD_START):].split(FIELD_SEP, 2)
+    message = message.rstrip(b"\n")
+    if message.endswith(MESSAGE_END):
+        message = message[:-len(MESSAGE_END)]
+
+    # git emits a blank line between the header and the patch; the legacy
+    # `git diff` output had no trailing newline either.
+    diff = b"".join(patch)
+    if diff.startswith(b"\n"):
+        diff = diff[1:]
+    diff = diff.rstrip(b"\n")
+
+    return CommitRecord(_decode(commit_hash), _decode(author_name), _decode(message), _decode(diff))
+
+def parse_log_stream(lines) -> Iterator[CommitRecord]:
+    header: Optional[bytes] = None
+    header_done = False
+    patch: List[bytes] = []
+
+    for line in lines:
+        if line.startswith(RECORD_START):
+            if header is not None:
+                yield _build_record(header, patch)
+            header = line
+            header_done = MESSAGE_END in line
+            patch = []
+        elif header is None:
+            continue
+        elif not header_done:
+            header += line
+            header_done = MESSAGE_END in line
+        else:
+            patch.append(line)
+
+    if header is not None:
+        yield _build_record(header, patch)
+
+def iter_history(repo_path: str, revision: str = "HEAD", reverse: bool = False) -> Iterator[CommitRecord]:
+    process = subprocess.Popen(log_command(repo_path, revision, reverse), stdout=subprocess.PIPE, bufsize=1 << 20)
+    try:
+        yield from parse_log_stream(process.stdout)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.terminate()
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, process.args)
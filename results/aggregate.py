@@ -0,0 +1,250 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import queue
+import sqlite3
+import argparse
+import pathlib
+import multiprocessing
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+from tqdm import tqdm
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.diff_store import diff_sql
+
+TABLES = ("evaluated", "commits", "ai_commits_one_shot")
+# Bookkeeping columns that mean nothing outside their shard
+SKIPPED_COLUMNS = {"diff_hash"}
+
+def find_shards(paths: List[str]) -> List[str]:
+    shards = []
+    for path in paths:
+        if os.path.isdir(path):
+            shards.extend(sorted(glob.glob(os.path.join(path, "*.db"))))
+        else:
+            shards.append(path)
+    return shards
+
+def assign_repos(shards: List[str]) -> List[Tuple[str, str]]:
+    # Same naming as extractor/batch.py: the file name, with _2, _3, ... on collisions
+    named = []
+    used_names = set()
+    for path in shards:
+        name = os.path.splitext(os.path.basename(path))[0]
+        candidate, suffix = name, 1
+        while candidate in used_names:
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        used_names.add(candidate)
+        named.append((path, candidate))
+    return named
+
+def open_read_only(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(pathlib.Path(path).absolute().as_uri() + "?mode=ro", uri=True)
+
+def column_type(declared: str) -> str:
+    # SQLite type affinity rules, reduced to the types the export distinguishes
+    declared = declared.upper()
+    if "INT" in declared:
+        return "integer"
+    if any(name in declared for name in ("CHAR", "CLOB", "TEXT")):
+        return "text"
+    if "BLOB" in declared:
+        return "blob"
+    if any(name in declared for name in ("REAL", "FLOA", "DOUB")):
+        return "real"
+    return "text"
+
+def merge_types(first: str, second: str) -> str:
+    if first == second:
+        return first
+    if {first, second} == {"integer", "real"}:
+        return "real"
+    return "text"
+
+def union_schemas(shards: List[str], tables: List[str], with_diffs: bool) -> Tuple[Dict[str, Dict[str, str]], Dict[str, List[str]]]:
+    # Shards written by different versions have different columns; missing ones are exported as NULL
+    schemas: Dict[str, Dict[str, str]] = {table: {"repo": "text"} for table in tables}
+    present: Dict[str, List[str]] = {table: [] for table in tables}
+    for path in shards:
+        conn = open_read_only(path)
+        for table in tables:
+            columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            if not columns:
+                continue
+            present[table].append(path)
+            for _, name, declared, *_ in columns:
+                if name in SKIPPED_COLUMNS or (table == "commits" and name == "diff" and not with_diffs):
+                    continue
+                kind = column_type(declared or "")
+                schemas[table][name] = merge_types(schemas[table][name], kind) if name in schemas[table] else kind
+        conn.close()
+    return schemas, present
+
+_queue = None
+
+def init_worker(message_queue) -> None:
+    global _queue
+    _queue = message_queue
+
+def read_shard(task) -> None:
+    # Streams one table of one shard to the writer in chunks; the bounded queue keeps memory flat
+    path, repo, table, columns, chunk_size = task
+    rows_read = 0
+    try:
+        conn = open_read_only(path)
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        join = ""
+        expressions = []
+        for column in columns[1:]:
+            if table == "commits" and column == "diff":
+                expression, join = diff_sql(conn, "commits")
+                expressions.append(expression)
+            elif column in existing:
+                expressions.append(f"{table}.{column}")
+            else:
+                expressions.append("NULL")
+        cursor = conn.execute(f"SELECT {', '.join(expressions)} FROM {table} {join}")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            _queue.put(("rows", table, repo, rows))
+            rows_read += len(rows)
+        conn.close()
+        _queue.put(("done", table, path, rows_read, None))
+    except Exception as error:
+        _queue.put(("done", table, path, rows_read, str(error)))
+
+ARROW_TYPES = {"integer": "int64", "real": "float64", "text": "string", "blob": "binary"}
+
+class ParquetSink:
+    def __init__(self, path: str, schema: Dict[str, str], row_group_size: int):
+        self.columns = list(schema)
+        self.schema = pa.schema([(name, getattr(pa, ARROW_TYPES[kind])()) for name, kind in schema.items()])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self.row_group_size = row_group_size
+        self._buffer: List[Tuple[str, List[tuple]]] = []
+        self._buffered = 0
+        self.rows_written = 0
+
+    def write(self, repo: str, rows: List[tuple]) -> None:
+        # Small shards are buffered so that row groups do not end up tiny
+        self._buffer.append((repo, rows))
+        self._buffered += len(rows)
+        if self._buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffered:
+            return
+        repos = [repo for repo, rows in self._buffer for _ in range(len(rows))]
+        values = list(zip(*(row for _, rows in self._buffer for row in rows)))
+        arrays = [pa.array(repos, type=pa.string())] + [
+            pa.array(list(column), type=field.type, from_pandas=True) for column, field in zip(values, list(self.schema)[1:])
+        ]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows_written += self._buffered
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+class CsvSink:
+    def __init__(self, path: str, schema: Dict[str, str]):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(list(schema))
+        self.rows_written = 0
+        # The column types go next to the file, e.g. for the dtype argument of pandas.read_csv
+        with open(os.path.splitext(path)[0] + ".schema.json", "w") as file:
+            json.dump(schema, file, indent=2)
+
+    def write(self, repo: str, rows: List[tuple]) -> None:
+        self.writer.writerows((repo,) + row for row in rows)
+        self.rows_written += len(rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+def aggregate(paths: List[str], output_dir: str, tables: List[str], output_format: str, workers: int,
+              chunk_size: int, with_diffs: bool) -> None:
+    shards = find_shards(paths)
+    if not shards:
+        print("No databases found")
+        sys.exit(1)
+    repos = dict(assign_repos(shards))
+
+    start = time.perf_counter()
+    schemas, present = union_schemas(shards, tables, with_diffs)
+    os.makedirs(output_dir, exist_ok=True)
+    sinks = {}
+    for table in tables:
+        path = os.path.join(output_dir, f"{table}.{output_format}")
+        sinks[table] = ParquetSink(path, schemas[table], chunk_size) if output_format == "parquet" else CsvSink(path, schemas[table])
+
+    tasks = [(path, repos[path], table, list(schemas[table]), chunk_size) for table in tables for path in present[table]]
+    failures = []
+    message_queue = multiprocessing.Queue(maxsize=2 * workers)
+    with Pool(processes=workers, initializer=init_worker, initargs=(message_queue,)) as pool, \
+            tqdm(total=len(tasks), desc="Reading shards", unit="table", ncols=100) as progress_bar:
+        result = pool.map_async(read_shard, tasks, chunksize=1)
+        finished = 0
+        # This process is the single writer; workers only read
+        while finished < len(tasks):
+            try:
+                message = message_queue.get(timeout=1.0)
+            except queue.Empty:
+                if result.ready():
+                    result.get()
+                    break
+                continue
+            if message[0] == "rows":
+                _, table, repo, rows = message
+                sinks[table].write(repo, rows)
+                continue
+            _, table, path, _, error = message
+            finished += 1
+            progress_bar.update(1)
+            if error:
+                failures.append((path, table, error))
+                tqdm.write(f"{path}: reading '{table}' failed ({error})")
+
+    for sink in sinks.values():
+        sink.close()
+
+    elapsed = time.perf_counter() - start
+    total_rows = sum(sink.rows_written for sink in sinks.values())
+    for table, sink in sinks.items():
+        print(f"{table}: {sink.rows_written} rows from {len(present[table])} shards -> {os.path.join(output_dir, f'{table}.{output_format}')}")
+    print(f"Aggregated {len(shards)} databases in {elapsed:.2f}s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Merge the tables of many per-repository databases into one columnar export.')
+    parser.add_argument('databases', type=str, nargs='+', help='Database files, or directories whose *.db files are read.')
+    parser.add_argument('-o', '--output-dir', type=str, default='export', help='Directory receiving one file per table.')
+    parser.add_argument('-t', '--tables', type=str, nargs='+', choices=TABLES, default=list(TABLES), help='Tables to export.')
+    parser.add_argument('-f', '--format', choices=['parquet', 'csv'], default='parquet' if pa else 'csv',
+                        help='Parquet needs pyarrow; CSV gets a .schema.json with the column types.')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='Number of reader processes.')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per chunk read from a shard and per Parquet row group.')
+    parser.add_argument('--with-diffs', action='store_true', help='Include the diff column of the commits table.')
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and pa is None:
+        parser.error("Parquet export needs pyarrow; install it or use --format csv")
+    aggregate(args.databases, args.output_dir, args.tables, args.format, args.workers, args.chunk_size, args.with_diffs)
@@ -0,0 +1,360 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+from aggregate import assign_repos, find_shards, open_read_only
+
+# Headless version of viz.ipynb: loads the evaluated scores of any number of databases (or
+# an aggregate.py export) into NumPy arrays, compares human and AI messages metric by metric
+# and renders the figures used in the paper.
+
+SIZE = 17
+METRIC_ORDER = ("overall", "adherence", "readability", "accuracy", "auto_accuracy")
+# Bootstrap and permutation draws are made in batches of at most this many elements
+BATCH_ELEMENTS = 1 << 24
+
+Data = Tuple[Dict[str, np.ndarray], np.ndarray, List[str]]
+
+def read_database(path: str) -> Dict[str, np.ndarray]:
+    conn = open_read_only(path)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(evaluated)") if row[1].startswith(("human_", "ai_"))]
+    if not columns:
+        conn.close()
+        return {}
+    # NULL becomes NaN
+    values = np.array(conn.execute(f"SELECT {', '.join(columns)} FROM evaluated").fetchall(), dtype=float).reshape(-1, len(columns))
+    conn.close()
+    return {column: values[:, index] for index, column in enumerate(columns)}
+
+def read_export(path: str) -> Tuple[Dict[str, np.ndarray], Optional[np.ndarray]]:
+    # evaluated.parquet or evaluated.csv written by aggregate.py; a "repo" column is optional
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        frame = {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+    else:
+        import pandas as pd
+        frame = {name: column.to_numpy() for name, column in pd.read_csv(path).items()}
+    columns = {name: np.asarray(values, dtype=float) for name, values in frame.items() if name.startswith(("human_", "ai_"))}
+    return columns, (np.asarray(frame["repo"], dtype=str) if "repo" in frame else None)
+
+def load(sources: List[str]) -> Data:
+    # Returns the score columns, a repository index per row and the repository names
+    parts: List[Tuple[str, Dict[str, np.ndarray], Optional[np.ndarray]]] = []
+    databases = find_shards([source for source in sources if not source.endswith((".parquet", ".csv"))])
+    for path, repo in assign_repos(databases):
+        parts.append((repo, read_database(path), None))
+    for source in sources:
+        if source.endswith((".parquet", ".csv")):
+            columns, repos = read_export(source)
+            parts.append((os.path.splitext(os.path.basename(source))[0], columns, repos))
+
+    names = sorted({name for _, columns, _ in parts for name in columns})
+    lengths = [len(next(iter(columns.values()))) if columns else 0 for _, columns, _ in parts]
+    data = {name: np.concatenate([columns.get(name, np.full(length, np.nan)) for (_, columns, _), length in zip(parts, lengths)])
+            if parts else np.empty(0) for name in names}
+    labels = np.concatenate([repos if repos is not None else np.full(length, repo, dtype=object)
+                             for (repo, _, repos), length in zip(parts, lengths)]) if parts else np.empty(0, dtype=object)
+    repo_names, repo_index = np.unique(labels.astype(str), return_inverse=True)
+    return data, repo_index, list(repo_names)
+
+def metrics(data: Dict[str, np.ndarray]) -> List[str]:
+    paired = {name[len("human_"):] for name in data if name.startswith("human_") and "ai_" + name[len("human_"):] in data}
+    return [name for name in METRIC_ORDER if name in paired] + sorted(paired - set(METRIC_ORDER))
+
+def batches(total: int, width: int) -> Iterator[Tuple[int, int]]:
+    size = max(1, BATCH_ELEMENTS // max(width, 1))
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+def value_groups(values: np.ndarray, max_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Distinct values and their counts; resampling these is the same as resampling the rows.
+    # Only with max_groups > 0, scores with more distinct values are cut into equal-count
+    # quantile groups represented by their mean. That is faster, but it drops the variance
+    # within each group, so the intervals come out too narrow.
+    group_values, counts = np.unique(values, return_counts=True)
+    if max_groups <= 0 or len(group_values) <= max_groups:
+        return group_values, counts
+    ordered = np.sort(values)
+    bounds = np.linspace(0, len(ordered), max_groups + 1).astype(np.int64)
+    counts = np.diff(bounds)
+    sums = np.add.reduceat(ordered, bounds[:-1][counts > 0])
+    counts = counts[counts > 0]
+    return sums / counts, counts
+
+def is_grouped(values: np.ndarray, max_groups: int) -> bool:
+    return max_groups > 0 and len(np.unique(values)) > max_groups
+
+def group_mean(group_values: np.ndarray, counts: np.ndarray) -> float:
+    # The same summation as a bootstrap resample, so a constant score lies inside its own interval
+    return float(counts @ group_values / counts.sum())
+
+def bootstrap_means(values: np.ndarray, resamples: int, rng: np.random.Generator, max_groups: int) -> np.ndarray:
+    # A resample of n rows is a multinomial draw of group counts; all resamples of a batch are one call
+    group_values, counts = value_groups(values, max_groups)
+    total = int(counts.sum())
+    means = np.empty(resamples)
+    if len(counts) * 8 > total:
+        # Mostly distinct values: drawing row indices is cheaper than a binomial per value
+        for start, stop in batches(resamples, total):
+            means[start:stop] = values[rng.integers(0, total, size=(stop - start, total))].mean(axis=1)
+        return means
+    for start, stop in batches(resamples, len(counts)):
+        means[start:stop] = rng.multinomial(total, counts / total, size=stop - start) @ group_values / total
+    return means
+
+def sign_flip_test(differences: np.ndarray, resamples: int, rng: np.random.Generator, max_groups: int) -> float:
+    # Paired permutation test: without a real difference, each difference is as likely to have
+    # the opposite sign. Within a group, the number of flipped signs is binomial.
+    magnitudes, counts = value_groups(np.abs(differences), max_groups)
+    observed = abs(differences.mean())
+    extreme = 0
+    if len(counts) * 8 > len(differences):
+        # Mostly distinct magnitudes: one random sign per row is cheaper than a binomial per value
+        for start, stop in batches(resamples, len(differences)):
+            signs = rng.integers(0, 2, size=(stop - start, len(differences)), dtype=np.int8) * 2 - 1
+            extreme += int((np.abs(signs @ differences) / len(differences) >= observed - 1e-12).sum())
+        return (extreme + 1) / (resamples + 1)
+    for start, stop in batches(resamples, len(counts)):
+        positive = rng.binomial(counts, 0.5, size=(stop - start, len(counts)))
+        permuted = np.abs((2 * positive - counts) @ magnitudes) / len(differences)
+        extreme += int((permuted >= observed - 1e-12).sum())
+    return (extreme + 1) / (resamples + 1)
+
+def interval(means: np.ndarray, confidence: float) -> Tuple[float, float]:
+    low, high = np.percentile(means, [50 * (1 - confidence), 50 * (1 + confidence)])
+    return float(low), float(high)
+
+def summarize(human: np.ndarray, ai: np.ndarray, resamples: int, confidence: float, rng: np.random.Generator,
+              max_groups: int) -> Dict[str, float]:
+    row: Dict[str, float] = {}
+    grouped = False
+    for prefix, values in (("human", human), ("ai", ai)):
+        values = values[~np.isnan(values)]
+        grouped = grouped or is_grouped(values, max_groups)
+        row[f"{prefix}_n"] = len(values)
+        row[f"{prefix}_mean"] = group_mean(*value_groups(values, 0)) if len(values) else np.nan
+        row[f"{prefix}_median"] = float(np.median(values)) if len(values) else np.nan
+        row[f"{prefix}_std"] = float(values.std(ddof=1)) if len(values) > 1 else np.nan
+        row[f"{prefix}_low"], row[f"{prefix}_high"] = (interval(bootstrap_means(values, resamples, rng, max_groups), confidence)
+                                                       if len(values) else (np.nan, np.nan))
+
+    # Human and AI messages describe the same commits, so the comparison is paired
+    paired = ~np.isnan(human) & ~np.isnan(ai)
+    differences = ai[paired] - human[paired]
+    row["pairs"] = len(differences)
+    if len(differences):
+        grouped = grouped or is_grouped(differences, max_groups)
+        row["difference"] = group_mean(*value_groups(differences, 0))
+        row["difference_low"], row["difference_high"] = interval(bootstrap_means(differences, resamples, rng, max_groups), confidence)
+        spread = differences.std(ddof=1) if len(differences) > 1 else 0.0
+        # A constant difference has a spread of rounding error, not an effect size
+        constant = np.isclose(spread, 0, rtol=0, atol=1e-12 * max(1.0, abs(row["difference"])))
+        row["effect_size"] = np.nan if constant else float(row["difference"] / spread)
+        row["p_value"] = sign_flip_test(differences, resamples, rng, max_groups)
+    else:
+        row.update({"difference": np.nan, "difference_low": np.nan, "difference_high": np.nan, "effect_size": np.nan, "p_value": np.nan})
+    # Grouped resampling underestimates the spread; such rows are flagged in every output
+    row["grouped"] = grouped
+    return row
+
+def summary_table(data: Dict[str, np.ndarray], names: List[str], resamples: int, confidence: float, seed: int,
+                  max_groups: int) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    return [{"metric": name, **summarize(data[f"human_{name}"], data[f"ai_{name}"], resamples, confidence, rng, max_groups)}
+            for name in names]
+
+def repo_table(data: Dict[str, np.ndarray], repo_index: np.ndarray, repo_names: List[str], names: List[str], resamples: int,
+               confidence: float, seed: int, max_groups: int) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    order = np.argsort(repo_index, kind="stable")
+    bounds = np.searchsorted(repo_index[order], np.arange(len(repo_names) + 1))
+    rows = []
+    for index, repo in enumerate(repo_names):
+        rows_of_repo = order[bounds[index]:bounds[index + 1]]
+        for name in names:
+            row = summarize(data[f"human_{name}"][rows_of_repo], data[f"ai_{name}"][rows_of_repo], resamples, confidence, rng, max_groups)
+            rows.append({"repo": repo, "metric": name, **row})
+    return rows
+
+def write_csv(rows: List[Dict], path: str) -> None:
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def format_p(p: float) -> str:
+    return "-" if p != p else ("< 0.001" if p < 0.001 else f"{p:.3f}")
+
+def write_markdown(rows: List[Dict], path: str, confidence: float) -> None:
+    level = f"{confidence * 100:g}%"
+    with open(path, "w") as file:
+        file.write(f"| Metric | Human mean [{level} CI] | AI mean [{level} CI] | AI − human [{level} CI] | Pairs | p |\n")
+        file.write("|---|---|---|---|---|---|\n")
+        for row in rows:
+            file.write(f"| {row['metric']} "
+                       f"| {row['human_mean']:.3f} [{row['human_low']:.3f}, {row['human_high']:.3f}] "
+                       f"| {row['ai_mean']:.3f} [{row['ai_low']:.3f}, {row['ai_high']:.3f}] "
+                       f"| {row['difference']:+.3f} [{row['difference_low']:+.3f}, {row['difference_high']:+.3f}] "
+                       f"| {row['pairs']} | {format_p(row['p_value'])}{' *' if row['grouped'] else ''} |\n")
+        if any(row["grouped"] for row in rows):
+            file.write("\n\\* Resampled in quantile groups (--max-groups): the intervals are too narrow and the p-values too small.\n")
+
+def print_table(rows: List[Dict]) -> None:
+    print(f"{'metric':<18} {'human':>7} {'ai':>7} {'ai-human':>9} {'ci':>19} {'pairs':>9} {'p':>8}")
+    for row in rows:
+        ci = f"[{row['difference_low']:+.3f}, {row['difference_high']:+.3f}]"
+        print(f"{row['metric']:<18} {row['human_mean']:>7.3f} {row['ai_mean']:>7.3f} {row['difference']:>+9.3f} {ci:>19} "
+              f"{row['pairs']:>9} {format_p(row['p_value']):>8}{' *' if row['grouped'] else ''}")
+    if any(row["grouped"] for row in rows):
+        print("* resampled in quantile groups (--max-groups): intervals too narrow, p-values too small")
+
+def histogram_edges(values: np.ndarray) -> np.ndarray:
+    # Scores between 0 and 1 share the notebook's 20 bins; anything else (e.g. subject length) is clipped to its bulk
+    if len(values) and values.min() >= 0 and values.max() <= 1:
+        return np.linspace(0, 1, 21)
+    low, high = np.percentile(values, [0.5, 99.5]) if len(values) else (0, 1)
+    return np.histogram_bin_edges(values, bins=50, range=(low, high if high > low else low + 1))
+
+def plot_histogram(human: np.ndarray, ai: np.ndarray, name: str, path: str) -> None:
+    human, ai = human[~np.isnan(human)], ai[~np.isnan(ai)]
+    edges = histogram_edges(np.concatenate([human, ai]))
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for label, values in (("Human", human), ("AI", ai)):
+        counts, _ = np.histogram(values, bins=edges)
+        ax.stairs(counts, edges, fill=True, alpha=0.5, label=label)
+    ax.set_xlabel(f"{name.replace('_', ' ').capitalize()} score", fontsize=SIZE)
+    ax.set_ylabel("Count", fontsize=SIZE)
+    ax.tick_params(axis="both", which="major", labelsize=SIZE - 3)
+    ax.legend(fontsize=SIZE - 3)
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+def plot_box(human: np.ndarray, ai: np.ndarray, name: str, path: str) -> None:
+    columns = [human[~np.isnan(human)], ai[~np.isnan(ai)]]
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.boxplot(columns, showfliers=False)
+    ax.set_xticks([1, 2], [f"Human {name.replace('_', ' ')}", f"AI {name.replace('_', ' ')}"], fontsize=SIZE)
+    # Individual points only while they can still be told apart
+    rng = np.random.default_rng(0)
+    for position, values in enumerate(columns, start=1):
+        if 0 < len(values) <= 2000:
+            ax.scatter(position + rng.uniform(-0.08, 0.08, len(values)), values, color="black", alpha=0.3, s=8)
+        if len(values):
+            median = float(np.median(values))
+            ax.text(position, median, f"{median:.3f}", ha="center", va="bottom", fontsize=SIZE - 3,
+                    bbox=dict(facecolor="white", alpha=0.7, linewidth=0))
+    ax.set_ylabel("Values", fontsize=SIZE)
+    ax.tick_params(axis="both", which="major", labelsize=SIZE - 3)
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+def plot_adherence(human: np.ndarray, ai: np.ndarray, path: str) -> None:
+    shares = [100 * float(np.mean(values[~np.isnan(values)] > 0)) if np.any(~np.isnan(values)) else 0.0 for values in (human, ai)]
+    labels = ["Human Adherence", "AI Adherence"]
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.bar(labels, [100 - share for share in shares], label="Does not adhere")
+    ax.bar(labels, shares, bottom=[100 - share for share in shares], label="Adheres")
+    ax.set_ylabel("Share of commits (%)", fontsize=SIZE - 3)
+    ax.legend()
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+def plot_differences(rows: List[Dict], path: str, confidence: float) -> None:
+    # Mean paired difference per metric with its bootstrap interval
+    rows = [row for row in rows if row["difference"] == row["difference"]]
+    fig, ax = plt.subplots(figsize=(8, 1 + 0.6 * len(rows)))
+    positions = np.arange(len(rows))[::-1]
+    differences = np.array([row["difference"] for row in rows])
+    errors = np.array([[row["difference"] - row["difference_low"], row["difference_high"] - row["difference"]] for row in rows]).T.reshape(2, -1)
+    # Rounding can put a zero-width interval a hair beside its mean
+    errors = np.maximum(errors, 0)
+    ax.errorbar(differences, positions, xerr=errors, fmt="o", capsize=4)
+    ax.axvline(0, color="gray", ls="--", lw=1)
+    ax.set_yticks(positions, [row["metric"] for row in rows])
+    ax.set_xlabel(f"AI − human (mean, {confidence * 100:g}% CI)")
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+def is_unit_score(data: Dict[str, np.ndarray], name: str) -> bool:
+    values = np.concatenate([data[f"human_{name}"], data[f"ai_{name}"]])
+    values = values[~np.isnan(values)]
+    return len(values) > 0 and values.min() >= 0 and values.max() <= 1
+
+def render_figures(data: Dict[str, np.ndarray], names: List[str], rows: List[Dict], output_dir: str, confidence: float) -> List[str]:
+    paths = []
+    # Differences share one axis, so only the scores between 0 and 1 go into that figure
+    rows = [row for row in rows if is_unit_score(data, row["metric"])]
+    for name in names:
+        human, ai = data[f"human_{name}"], data[f"ai_{name}"]
+        if name == "adherence":
+            paths.append(os.path.join(output_dir, "bar_adherence.png"))
+            plot_adherence(human, ai, paths[-1])
+        else:
+            paths.append(os.path.join(output_dir, f"hist_{name}.png"))
+            plot_histogram(human, ai, name, paths[-1])
+        if name == "overall":
+            paths.append(os.path.join(output_dir, "box_overall.png"))
+            plot_box(human, ai, name, paths[-1])
+    if rows:
+        paths.append(os.path.join(output_dir, "differences.png"))
+        plot_differences(rows, paths[-1], confidence)
+    return paths
+
+def main(sources: List[str], output_dir: str, resamples: int, confidence: float, seed: int, max_groups: int,
+         by_repo: bool, figures: bool) -> None:
+    start = time.perf_counter()
+    data, repo_index, repo_names = load(sources)
+    names = metrics(data)
+    if not names:
+        print("No evaluated scores found; run evaluator.py first")
+        sys.exit(1)
+    rows_loaded = len(repo_index)
+    print(f"Loaded {rows_loaded} rows from {len(repo_names)} repositories in {time.perf_counter() - start:.2f}s")
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    rows = summary_table(data, names, resamples, confidence, seed, max_groups)
+    print(f"Computed {resamples} bootstrap and permutation resamples per metric in {time.perf_counter() - start:.2f}s")
+    print_table(rows)
+    write_csv(rows, os.path.join(output_dir, "summary.csv"))
+    write_markdown(rows, os.path.join(output_dir, "summary.md"), confidence)
+
+    if by_repo:
+        write_csv(repo_table(data, repo_index, repo_names, names, resamples, confidence, seed, max_groups),
+                  os.path.join(output_dir, "by_repo.csv"))
+
+    if figures:
+        paths = render_figures(data, names, rows, output_dir, confidence)
+        print(f"Rendered {len(paths)} figures")
+    print(f"Wrote the report to {output_dir}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize and plot the human and AI scores of evaluated databases.')
+    parser.add_argument('sources', type=str, nargs='+', help='Database files, directories of *.db files, or evaluated.parquet/.csv exports of aggregate.py.')
+    parser.add_argument('-o', '--output-dir', type=str, default='report', help='Directory receiving the tables and figures.')
+    parser.add_argument('-n', '--resamples', type=int, default=10000, help='Bootstrap and permutation resamples per statistic.')
+    parser.add_argument('-c', '--confidence', type=float, default=0.95, help='Level of the bootstrap confidence intervals.')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed of the resampling.')
+    parser.add_argument('--max-groups', type=int, default=0,
+                        help='Resample continuous scores in this many quantile groups instead of row by row: faster, '
+                             'but the intervals come out too narrow. 0 (default) resamples the rows.')
+    parser.add_argument('--by-repo', action='store_true', help='Also write per-repository comparisons to by_repo.csv.')
+    parser.add_argument('--no-figures', action='store_true', help='Only write the tables.')
+    args = parser.parse_args()
+
+    if not args.no_figures and plt is None:
+        parser.error("The figures need matplotlib; install it or pass --no-figures")
+    main(args.sources, args.output_dir, args.resamples, args.confidence, args.seed, args.max_groups, args.by_repo, not args.no_figures)
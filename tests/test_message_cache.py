@@ -0,0 +1,34 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai_commits"))
+from message_cache import cache_key
+
+CONFIG = {"executable": "digest", "args": ["-o"], "token_budget": 1000}
+
+def diff(path="src/app.py", index="index 1111111..2222222 100644", start=10, old="    return compute(value)",
+         new="    return compute(value, strict=True)"):
+    return (f"diff --git a/{path} b/{path}\n"
+            f"{index}\n"
+            f"--- a/{path}\n"
+            f"+++ b/{path}\n"
+            f"@@ -{start},3 +{start},3 @@ def main():\n"
+            " value = read()\n"
+            f"-{old}\n"
+            f"+{new}\n"
+            " log(value)\n")
+
+def test_cherry_pick_shares_the_entry():
+    # Other blob ids and line offsets, as when the change is applied on another branch
+    picked = diff(index="index 3333333..4444444 100644", start=57)
+    assert cache_key(picked, CONFIG) == cache_key(diff(), CONFIG)
+    assert cache_key(picked.replace("\n", "\r\n"), CONFIG) == cache_key(diff(), CONFIG)
+
+def test_revert_and_vendored_copy_do_not():
+    revert = diff(old="    return compute(value, strict=True)", new="    return compute(value)")
+    vendored = diff(path="vendor/app/src/app.py")
+    assert cache_key(revert, CONFIG) != cache_key(diff(), CONFIG)
+    assert cache_key(vendored, CONFIG) != cache_key(diff(), CONFIG)
+
+def test_config_is_part_of_the_key():
+    assert cache_key(diff(), {**CONFIG, "token_budget": 500}) != cache_key(diff(), CONFIG)
@@ -0,0 +1,37 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluator"))
+from overall import INPUT_COLUMNS, update_overall
+
+def evaluated_table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"CREATE TABLE evaluated (hash TEXT PRIMARY KEY, {', '.join(c + ' REAL' for c in INPUT_COLUMNS)}, human_overall REAL, ai_overall REAL)")
+    conn.executemany(f"INSERT INTO evaluated VALUES (?, {', '.join('?' for _ in INPUT_COLUMNS)}, NULL, NULL)", [
+        ("a", 0.3, 0.6, 0.9, 0.6, 0.6, 0.6),
+        ("b", 0.3, 0.6, None, 0.6, 0.6, 0.6),
+    ])
+    return conn
+
+def overall(conn, hash):
+    return conn.execute("SELECT human_overall, ai_overall FROM evaluated WHERE hash = ?", (hash,)).fetchone()
+
+def test_only_changed_rows_are_recomputed():
+    conn = evaluated_table()
+    assert update_overall(conn) == (2, 1)
+    assert overall(conn, "a") == pytest.approx((0.6, 0.6))
+    # A missing component leaves the overall score NULL and is counted
+    assert overall(conn, "b")[0] is None
+    assert update_overall(conn) == (0, 0)
+    conn.execute("UPDATE evaluated SET human_accuracy = 0.3 WHERE hash = 'b'")
+    assert update_overall(conn) == (1, 0)
+    assert overall(conn, "b") == pytest.approx((0.4, 0.6))
+
+def test_new_weights_recompute_every_row():
+    conn = evaluated_table()
+    update_overall(conn)
+    assert update_overall(conn, (1, 1, 0)) == (2, 0)
+    assert overall(conn, "a") == pytest.approx((0.45, 0.6))
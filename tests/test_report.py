@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results"))
+import report
+
+def test_constant_difference():
+    # ai - human is the same for every pair, up to rounding
+    rng = np.random.default_rng(0)
+    human = rng.choice([0.1, 0.3, 0.5, 0.7, 0.9], 5000)
+    ai = human - 0.2
+    row = report.summarize(human, ai, 500, 0.95, rng, 0)
+    assert row["difference_low"] <= row["difference"] <= row["difference_high"]
+    assert np.isnan(row["effect_size"])
+    assert not row["grouped"]
+
+def test_constant_difference_figure(tmp_path):
+    rng = np.random.default_rng(0)
+    human = rng.choice([0.1, 0.3, 0.5, 0.7, 0.9], 5000)
+    row = {"metric": "accuracy", **report.summarize(human, human - 0.2, 500, 0.95, rng, 0)}
+    report.plot_differences([row], str(tmp_path / "differences.png"), 0.95)
+    assert (tmp_path / "differences.png").exists()
+
+def test_bootstrap_resamples_rows():
+    # The spread of the bootstrap means matches the standard error of continuous scores
+    rng = np.random.default_rng(1)
+    values = rng.random(20000)
+    means = report.bootstrap_means(values, 2000, rng, 0)
+    standard_error = values.std() / np.sqrt(len(values))
+    assert abs(means.std() / standard_error - 1) < 0.1
+
+def test_grouping_is_flagged():
+    rng = np.random.default_rng(2)
+    row = report.summarize(rng.random(2000), rng.random(2000), 200, 0.95, rng, 50)
+    assert row["grouped"]
@@ -0,0 +1,55 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai_commits"))
+from common.db_writer import BatchWriter
+from generate import prepare_diff
+from trim import create_token_stats_table, trim_diff
+
+# The change sits below a long run of context, so a prefix that fits a small budget has no changes
+CONTEXT = "".join(f" unchanged line number {number} of the module\n" for number in range(40))
+DIFF = ("diff --git a/src/app.py b/src/app.py\n"
+        "index 1111111..2222222 100644\n"
+        "--- a/src/app.py\n"
+        "+++ b/src/app.py\n"
+        "@@ -10,42 +10,42 @@ def main():\n"
+        + CONTEXT +
+        "-    return compute(value)\n"
+        "+    return compute(value, strict=True)\n"
+        " trailing context\n")
+
+def changed_lines(diff):
+    return [line for line in diff.splitlines() if line[:1] in ("+", "-") and not line.startswith(("+++", "---"))]
+
+@pytest.mark.parametrize("budget", [1, 10, 50, 100, 200])
+def test_small_budget_keeps_a_change(budget):
+    trimmed, stats = trim_diff(DIFF, budget)
+    assert changed_lines(trimmed)
+    assert stats.files_kept == 1 and stats.hunks_kept == 1
+    assert stats.trimmed_tokens > 0
+
+def test_dropped_context_moves_the_hunk_start():
+    trimmed, _ = trim_diff(DIFF, 30)
+    header = next(line for line in trimmed.splitlines() if line.startswith("@@"))
+    assert header.startswith("@@ -50,")
+    # A replacement keeps both of its sides
+    assert trimmed.splitlines()[-2:] == ["-    return compute(value)", "+    return compute(value, strict=True)"]
+
+def test_large_budget_keeps_the_diff():
+    trimmed, stats = trim_diff(DIFF, 100000)
+    assert trimmed == DIFF
+    assert stats.original_tokens == stats.trimmed_tokens
+
+def test_empty_diff_is_skipped():
+    conn = sqlite3.connect(":memory:")
+    create_token_stats_table(conn)
+    with BatchWriter(conn, batch_size=10) as writer:
+        _, skipped = prepare_diff(writer, "abc", "", {}, 100)
+        _, kept = prepare_diff(writer, "def", DIFF, {}, 10)
+    assert skipped == "empty diff"
+    assert kept is None
+    rows = dict(conn.execute("SELECT hash, skipped FROM diff_tokens"))
+    assert rows == {"abc": "empty diff", "def": None}